@@ -0,0 +1,407 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.artifact_cache
+ Module Revision: 0.0.1-18
+ Module Description:
+    A content-addressed store of downloaded artifacts (server jars, BE archives...),
+    shared by all the servers. Default directory: ./MCSH/artifacts
+    Artifacts are stored by SHA-256, and placed into server directories as
+    hardlinks (or reflinks, or copies as the last resort) instead of copies.
+    Every placed file is recorded as a reference: artifacts without references
+    are garbage-collected, and evicted (least recently used first) over the byte budget.
+    Besides whole downloads, single files (e.g. the members of a BE archive) can be added
+    from a stream, so that servers share every identical file.
+    The index is shared by the CLI and the daemon: it's changed under a file lock (index.lock),
+    and reloaded first if another process changed it.
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from contextlib import contextmanager
+
+from MCSH.logging import log
+
+MODULE_NAME = "artifact_cache"
+ARTIFACT_CACHE_PATH = "./MCSH/artifacts"
+ARTIFACT_CACHE_MAX_BYTES = 4 * 1024 ** 3
+# ioctl FICLONE (Linux): make a reflink (copy-on-write clone) of a file
+FICLONE = 0x40049409
+# Artifacts used within this many seconds are never evicted or collected,
+# so a download isn't removed before the job that fetched it places it
+ARTIFACT_GRACE_PERIOD = 3600
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path, algorithm="sha256"):
+    """
+    Hash a file without reading it into memory.
+    """
+    hash_object = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            hash_object.update(data)
+    return hash_object.hexdigest()
+
+
+def _stat(file_name):
+    try:
+        stat_result = os.stat(file_name)
+        return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _reflink(source, target):
+    """
+    Make a reflink where the filesystem supports it (btrfs, XFS...).
+    """
+    import fcntl
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+class ArtifactCache:
+    """
+    The artifact cache.
+    """
+
+    def __init__(self, path=ARTIFACT_CACHE_PATH, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(path, "index.json")
+        self.lock_file = os.path.join(path, "index.lock")
+        self._lock = threading.RLock()
+        # Nesting depth of _locked(): only the outermost one takes the file lock
+        self._lock_depth = 0
+        # Nesting depth of batch(); the index is saved when the outermost one ends
+        self._batch_depth = 0
+        self._batch_dirty = False
+        if not os.path.exists(os.path.join(path, "objects")):
+            os.makedirs(os.path.join(path, "objects"))
+        self.index = {}
+        self._index_stat = False
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self):
+        """
+        Lock the index (in this process, and for the other processes), and catch up with it.
+        """
+        with self._lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            try:
+                import fcntl
+            except ImportError:
+                # The file can't be locked here: only this process is safe
+                fcntl = None
+            with open(self.lock_file, "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    index_stat = _stat(self.index_file)
+                    if index_stat != self._index_stat:
+                        self.index = self._load_index()
+                        self._index_stat = index_stat
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+                f.close()
+            return index
+        except Exception:
+            return {}
+
+    def _save_index(self):
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
+        temp_file = self.index_file + ".tmp"
+        with open(temp_file, "w") as f:
+            f.write(json.dumps(self.index))
+            f.close()
+        os.replace(temp_file, self.index_file)
+        self._index_stat = _stat(self.index_file)
+
+    @contextmanager
+    def batch(self):
+        """
+        Save the index once for many changes (e.g. the thousands of files of a BE archive),
+        instead of once per change.
+        """
+        with self._locked():
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._batch_dirty:
+                    self._batch_dirty = False
+                    self._save_index()
+            if not self._batch_depth:
+                self.evict()
+
+    def object_path(self, digest):
+        return os.path.join(self.path, "objects", digest[:2], digest)
+
+    def contains(self, digest):
+        return digest in self.index and os.path.exists(self.object_path(digest))
+
+    def total_size(self):
+        return sum([entry["size"] for entry in self.index.values()])
+
+    def add_file(self, path, digest=None, name=None, move=False, executable=False):
+        """
+        Add a file to the cache, and return its SHA-256.
+        move: Move the file into the cache instead of copying it.
+        executable: The file is a program (placed files share the mode of the object).
+        """
+        digest = digest or hash_file(path)
+        # Read-only: the object is hardlinked into server directories
+        mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+        if executable:
+            mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        with self._locked():
+            if self.contains(digest):
+                if move:
+                    os.remove(path)
+                if executable:
+                    os.chmod(self.object_path(digest), mode)
+                self._touch(digest)
+                return digest
+            object_path = self.object_path(digest)
+            if not os.path.exists(os.path.dirname(object_path)):
+                os.makedirs(os.path.dirname(object_path))
+            if move:
+                try:
+                    os.replace(path, object_path)
+                except OSError:
+                    shutil.move(path, object_path)
+            else:
+                shutil.copyfile(path, object_path)
+            os.chmod(object_path, mode)
+            self.index[digest] = {
+                "name": name or os.path.basename(path),
+                "size": os.path.getsize(object_path),
+                "last_used": time.time(),
+                "refs": []
+            }
+            self._save_index()
+            self.evict(exclude={digest})
+        return digest
+
+    def add_stream(self, stream, name, executable=False):
+        """
+        Add a file read from a stream (e.g. an archive member), hashing it while it's written.
+        Returns the SHA-256.
+        """
+        hash_object = hashlib.sha256()
+        temp_file = os.path.join(self.path, "stream-{}-{}.tmp".format(os.getpid(), threading.get_ident()))
+        try:
+            with open(temp_file, "wb") as f:
+                for data in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b""):
+                    hash_object.update(data)
+                    f.write(data)
+            return self.add_file(temp_file, hash_object.hexdigest(), name, move=True, executable=executable)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def fetch(self, url, sha256=None, sha1=None, downloader=None, name=None, progress=None):
+        """
+        Get an artifact by its SHA-256, downloading it only if it isn't cached.
+        progress: See MCSH.download.Downloader.download.
+        Returns the SHA-256.
+        """
+        # Without a SHA-256, the artifact is found by where it came from
+        cached = sha256 or self.find_url(url)
+        if cached and self.contains(cached):
+            log(MODULE_NAME, "DEBUG", "Artifact {} is cached.", cached)
+            with self._locked():
+                self._touch(cached)
+            return cached
+        from MCSH.download import Downloader
+        own_downloader = downloader is None
+        downloader = downloader or Downloader()
+        # Named after the URL: an interrupted download is resumed by the next fetch, even in another run
+        temp_file = os.path.join(self.path, "download-{}.tmp".format(hashlib.sha1(url.encode()).hexdigest()[:16]))
+        try:
+            digests = downloader.download(url, temp_file, sha1=sha1, sha256=sha256, progress=progress)
+        finally:
+            if own_downloader:
+                downloader.close()
+        digest = self.add_file(temp_file, digests["sha256"], name or url.rsplit("/", 1)[-1], move=True)
+        with self._locked():
+            self.index[digest]["url"] = url
+            self._save_index()
+        return digest
+
+    def annotate(self, digest, **fields):
+        """
+        Keep some information with an artifact (e.g. the members of an archive).
+        """
+        with self._locked():
+            if digest in self.index:
+                self.index[digest].update(fields)
+                self._save_index()
+
+    def find_url(self, url):
+        """
+        Get the SHA-256 of the artifact downloaded from the URL, or None.
+        """
+        with self._locked():
+            for digest, entry in self.index.items():
+                if entry.get("url") == url:
+                    return digest
+        return None
+
+    def _touch(self, digest):
+        self.index[digest]["last_used"] = time.time()
+        self._save_index()
+
+    def link(self, digest, target):
+        """
+        Place an artifact at the target path, and record the reference.
+        Hardlinks are tried first, then reflinks, then a plain copy.
+        Returns the method used ('hardlink', 'reflink' or 'copy').
+        """
+        object_path = self.object_path(digest)
+        target_directory = os.path.dirname(os.path.abspath(target))
+        if not os.path.exists(target_directory):
+            os.makedirs(target_directory)
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(object_path, target)
+            method = "hardlink"
+        except OSError:
+            try:
+                _reflink(object_path, target)
+                method = "reflink"
+            except (OSError, ImportError):
+                shutil.copyfile(object_path, target)
+                shutil.copymode(object_path, target)
+                method = "copy"
+        with self._locked():
+            references = self.index[digest]["refs"]
+            if os.path.abspath(target) not in references:
+                references.append(os.path.abspath(target))
+            self.index[digest]["last_used"] = time.time()
+            self._save_index()
+        log(MODULE_NAME, "DEBUG", "Placed artifact {} at {} ({}).", digest, target, method)
+        return method
+
+    def release(self, target, remove_file=True):
+        """
+        Drop the reference of a placed artifact (and remove the file).
+        """
+        target = os.path.abspath(target)
+        with self._locked():
+            for entry in self.index.values():
+                if target in entry["refs"]:
+                    entry["refs"].remove(target)
+            self._save_index()
+        if remove_file and os.path.lexists(target):
+            os.remove(target)
+
+    def references(self, directory):
+        """
+        Get the artifacts placed under a directory, as placed file -> SHA-256.
+        """
+        directory = os.path.join(os.path.abspath(directory), "")
+        with self._locked():
+            return {reference: digest for digest, entry in self.index.items()
+                    for reference in entry["refs"] if reference.startswith(directory)}
+
+    def drop_references(self, references):
+        """
+        Drop references (placed file -> SHA-256, see references()) without touching the files.
+        """
+        with self._locked():
+            for target, digest in references.items():
+                entry = self.index.get(digest)
+                if entry is not None and target in entry["refs"]:
+                    entry["refs"].remove(target)
+            self._save_index()
+
+    def release_directory(self, directory):
+        """
+        Drop the references of all the artifacts placed under a directory (e.g. a removed server).
+        """
+        directory = os.path.join(os.path.abspath(directory), "")
+        with self._locked():
+            for entry in self.index.values():
+                entry["refs"] = [reference for reference in entry["refs"] if not reference.startswith(directory)]
+            self._save_index()
+
+    def _remove_object(self, digest):
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            os.chmod(object_path, stat.S_IWUSR | stat.S_IRUSR)
+            os.remove(object_path)
+        del self.index[digest]
+
+    def garbage_collect(self):
+        """
+        Remove the artifacts that nothing refers to (and that weren't used within ARTIFACT_GRACE_PERIOD).
+        References to files that are gone are dropped first.
+        Returns the bytes freed.
+        """
+        freed = 0
+        with self._locked():
+            for digest in list(self.index):
+                entry = self.index[digest]
+                entry["refs"] = [reference for reference in entry["refs"] if os.path.exists(reference)]
+                if not entry["refs"] and entry["last_used"] < time.time() - ARTIFACT_GRACE_PERIOD:
+                    freed += entry["size"]
+                    self._remove_object(digest)
+            self._save_index()
+        if freed:
+            log(MODULE_NAME, "INFO", "Freed {} MB of unused artifacts.", round(freed / 1024 / 1024))
+        return freed
+
+    def evict(self, exclude=()):
+        """
+        Evict unreferenced artifacts, least recently used first, until the cache fits the budget.
+        Referenced artifacts, the excluded ones (e.g. the one just added) and the ones used within
+        ARTIFACT_GRACE_PERIOD are never evicted.
+        Nothing is evicted within a batch, before the new artifacts are placed.
+        """
+        if not self.max_bytes or self._batch_depth:
+            return
+        with self._locked():
+            total_size = self.total_size()
+            if total_size <= self.max_bytes:
+                return
+            recent = time.time() - ARTIFACT_GRACE_PERIOD
+            unreferenced = sorted([digest for digest, entry in self.index.items()
+                                   if not entry["refs"] and digest not in exclude and entry["last_used"] < recent],
+                                  key=lambda digest: self.index[digest]["last_used"])
+            for digest in unreferenced:
+                if total_size <= self.max_bytes:
+                    break
+                total_size -= self.index[digest]["size"]
+                log(MODULE_NAME, "DEBUG", "Evicting artifact {}...", digest)
+                self._remove_object(digest)
+            self._save_index()
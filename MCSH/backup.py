@@ -0,0 +1,369 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.backup
+ Module Revision: 0.0.1-18
+ Module Description:
+    Incremental, deduplicating backups of server directories.
+    Default directory: ./MCSH/backups
+        chunks/<xx>/<sha256>                 Stored chunks, shared by all the snapshots of all the servers
+        snapshots/<server>/<id>.json.gz      Snapshot manifests: file -> size, mtime, mode, chunk list
+        store.lock                           Shared by backups and restores, exclusive for garbage collection
+    Region files (.mca) are split at the boundaries of their Minecraft chunks, so a chunk
+    that didn't change (even if the game moved it in the file) is stored only once.
+    Other files are split into fixed-size chunks.
+    Files with the same size and mtime as in the previous snapshot aren't read at all;
+    the others are split, hashed and compressed on a process pool.
+"""
+import gzip
+import json
+import os
+import time
+import zlib
+from contextlib import contextmanager
+
+from MCSH.logging import log
+from MCSH.process_pool import process_pool
+from MCSH.region import HEADER_SIZE, read_locations
+
+MODULE_NAME = "backup"
+BACKUP_PATH = "./MCSH/backups"
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_COMPRESS_LEVEL = 6
+BACKUP_EXCLUDE = ["session.lock"]
+# The first byte of a stored chunk: how it's stored
+CHUNK_RAW = b"R"
+CHUNK_ZLIB = b"Z"
+
+
+def _region_segments(data):
+    """
+    Split a region file into (offset, length) segments: the header, every Minecraft chunk,
+    and the gaps between them (the file is restored byte for byte).
+    """
+    if len(data) < HEADER_SIZE:
+        return [(0, len(data))] if data else []
+    chunks = set([(offset, length) for index, offset, length in read_locations(data)
+                  if length and offset >= HEADER_SIZE and offset + length <= len(data)])
+    segments = [(0, HEADER_SIZE)]
+    position = HEADER_SIZE
+    for offset, length in sorted(chunks):
+        if offset < position:
+            # Overlapping entries (a corrupted header): leave it to the gap handling
+            continue
+        if offset > position:
+            segments.append((position, offset - position))
+        segments.append((offset, length))
+        position = offset + length
+    if position < len(data):
+        segments.append((position, len(data) - position))
+    return segments
+
+
+def _store_chunk(chunks_path, data):
+    """
+    Store a chunk if it isn't stored yet.
+    Returns (digest, bytes written).
+    """
+    import hashlib
+    digest = hashlib.sha256(data).hexdigest()
+    chunk_name = os.path.join(chunks_path, digest[:2], digest)
+    if os.path.exists(chunk_name):
+        return digest, 0
+    compressed = zlib.compress(data, BACKUP_COMPRESS_LEVEL)
+    # Data that's already compressed (e.g. Minecraft chunks) is stored as it is
+    stored = CHUNK_ZLIB + compressed if len(compressed) < len(data) else CHUNK_RAW + data
+    os.makedirs(os.path.dirname(chunk_name), exist_ok=True)
+    temp_name = "{}.{}.tmp".format(chunk_name, os.getpid())
+    with open(temp_name, "wb") as f:
+        f.write(stored)
+    os.replace(temp_name, chunk_name)
+    return digest, len(stored)
+
+
+def _backup_file(chunks_path, file_name):
+    """
+    Split, hash and store a file (runs in the process pool).
+    Returns (chunk digests, bytes written).
+    """
+    digests = []
+    written = 0
+    if file_name.endswith(".mca"):
+        with open(file_name, "rb") as f:
+            data = f.read()
+        for offset, length in _region_segments(data):
+            digest, size = _store_chunk(chunks_path, data[offset:offset + length])
+            digests.append(digest)
+            written += size
+    else:
+        with open(file_name, "rb") as f:
+            for data in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b""):
+                digest, size = _store_chunk(chunks_path, data)
+                digests.append(digest)
+                written += size
+    return digests, written
+
+
+class BackupStore:
+    """
+    The backup store.
+    """
+
+    def __init__(self, path=BACKUP_PATH):
+        self.path = path
+        self.chunks_path = os.path.join(path, "chunks")
+        self.lock_file = os.path.join(path, "store.lock")
+        os.makedirs(self.chunks_path, exist_ok=True)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """
+        Lock the store: shared while chunks are written or read, exclusive while unused ones are removed
+        (a chunk a running backup relies on isn't in any snapshot yet).
+        """
+        try:
+            import fcntl
+        except ImportError:
+            # The store can't be locked here
+            fcntl = None
+        with open(self.lock_file, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _snapshot_directory(self, server_name):
+        if not server_name or server_name in (".", "..") or "/" in server_name or "\\" in server_name:
+            raise ValueError("Invalid server name: {}".format(server_name))
+        return os.path.join(self.path, "snapshots", server_name)
+
+    def list_snapshots(self, server_name):
+        """
+        The snapshot IDs of a server, the oldest first.
+        """
+        directory = self._snapshot_directory(server_name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted([file[:-len(".json.gz")] for file in os.listdir(directory) if file.endswith(".json.gz")])
+
+    def load_snapshot(self, server_name, snapshot_id):
+        with gzip.open(os.path.join(self._snapshot_directory(server_name), snapshot_id + ".json.gz"), "rt") as f:
+            return json.load(f)
+
+    def _save_snapshot(self, server_name, snapshot):
+        directory = self._snapshot_directory(server_name)
+        os.makedirs(directory, exist_ok=True)
+        snapshot_name = os.path.join(directory, snapshot["id"] + ".json.gz")
+        with gzip.open(snapshot_name + ".tmp", "wt") as f:
+            json.dump(snapshot, f)
+        os.replace(snapshot_name + ".tmp", snapshot_name)
+
+    def backup(self, server_name, directory, workers=None):
+        """
+        Take a snapshot of a server directory.
+        Returns the snapshot ID.
+        """
+        with self._locked():
+            return self._backup(server_name, directory, workers)
+
+    def _backup(self, server_name, directory, workers):
+        start = time.perf_counter()
+        snapshots = self.list_snapshots(server_name)
+        previous_files = self.load_snapshot(server_name, snapshots[-1])["files"] if snapshots else {}
+        snapshot_id = time.strftime("%Y%m%d-%H%M%S")
+        if snapshot_id in snapshots:
+            snapshot_id += "-{}".format(len(snapshots))
+        snapshot = {"id": snapshot_id, "server": server_name, "time": time.time(),
+                    "directory": os.path.abspath(directory), "files": {}}
+        changed = []
+        for root, directories, files in os.walk(directory):
+            directories.sort()
+            for file in sorted(files):
+                if file in BACKUP_EXCLUDE:
+                    continue
+                file_name = os.path.join(root, file)
+                if not os.path.isfile(file_name):
+                    continue
+                relative_name = os.path.relpath(file_name, directory).replace(os.sep, "/")
+                stat = os.stat(file_name)
+                entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "mode": stat.st_mode & 0o777}
+                previous = previous_files.get(relative_name)
+                if previous is not None and previous["size"] == entry["size"] \
+                        and previous["mtime"] == entry["mtime"]:
+                    entry["chunks"] = previous["chunks"]
+                else:
+                    changed.append((relative_name, file_name))
+                snapshot["files"][relative_name] = entry
+        log(MODULE_NAME, "INFO", "Backing up {}: {} file(s), {} changed...",
+            server_name, len(snapshot["files"]), len(changed))
+        written = 0
+        if changed:
+            with process_pool(workers) as executor:
+                results = executor.map(_backup_file, [self.chunks_path] * len(changed),
+                                       [file_name for relative_name, file_name in changed])
+                for (relative_name, file_name), (digests, size) in zip(changed, results):
+                    snapshot["files"][relative_name]["chunks"] = digests
+                    written += size
+        self._save_snapshot(server_name, snapshot)
+        log(MODULE_NAME, "INFO", "Snapshot {} of {} done in {}s ({} MB written).", snapshot_id, server_name,
+            round(time.perf_counter() - start, 1), round(written / 1024 / 1024, 1))
+        return snapshot_id
+
+    def _read_chunk(self, digest):
+        with open(os.path.join(self.chunks_path, digest[:2], digest), "rb") as f:
+            stored = f.read()
+        if stored[:1] == CHUNK_ZLIB:
+            return zlib.decompress(stored[1:])
+        return stored[1:]
+
+    def restore(self, server_name, snapshot_id, directory, paths=None):
+        """
+        Restore a snapshot (or only the files under the given paths) into a directory.
+        Files that are already the same as in the snapshot (size and mtime) are skipped,
+        and the others are written chunk by chunk.
+        Files under the restored paths that the snapshot doesn't have are removed.
+        """
+        def restored_path(relative_name):
+            return not paths or any([relative_name == path or relative_name.startswith(path.rstrip("/") + "/")
+                                     for path in paths])
+
+        with self._locked():
+            snapshot = self.load_snapshot(server_name, snapshot_id)
+            restored = self._restore_files(snapshot, directory, restored_path)
+        removed = 0
+        for root, directories, files in os.walk(directory):
+            for file in files:
+                file_name = os.path.join(root, file)
+                relative_name = os.path.relpath(file_name, directory).replace(os.sep, "/")
+                if file in BACKUP_EXCLUDE or relative_name in snapshot["files"] or not restored_path(relative_name):
+                    continue
+                os.remove(file_name)
+                removed += 1
+        log(MODULE_NAME, "INFO", "Restored {} file(s) of snapshot {} to {}, removed {} file(s) it doesn't have.",
+            restored, snapshot_id, directory, removed)
+        return restored
+
+    def _restore_files(self, snapshot, directory, restored_path):
+        restored = 0
+        for relative_name, entry in snapshot["files"].items():
+            if not restored_path(relative_name):
+                continue
+            file_name = os.path.join(directory, *relative_name.split("/"))
+            try:
+                stat = os.stat(file_name)
+                if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime"]:
+                    continue
+            except FileNotFoundError:
+                pass
+            os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+            with open(file_name + ".restoring", "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(self._read_chunk(digest))
+            os.chmod(file_name + ".restoring", entry["mode"])
+            os.replace(file_name + ".restoring", file_name)
+            os.utime(file_name, ns=(entry["mtime"], entry["mtime"]))
+            restored += 1
+        return restored
+
+    def remove_snapshots(self, server_name, keep=0):
+        """
+        Remove the snapshots of a server except the newest ones, then the chunks nothing uses.
+        """
+        for snapshot_id in self.list_snapshots(server_name)[:-keep or None]:
+            os.remove(os.path.join(self._snapshot_directory(server_name), snapshot_id + ".json.gz"))
+        return self.garbage_collect()
+
+    def garbage_collect(self):
+        """
+        Remove the chunks that no snapshot uses.
+        Returns the bytes freed.
+        """
+        with self._locked(exclusive=True):
+            freed = self._remove_unused_chunks()
+        if freed:
+            log(MODULE_NAME, "INFO", "Freed {} MB of unused backup chunks.", round(freed / 1024 / 1024, 1))
+        return freed
+
+    def _remove_unused_chunks(self):
+        used = set()
+        snapshots_path = os.path.join(self.path, "snapshots")
+        for server_name in os.listdir(snapshots_path) if os.path.isdir(snapshots_path) else []:
+            for snapshot_id in self.list_snapshots(server_name):
+                for entry in self.load_snapshot(server_name, snapshot_id)["files"].values():
+                    used.update(entry["chunks"])
+        freed = 0
+        for root, directories, files in os.walk(self.chunks_path):
+            for file in files:
+                if file not in used:
+                    chunk_name = os.path.join(root, file)
+                    freed += os.path.getsize(chunk_name)
+                    os.remove(chunk_name)
+        return freed
+
+
+def _get_server(server_name):
+    from MCSH.servers import get_registry
+    server = get_registry().get(server_name)
+    if server is None:
+        log(MODULE_NAME, "ERROR", "There's no server named {}.", server_name)
+    return server
+
+
+def backup_server(server_name):
+    """
+    Back up a server. (--backup)
+    """
+    server = _get_server(server_name)
+    if server is None:
+        return
+    from MCSH.rcon import RconError, run_commands
+    # A running server flushes the world first, and doesn't save while it's read
+    saving_off = False
+    try:
+        run_commands(server_name, ["save-off", "save-all flush"])
+        saving_off = True
+    except (RconError, ConnectionError) as e:
+        log(MODULE_NAME, "DEBUG", "Not saving {} through RCON: {}", server_name, e)
+    try:
+        BackupStore().backup(server_name, server["directory"])
+    finally:
+        if saving_off:
+            try:
+                run_commands(server_name, ["save-on"])
+            except (RconError, OSError) as e:
+                # Not raised: it would hide how the backup went
+                log(MODULE_NAME, "ERROR", "Failed to turn the autosave of server {} back on: {}\n"
+                                          "It doesn't save the world until 'save-on' is run on it!", server_name, e)
+
+
+def restore_server(arguments):
+    """
+    Restore a server from a snapshot, the latest one by default. (--restore)
+    """
+    server_name = arguments[0]
+    server = _get_server(server_name)
+    if server is None:
+        return
+    store = BackupStore()
+    snapshots = store.list_snapshots(server_name)
+    if not snapshots:
+        log(MODULE_NAME, "ERROR", "Server {} has no backup.", server_name)
+        return
+    from MCSH.servers import DEFAULT_STATE, server_state
+    # The files of a running server would be replaced under it
+    state = server_state(server_name, server)
+    if state != DEFAULT_STATE:
+        log(MODULE_NAME, "ERROR", "Server {} is {}. Stop it first.", server_name, state)
+        return
+    snapshot_id = arguments[1] if len(arguments) > 1 else snapshots[-1]
+    if snapshot_id not in snapshots:
+        log(MODULE_NAME, "ERROR", "Server {} has no snapshot {}. Snapshots: {}",
+            server_name, snapshot_id, ", ".join(snapshots))
+        return
+    store.restore(server_name, snapshot_id, server["directory"])
@@ -0,0 +1,156 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.bedrock
+ Module Revision: 0.0.1-18
+ Module Description:
+    Installs, updates and launches Bedrock Edition servers.
+    The bedrock-server archive is read member by member, straight into MCSH.artifact_cache
+    (nothing is extracted to a temporary directory): every program file (the server binary,
+    its libraries, the behavior and resource packs...) is stored once, and hardlinked into
+    the server directories. Servers of the same version share the files on disk and, as they're
+    the same inodes, the pages of the binary and libraries in memory.
+    The settings (server.properties, permissions, allowlist) are the server's own:
+    new keys of server.properties are merged in, and the other files are only written if missing.
+"""
+import os
+import sys
+
+from MCSH.logging import log
+
+MODULE_NAME = "bedrock"
+BEDROCK_BINARY = "bedrock_server.exe" if sys.platform == "win32" else "bedrock_server"
+# The default ports (IPv4, and IPv6 right after); co-hosted servers get the next free pair
+BEDROCK_PORT = 19132
+# Files and directories of the archive that are the server's settings (never linked, never replaced)
+BEDROCK_CONFIG_FILES = ["server.properties", "permissions.json", "allowlist.json", "whitelist.json"]
+BEDROCK_CONFIG_DIRECTORIES = ["config/"]
+
+
+def _member_name(name):
+    """
+    Normalize the path of an archive member, refusing paths that leave the server directory.
+    """
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or ".." in parts or name.startswith(("/", "\\")) or ":" in parts[0]:
+        raise ValueError("Unsafe path in the archive: {}".format(name))
+    return "/".join(parts)
+
+
+def _is_config(member_name):
+    return member_name in BEDROCK_CONFIG_FILES or member_name.startswith(tuple(BEDROCK_CONFIG_DIRECTORIES))
+
+
+def _place_config(archive, info, member_name, target):
+    """
+    Place a settings file of the archive, keeping what the server already has.
+    """
+    import shutil
+    from MCSH.server_properties import PROPERTIES_FILE, merge_properties
+    if member_name == PROPERTIES_FILE:
+        added = merge_properties(target, archive.read(info).decode("utf-8", "replace"))
+        if added:
+            log(MODULE_NAME, "DEBUG", "New properties in {}: {}", target, ", ".join(added))
+        return
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with archive.open(info) as source, open(target, "wb") as f:
+        shutil.copyfileobj(source, f)
+
+
+def unpack_bedrock(cache, archive_digest, directory):
+    """
+    Place the files of a cached bedrock-server archive into a server directory.
+    Program files that didn't change are left alone, and the ones the new version doesn't have are removed.
+    Returns {"linked", "unchanged", "removed"} (file counts).
+    """
+    import zipfile
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    # Member -> SHA-256, kept with the archive: a version is hashed only once, by its first server
+    members = dict(cache.index.get(archive_digest, {}).get("members") or {})
+    previous = cache.references(directory)
+    placed = {}
+    counts = {"linked": 0, "unchanged": 0, "removed": 0}
+    with cache.batch(), zipfile.ZipFile(cache.object_path(archive_digest)) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            member_name = _member_name(info.filename)
+            target = os.path.join(directory, *member_name.split("/"))
+            if _is_config(member_name):
+                _place_config(archive, info, member_name, target)
+                continue
+            digest = members.get(member_name)
+            if digest is None or not cache.contains(digest):
+                executable = bool((info.external_attr >> 16) & 0o111) or member_name == BEDROCK_BINARY
+                with archive.open(info) as stream:
+                    digest = cache.add_stream(stream, os.path.basename(member_name), executable)
+                members[member_name] = digest
+            placed[target] = digest
+            if previous.get(target) == digest and os.path.exists(target) and \
+                    os.path.samefile(target, cache.object_path(digest)):
+                counts["unchanged"] += 1
+                continue
+            cache.link(digest, target)
+            counts["linked"] += 1
+        cache.drop_references({target: digest for target, digest in previous.items()
+                               if placed.get(target) != digest})
+        for target in previous:
+            if target not in placed and os.path.lexists(target):
+                os.remove(target)
+                counts["removed"] += 1
+        cache.annotate(archive_digest, members=members)
+    log(MODULE_NAME, "DEBUG", "Unpacked {} into {}: {} linked, {} unchanged, {} removed.", archive_digest,
+        directory, counts["linked"], counts["unchanged"], counts["removed"])
+    return counts
+
+
+def _free_port(registry):
+    """
+    Get the first pair of ports (IPv4, IPv6) no installed BE server uses.
+    """
+    from MCSH.server_properties import read_server_properties
+    used = set()
+    for server_name in registry.find(type="BE"):
+        properties = read_server_properties(registry.get(server_name)["directory"])
+        for key in ("server-port", "server-portv6"):
+            try:
+                used.add(int(properties[key]))
+            except (KeyError, ValueError):
+                pass
+    port = BEDROCK_PORT
+    while port in used or port + 1 in used:
+        port += 2
+    return port
+
+
+def install_bedrock(registry, server_name, directory, archive_digest, cache):
+    """
+    Set up a new BE server directory from a cached archive.
+    The server is named after the server, and gets its own ports.
+    """
+    from MCSH.server_properties import PROPERTIES_FILE, set_properties
+    port = _free_port(registry)
+    unpack_bedrock(cache, archive_digest, directory)
+    set_properties(os.path.join(directory, PROPERTIES_FILE),
+                   {"server-name": server_name, "server-port": port, "server-portv6": port + 1})
+    log(MODULE_NAME, "INFO", "Server {} listens on port {} (IPv6: {}).", server_name, port, port + 1)
+
+
+def managed_server(server_name, record):
+    """
+    Get the supervisor entry (MCSH.supervisor.ManagedServer) of a BE server.
+    """
+    from MCSH.supervisor import ManagedServer
+    directory = os.path.abspath(record["directory"])
+    env = dict(os.environ)
+    if sys.platform.startswith("linux"):
+        # The server loads its libraries from its own directory
+        env["LD_LIBRARY_PATH"] = os.pathsep.join([directory] + ([env["LD_LIBRARY_PATH"]]
+                                                                if env.get("LD_LIBRARY_PATH") else []))
+    return ManagedServer(server_name, "BE", [os.path.join(directory, BEDROCK_BINARY)], cwd=directory, env=env)
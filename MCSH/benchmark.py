@@ -0,0 +1,316 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.benchmark
+ Module Revision: 0.0.1-18
+ Module Description:
+    The 'Performance Tester'. (--benchmark)
+    Measures single-core and multi-core CPU throughput, memory bandwidth,
+    and sequential/random disk IO in the world directory, within a time budget.
+    The CPU workload is pure Python, so its raw score (iterations per second) depends on the interpreter
+    as much as on the CPU. Raw scores are saved, and converted to 'effective GHz' (comparable with the
+    CPUFreq numbers in perf_recommend/*.json) by the reference runs in CPU_CALIBRATION; without a
+    reference run for the interpreter, the CPU has no effective GHz and isn't compared.
+    Results are saved to MCSH/config/benchmark.json.
+"""
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from MCSH.logging import log
+from MCSH.process_pool import process_pool
+
+MODULE_NAME = "benchmark"
+BENCHMARK_RESULT_FILE = "MCSH/config/benchmark.json"
+# Seconds given to every test
+BENCHMARK_TIME_BUDGET = {
+    "cpu_single": 1.5,
+    "cpu_multi": 2,
+    "memory": 1,
+    "disk_sequential": 3,
+    "disk_random": 2
+}
+# Format of the saved results; results of other formats (e.g. uncalibrated CPU scores) are ignored
+BENCHMARK_FORMAT_VERSION = 2
+# Iterations per second of the CPU workload per GHz, by interpreter: reference runs on one core of
+# a 2.1 GHz Xeon (the best of 3 runs of 2 seconds, divided by 2.1)
+CPU_CALIBRATION = {
+    "CPython 3.7": 1137000,
+    "CPython 3.8": 1086000,
+    "CPython 3.9": 1122000,
+    "CPython 3.10": 1257000,
+    "CPython 3.11": 1137000,
+    "CPython 3.12": 838000,
+    "CPython 3.13": 805000
+}
+CPU_CHUNK_ITERATIONS = 200000
+MEMORY_BLOCK_SIZE = 64 * 1024 * 1024
+DISK_FILE_SIZE = 256 * 1024 * 1024
+DISK_BLOCK_SIZE = 1024 * 1024
+DISK_RANDOM_BLOCK_SIZE = 4096
+PERF_RECOMMEND_TIERS = ["minimum", "recommended", "optimal"]
+
+
+def _cpu_workload(time_budget):
+    """
+    Run the integer workload for the time budget, and return the iterations per second.
+    It's pure Python on purpose: like a Minecraft server tick, it's bound by one core's speed.
+    """
+    iterations = 0
+    value = 0
+    start = time.perf_counter()
+    deadline = start + time_budget
+    while time.perf_counter() < deadline:
+        for i in range(CPU_CHUNK_ITERATIONS):
+            value = (value * 31 + i) & 0xFFFFFFFF
+        iterations += CPU_CHUNK_ITERATIONS
+    return iterations / (time.perf_counter() - start)
+
+
+def python_name():
+    """
+    The interpreter, as in CPU_CALIBRATION (e.g. "CPython 3.11").
+    """
+    return "{} {}.{}".format(platform.python_implementation(), *sys.version_info[:2])
+
+
+def effective_ghz(score, python=None):
+    """
+    Convert a raw CPU score into effective GHz, or None if there's no reference run for the interpreter.
+    """
+    iterations_per_ghz = CPU_CALIBRATION.get(python or python_name())
+    if score is None or iterations_per_ghz is None:
+        return None
+    return round(score / iterations_per_ghz, 2)
+
+
+def benchmark_cpu_single():
+    """
+    Single-core CPU score (raw: iterations per second).
+    """
+    return round(_cpu_workload(BENCHMARK_TIME_BUDGET["cpu_single"]))
+
+
+def benchmark_cpu_multi():
+    """
+    Multi-core CPU score (raw: iterations per second of all the cores), using one process per core.
+    """
+    workers = os.cpu_count() or 1
+    with process_pool(workers) as executor:
+        rates = list(executor.map(_cpu_workload, [BENCHMARK_TIME_BUDGET["cpu_multi"]] * workers))
+    return round(sum(rates))
+
+
+def benchmark_memory():
+    """
+    Memory bandwidth (GB/s) of copying large blocks.
+    """
+    source = bytearray(MEMORY_BLOCK_SIZE)
+    target = bytearray(MEMORY_BLOCK_SIZE)
+    copied = 0
+    start = time.perf_counter()
+    deadline = start + BENCHMARK_TIME_BUDGET["memory"]
+    while time.perf_counter() < deadline:
+        target[:] = source
+        copied += MEMORY_BLOCK_SIZE
+    return round(copied / (time.perf_counter() - start) / 1024 ** 3, 2)
+
+
+def benchmark_disk_sequential(directory):
+    """
+    Sequential write and read speed (MB/s) in the directory.
+    Writing is fsync'ed, so the page cache doesn't hide the disk.
+    Returns (write MB/s, read MB/s, file size).
+    """
+    file_name = os.path.join(directory, ".mcsh_benchmark.tmp")
+    block = os.urandom(DISK_BLOCK_SIZE)
+    written = 0
+    deadline = time.perf_counter() + BENCHMARK_TIME_BUDGET["disk_sequential"] / 2
+    start = time.perf_counter()
+    with open(file_name, "wb", buffering=0) as f:
+        while written < DISK_FILE_SIZE and time.perf_counter() < deadline:
+            f.write(block)
+            written += DISK_BLOCK_SIZE
+        os.fsync(f.fileno())
+    write_speed = written / (time.perf_counter() - start) / 1024 ** 2
+    read = 0
+    deadline = time.perf_counter() + BENCHMARK_TIME_BUDGET["disk_sequential"] / 2
+    start = time.perf_counter()
+    with open(file_name, "rb", buffering=0) as f:
+        while time.perf_counter() < deadline:
+            data = f.read(DISK_BLOCK_SIZE)
+            if not data:
+                break
+            read += len(data)
+    read_speed = read / (time.perf_counter() - start) / 1024 ** 2
+    return round(write_speed, 1), round(read_speed, 1), written
+
+
+def benchmark_disk_random(directory, file_size):
+    """
+    Random 4K read and write IOPS in the directory (uses the sequential test file).
+    Returns (read IOPS, write IOPS).
+    """
+    file_name = os.path.join(directory, ".mcsh_benchmark.tmp")
+    blocks = max(file_size // DISK_RANDOM_BLOCK_SIZE, 1)
+    block = os.urandom(DISK_RANDOM_BLOCK_SIZE)
+    file_descriptor = os.open(file_name, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        reads = 0
+        deadline = time.perf_counter() + BENCHMARK_TIME_BUDGET["disk_random"] / 2
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            os.lseek(file_descriptor, random.randrange(blocks) * DISK_RANDOM_BLOCK_SIZE, os.SEEK_SET)
+            os.read(file_descriptor, DISK_RANDOM_BLOCK_SIZE)
+            reads += 1
+        read_iops = reads / (time.perf_counter() - start)
+        writes = 0
+        deadline = time.perf_counter() + BENCHMARK_TIME_BUDGET["disk_random"] / 2
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            os.lseek(file_descriptor, random.randrange(blocks) * DISK_RANDOM_BLOCK_SIZE, os.SEEK_SET)
+            os.write(file_descriptor, block)
+            writes += 1
+            if writes % 64 == 0:
+                os.fsync(file_descriptor)
+        os.fsync(file_descriptor)
+        write_iops = writes / (time.perf_counter() - start)
+    finally:
+        os.close(file_descriptor)
+    return round(read_iops), round(write_iops)
+
+
+def run_benchmark(directory="."):
+    """
+    Run all the tests, save and return the results.
+    directory: Where to test the disk (the world directory).
+    """
+    log(MODULE_NAME, "INFO", "Running performance tests (about {} seconds)...",
+        round(sum(BENCHMARK_TIME_BUDGET.values())))
+    results = {"version": BENCHMARK_FORMAT_VERSION, "time": time.time(), "directory": os.path.abspath(directory),
+               "python": python_name()}
+    log(MODULE_NAME, "INFO", "Testing CPU (single-core)...")
+    results["cpu_single_score"] = benchmark_cpu_single()
+    log(MODULE_NAME, "INFO", "Testing CPU (multi-core)...")
+    results["cpu_multi_score"] = benchmark_cpu_multi()
+    # Effective GHz, None without a reference run for this interpreter
+    results["cpu_single"] = effective_ghz(results["cpu_single_score"])
+    results["cpu_multi"] = effective_ghz(results["cpu_multi_score"])
+    if results["cpu_single"] is None:
+        log(MODULE_NAME, "WARNING", "There's no reference run for {}: the CPU can't be compared with the tiers.",
+            results["python"])
+    log(MODULE_NAME, "INFO", "Testing memory...")
+    results["memory_bandwidth"] = benchmark_memory()
+    log(MODULE_NAME, "INFO", "Testing disk...")
+    try:
+        results["disk_write"], results["disk_read"], file_size = benchmark_disk_sequential(directory)
+        results["disk_random_read_iops"], results["disk_random_write_iops"] = \
+            benchmark_disk_random(directory, file_size)
+    except OSError as e:
+        log(MODULE_NAME, "WARNING", "Can't test the disk in {}: {}", directory, e)
+    finally:
+        try:
+            os.remove(os.path.join(directory, ".mcsh_benchmark.tmp"))
+        except OSError:
+            pass
+    try:
+        os.makedirs(os.path.dirname(BENCHMARK_RESULT_FILE), exist_ok=True)
+        with open(BENCHMARK_RESULT_FILE, "w") as f:
+            f.write(json.dumps(results))
+            f.close()
+    except Exception:
+        log(MODULE_NAME, "WARNING", "Failed to save the benchmark results.")
+    return results
+
+
+def load_benchmark():
+    """
+    Load the saved results, or None if there's none (or they're of an older MCSH).
+    """
+    try:
+        with open(BENCHMARK_RESULT_FILE, "r") as f:
+            results = json.load(f)
+            f.close()
+    except Exception:
+        return None
+    if not is_current(results):
+        log(MODULE_NAME, "WARNING", "The saved benchmark results are outdated. Run --benchmark again.")
+        return None
+    return results
+
+
+def is_current(results):
+    """
+    Check whether results are of the current format (older ones have uncalibrated CPU scores).
+    """
+    return bool(results) and results.get("version") == BENCHMARK_FORMAT_VERSION
+
+
+def load_perf_recommend(server_type):
+    """
+    Load the tiers of perf_recommend/je.json or be.json.
+    """
+    with open("MCSH/perf_recommend/{}.json".format(server_type.lower()), "r") as f:
+        tiers = json.load(f)
+        f.close()
+    return tiers
+
+
+def match_tier(results, memory_total, server_type="JE"):
+    """
+    Get the highest perf_recommend tier that the measured numbers meet, or None.
+    memory_total: Total RAM (GB).
+    Numbers that weren't measured (e.g. the CPU without a reference run, or a disk that couldn't be tested)
+    aren't compared.
+    """
+    tiers = load_perf_recommend(server_type)
+    matched = None
+    for tier_name in PERF_RECOMMEND_TIERS:
+        tier = tiers[tier_name]
+        if memory_total < tier["RAM"]:
+            break
+        if any([results.get(key) is not None and results[key] < tier.get(tier_key, 0)
+                for key, tier_key in [("cpu_single", "CPUFreq"), ("cpu_multi", "CPUMulti"),
+                                      ("disk_write", "DiskWrite")]]):
+            break
+        matched = tier_name
+    return matched
+
+
+def print_results(results, memory_total):
+    """
+    Print the results, and the tiers they meet.
+    """
+    log(MODULE_NAME, "INFO", "-- Performance Test Results --\n"
+                             "CPU (single-core): {} effective GHz ({} iterations/s on {})\n"
+                             "CPU (multi-core): {} effective GHz ({} iterations/s)\n"
+                             "Memory bandwidth: {} GB/s\n"
+                             "Disk sequential write/read: {}/{} MB/s\n"
+                             "Disk random 4K read/write: {}/{} IOPS",
+        results.get("cpu_single") or "?", results.get("cpu_single_score"), results.get("python"),
+        results.get("cpu_multi") or "?", results.get("cpu_multi_score"), results.get("memory_bandwidth"),
+        results.get("disk_write", "?"), results.get("disk_read", "?"),
+        results.get("disk_random_read_iops", "?"), results.get("disk_random_write_iops", "?"))
+    for server_type in ["JE", "BE"]:
+        tier_name = match_tier(results, memory_total, server_type)
+        if tier_name is None:
+            log(MODULE_NAME, "WARNING", "This computer doesn't meet the minimum requirements of {} servers.",
+                server_type)
+        else:
+            log(MODULE_NAME, "INFO", "{} servers: meets '{}' ({} players).", server_type, tier_name,
+                load_perf_recommend(server_type)[tier_name]["players"])
+
+
+def benchmark_command(directory):
+    """
+    Run the performance tests. (--benchmark)
+    """
+    from MCSH.consts import config_instance
+    results = run_benchmark(directory)
+    print_results(results, config_instance.computer_info.get("memory_total", 0))
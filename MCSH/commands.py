@@ -0,0 +1,120 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.commands
+ Module Revision: 0.0.1-18
+ Module Description:
+    The command registry for MCSH.
+    Every command registers the module and function that handles it,
+    and the module is only imported when the command is executed.
+"""
+from importlib import import_module
+
+from MCSH.logging import log
+
+MODULE_NAME = "commands"
+# Argument types of the commands
+ARGUMENT_NONE = "none"
+ARGUMENT_SINGLE = "single"
+ARGUMENT_LIST = "list"
+
+
+class Command:
+    """
+    A registered command.
+    """
+    __slots__ = ("name", "module_name", "handler_name", "argument_type", "_handler")
+
+    def __init__(self, name, module_name, handler_name, argument_type):
+        self.name = name
+        self.module_name = module_name
+        self.handler_name = handler_name
+        self.argument_type = argument_type
+        self._handler = None
+
+    @property
+    def handler(self):
+        """
+        The handler function, imported on first use.
+        """
+        if self._handler is None:
+            log(MODULE_NAME, "DEBUG", "Loading handler {}.{}...", self.module_name, self.handler_name)
+            self._handler = getattr(import_module(self.module_name), self.handler_name)
+        return self._handler
+
+    def convert_argument(self, parsed_value):
+        """
+        Convert the value from argparse to the typed argument of the handler.
+        Returns None if the command isn't selected.
+        """
+        if parsed_value is None or parsed_value is False:
+            return None
+        if self.argument_type == ARGUMENT_NONE:
+            return ()
+        elif self.argument_type == ARGUMENT_SINGLE:
+            # nargs=1 gives a list, nargs="?" gives the value itself
+            if isinstance(parsed_value, str):
+                return (parsed_value,)
+            return (str(parsed_value[0]),)
+        else:
+            return ([str(i) for i in parsed_value],)
+
+
+# Command name -> Command, in the sequence of execution
+COMMANDS = {}
+
+
+def register_command(name, module_name, handler_name, argument_type=ARGUMENT_NONE):
+    """
+    Register a command.
+    name: The command name, the same as the parser destination (e.g. 'reposearch').
+    module_name, handler_name: Where the handler is, e.g. 'MCSH.install', 'install_server'.
+    argument_type: ARGUMENT_NONE (flag), ARGUMENT_SINGLE (one value) or ARGUMENT_LIST (values).
+    """
+    COMMANDS[name] = Command(name, module_name, handler_name, argument_type)
+
+
+def select_command(parser_args):
+    """
+    Select the first command (in registering sequence) that the user entered.
+    Returns (command name, handler arguments), or (None, None) if there's none.
+    """
+    for command in COMMANDS.values():
+        arguments = command.convert_argument(getattr(parser_args, command.name, None))
+        if arguments is not None:
+            return command.name, arguments
+    return None, None
+
+
+def execute_command(name, arguments):
+    """
+    Execute a registered command.
+    """
+    log(MODULE_NAME, "DEBUG", "Executing command {} with {}...", name, arguments)
+    return COMMANDS[name].handler(*arguments)
+
+
+register_command("install", "MCSH.install", "install_server", ARGUMENT_LIST)
+register_command("remove", "MCSH.install", "remove_servers", ARGUMENT_LIST)
+register_command("reinstall", "MCSH.install", "reinstall_server", ARGUMENT_SINGLE)
+register_command("backup", "MCSH.backup", "backup_server", ARGUMENT_SINGLE)
+register_command("restore", "MCSH.backup", "restore_server", ARGUMENT_LIST)
+register_command("autoupdate", "MCSH.update", "autoupdate_servers")
+register_command("upgrade", "MCSH.update", "upgrade_servers")
+register_command("download", "MCSH.download", "download_server", ARGUMENT_SINGLE)
+register_command("repolist", "MCSH.repository", "repository_list")
+register_command("reposearch", "MCSH.repository", "repository_search", ARGUMENT_SINGLE)
+register_command("reposhow", "MCSH.repository", "repository_show", ARGUMENT_SINGLE)
+register_command("list", "MCSH.servers", "list_servers")
+register_command("rcon", "MCSH.rcon", "rcon_command", ARGUMENT_LIST)
+register_command("events", "MCSH.console_events", "events_command", ARGUMENT_SINGLE)
+register_command("scan", "MCSH.region", "scan_command", ARGUMENT_SINGLE)
+register_command("prune", "MCSH.prune", "prune_command", ARGUMENT_SINGLE)
+register_command("benchmark", "MCSH.benchmark", "benchmark_command", ARGUMENT_SINGLE)
+register_command("export_probe", "MCSH.placement", "export_probe", ARGUMENT_SINGLE)
+register_command("plan", "MCSH.placement", "plan_command", ARGUMENT_SINGLE)
+register_command("daemon", "MCSH.daemon", "run_daemon")
+register_command("daemon_stop", "MCSH.daemon", "stop_daemon")
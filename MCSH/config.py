@@ -11,14 +11,15 @@
     Main argparse module for MCSH.
 """
 import argparse
-import json
 import os
 import traceback
 
+from MCSH.commands import COMMANDS, select_command, execute_command
 from MCSH.consts import MCSH_version
 from MCSH.debug import debugging_check, debugging_parse
-from MCSH.get_computer_info import ComputerInfo
 from MCSH.logging import log, crash
+from MCSH.program_config import ConfigError, get_program_config
+from MCSH.startup_profile import phase
 
 MODULE_NAME = "config"
 
@@ -41,64 +42,86 @@ class Config:
         self.operations = None
         self.parse_sequence = None
         self.execute_command = None
-        self.computer_info = None
-        self.crash_info = None
+        self.execute_arguments = None
+        self._computer_info = None
+        self._crash_info = None
         self.debug = False
         self.first_time_start = flag_first_time_start
         # Call functions for initializing.
-        self._init_computer_info()
+        # Computer info is probed lazily, when it's first used.
         self._init_debug()
-        self._init_program_config()
-        log(MODULE_NAME, "DEBUG", "-- Config Summary --\n"
-                                  "program_config: {}\n"
-                                  "computer_info: {}\n"
-                                  "crash_info: {}\n"
-                                  "first_time_startup: {}\n"
-                                  "DEBUG: {}".format(self.program_config,
-                                                     self.computer_info, self.crash_info,
-                                                     self.first_time_start, self.debug))
+        with phase("Read program config"):
+            self._init_program_config()
+        log(MODULE_NAME, "DEBUG", lambda: "-- Config Summary --\n"
+                                          "program_config: {}\n"
+                                          "computer_info: {}\n"
+                                          "crash_info: {}\n"
+                                          "first_time_startup: {}\n"
+                                          "DEBUG: {}".format(self.program_config,
+                                                             self.computer_info, self.crash_info,
+                                                             self.first_time_start, self.debug))
         log(MODULE_NAME, "DEBUG", "Starting parser...")
-        self._init_parser()
-        self._config_parser()
+        with phase("Build parser"):
+            self._init_parser()
+            self._config_parser()
+
+    @property
+    def computer_info(self):
+        """
+        The computer info (probed on first use).
+        """
+        if self._computer_info is None:
+            self._init_computer_info()
+        return self._computer_info
+
+    @property
+    def crash_info(self):
+        """
+        The 'System Details' for crash reports (probed on first use, the memory usage read every time).
+        """
+        from MCSH.get_computer_info import memory_usage
+        if self._crash_info is None:
+            self._init_computer_info()
+        self._crash_info["Memory"] = memory_usage()
+        return self._crash_info
 
     def _init_debug(self):
         if debugging_check(suppress_warning=True):
             log(MODULE_NAME, "DEBUG", "WARNING: Debugging features enabled.")
             self.debug = True
-            self.crash_info["Debugging"] = True
-        else:
-            self.crash_info["Debugging"] = False
 
     def _init_computer_info(self):
         """
         Initialize computer info module.
         """
         log(MODULE_NAME, "DEBUG", "Initializing computer info instance...")
-        computer_info_instance = ComputerInfo()
-        computer_info_instance.get_computer_info()
-        self.computer_info = computer_info_instance.computer_info
-        self.crash_info = computer_info_instance.crash_report_system_info
+        with phase("Probe computer info"):
+            from MCSH.get_computer_info import ComputerInfo
+            computer_info_instance = ComputerInfo()
+            computer_info_instance.get_computer_info()
+        self._computer_info = computer_info_instance.computer_info
+        self._crash_info = computer_info_instance.crash_report_system_info
+        self._crash_info["Debugging"] = self.debug
 
     def _init_program_config(self):
         """
-        Read program config json.
+        Read program config json (through MCSH.program_config, which migrates and validates it).
         """
         log(MODULE_NAME, "DEBUG", "Reading program config...")
         if self.first_time_start:
             self._generate_config()
+        program_config = get_program_config()
+        self.program_config_file = program_config.file_name
         try:
-            self.program_config_file = open("MCSH/config/MCSH.json")
-            self.program_config = json.loads(self.program_config_file.read())
-            self.program_config_file.close()
-        except Exception:
+            self.program_config = program_config.load()
+        except ConfigError:
             log("initialize_config", "WARNING", "The file {file_name} ({file_path}) is missing or corrupted. "
                                                 "Trying to generate a new one...".format(
-                **{"file_name": "MCSH.json", "file_path": "MCSH/config/MCSH.json"}))
+                **{"file_name": "MCSH.json", "file_path": program_config.file_name}))
             self._generate_config()
             self._init_program_config()
 
     def _generate_config(self):
-        # TODO: Update from version to version
         log(MODULE_NAME, "DEBUG", "Generating a new config file...")
         if self.first_time_start:
             try:
@@ -110,14 +133,8 @@ class Config:
                     "computer_info": self.crash_info,
                     "program_traceback": traceback.format_exc()
                 })
-        config_file_content = {
-            "version": "MCSH v0.0.1-InEDev",
-            "color_enabled": False
-        }
         try:
-            with open("MCSH/config/MCSH.json", "w+") as f:
-                f.write(json.dumps(config_file_content))
-                f.close()
+            get_program_config().generate()
         except Exception:
             crash({
                 "description": "Unable to generate config file.",
@@ -127,12 +144,16 @@ class Config:
             })
 
     def update_config(self):
+        """
+        Save the program config.
+        Returns whether it's saved.
+        """
         try:
-            with open("MCSH/config/MCSH.json", "w") as f:
-                f.write(json.dumps(self.program_config))
-                f.close()
-        except Exception:
-            print("Failed")
+            get_program_config().save(self.program_config)
+            return True
+        except OSError as e:
+            log(MODULE_NAME, "ERROR", "Failed to save the program config: {}", e)
+            return False
 
     def _init_parser(self):
         """
@@ -153,9 +174,9 @@ class Config:
         self.parser_args = None
         self.operations = self.parser.add_argument_group(title="All MCSH Commands")
         self.debug_operations = self.parser.add_argument_group(title="Debugging Commands")
-        self.parse_sequence = ["install", "remove", "reinstall", "autoupdate", "upgrade", "download",
-                               "repolist", "reposearch", "reposhow"]
+        self.parse_sequence = list(COMMANDS.keys())
         self.execute_command = None
+        self.execute_arguments = None
 
     def _config_parser(self):
         """
@@ -170,25 +191,69 @@ class Config:
                                      help="Show this help message.")
         self.operations.add_argument("--list", action="store_true",
                                      help="List all installed server(s).")
-        self.operations.add_argument("--install", action="store_true", default=False,
-                                     help="Install a server.")
+        self.operations.add_argument("--install", nargs=2, metavar=("Name", "ServerName"),
+                                     help="Install a server (JE or BE) of the repository.")
         self.operations.add_argument("--remove", nargs="+", metavar="ServerName",
                                      help="Remove server(s).")
         self.operations.add_argument("--reinstall", nargs=1, metavar="ServerName",
                                      help="Reinstall a server.")
+        self.operations.add_argument("--backup", nargs=1, metavar="ServerName",
+                                     help="Back up a server (incrementally).")
+        self.operations.add_argument("--restore", nargs="+", metavar=("ServerName", "SnapshotID"),
+                                     help="Restore a server from a backup (the latest one by default).")
         self.operations.add_argument("--autoupdate", action="store_true",
                                      help="Update all server(s) in the list.")
+        self.operations.add_argument("--dry-run", action="store_true",
+                                     help="With --autoupdate or --prune, only show what would be done.")
         self.operations.add_argument("--upgrade", action="store_true",
                                      help="Upgrade all server(s) to current version, including MCSH.\n"
                                           "WARNING: Under very early development, strongly unrecommended.")
-        self.operations.add_argument("--download", action="store_true",
-                                     help="Download a specified server program.")
+        self.operations.add_argument("--download", nargs=1, metavar="ServerName",
+                                     help="Download a server program of the repository.")
         self.operations.add_argument("--repolist", action="store_true",
                                      help="List all server(s) in the repository.")
         self.operations.add_argument("--reposearch", nargs=1, metavar="ServerName",
                                      help="Search for server(s) in the repository.")
         self.operations.add_argument("--reposhow", nargs=1, metavar="ServerName",
                                      help="Show the specific server detail in the repository.")
+        self.operations.add_argument("--rcon", nargs="+", metavar=("Command", "ServerName"),
+                                     help="Run a command through RCON on the given server(s),\n"
+                                          "or on all the running servers.")
+        self.operations.add_argument("--events", nargs=1, metavar="ServerName",
+                                     help="Show the console events (joins, chat, lag, crashes...) of a server.")
+        self.operations.add_argument("--event-type", metavar="Type",
+                                     help="With --events, only show this type of events\n"
+                                          "(join, leave, chat, lag, tps, start, stop, crash, error, fatal).")
+        self.operations.add_argument("--player", metavar="PlayerName",
+                                     help="With --events, only show the events of this player.")
+        self.operations.add_argument("--days", type=int, default=7, metavar="Days",
+                                     help="With --events, show the events of the last Days days (default: 7).")
+        self.operations.add_argument("--scan", nargs=1, metavar="World",
+                                     help="Show the chunk and size statistics of a world.\n"
+                                          "World is a world directory, or a server name (all its worlds).")
+        self.operations.add_argument("--prune", nargs=1, metavar="World",
+                                     help="Remove stale chunks from a world (the server must be stopped),\n"
+                                          "and compact its region files.\n"
+                                          "World is a world directory, or a server name (all its worlds).")
+        self.operations.add_argument("--inhabited-time", type=int, metavar="Ticks",
+                                     help="With --prune, remove the chunks players spent less time in.")
+        self.operations.add_argument("--keep-radius", type=int, metavar="Chunks",
+                                     help="With --prune, remove the chunks farther from the spawn.")
+        self.operations.add_argument("--benchmark", nargs="?", const=".", metavar="WorldDirectory",
+                                     help="Run the performance tests.\n"
+                                          "The disk is tested in WorldDirectory (default: current directory).")
+        self.operations.add_argument("--export-probe", nargs="?", const="", metavar="File",
+                                     help="Export the probe snapshot of this host, for --plan.\n"
+                                          "Default file: <hostname>.probe.json")
+        self.operations.add_argument("--plan", nargs=1, metavar="PlanFile",
+                                     help="Plan which host every server goes to, from probe snapshots.")
+        self.operations.add_argument("--daemon", action="store_true",
+                                     help="Run MCSH as a resident daemon.\n"
+                                          "While it's running, commands are forwarded to it.")
+        self.operations.add_argument("--daemon-stop", action="store_true",
+                                     help="Stop the running MCSH daemon.")
+        self.operations.add_argument("--startup-profile", action="store_true",
+                                     help="Print how long each startup phase takes.")
         # Commands used JUST FOR DEBUGGING
         self.debug_operations.add_argument("--debugging-crash",
                                            action="store_true",
@@ -205,26 +270,27 @@ class Config:
                                            help=("Disable debugging features."
                                                  if self.debug
                                                  else argparse.SUPPRESS))
-    def parser_parse(self):
+    def parser_parse(self, args=None):
         """
         Parse the args the user had entered.
+        args: The args to parse (the daemon passes them), defaults to sys.argv.
         """
         log(MODULE_NAME, "DEBUG", "Parsing arguments...")
-        self.parser_args = self.parser.parse_args()
+        self.execute_command = None
+        self.execute_arguments = None
+        self.parser_args = self.parser.parse_args(args)
         # DEBUGGING ARGUMENTS
         debug_args_selected = debugging_parse(self.parser_args)
         # Normal Parsing
-        for i in self.parse_sequence:
-            if eval("self.parser_args." + i) is True:
-                self.execute_command = i
-                break
-            elif eval("self.parser_args." + i) is not None and eval("self.parser_args." + i) is not False:
-                self.execute_command = i + "({})".format(eval("self.parser_args." + i))
-                break
+        self.execute_command, self.execute_arguments = select_command(self.parser_args)
         if self.execute_command is None and debug_args_selected is False:
             log(MODULE_NAME, "ERROR", "No command specified.")
             self.parser.print_usage()
         log(MODULE_NAME, "DEBUG", "-- Parser Summary --\n"
                                   "parser_args: {}\n"
                                   "execute_command: {}\n"
-                                  "parse_sequence: {}".format(self.parser_args, self.execute_command, self.parse_sequence))
\ No newline at end of file
+                                  "execute_arguments: {}\n"
+                                  "parse_sequence: {}",
+            self.parser_args, self.execute_command, self.execute_arguments, self.parse_sequence)
+        if self.execute_command is not None:
+            execute_command(self.execute_command, self.execute_arguments)
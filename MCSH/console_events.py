@@ -0,0 +1,347 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.console_events
+ Module Revision: 0.0.1-18
+ Module Description:
+    Parses server consoles into events (joins, leaves, chat, lag warnings, TPS, crashes...),
+    and indexes them on disk: MCSH/events.db (SQLite), indexed by server and time,
+    by event type and by player. (--events)
+    Lines are classified with precompiled patterns, each guarded by a keyword test,
+    so the lines that aren't events (most of them) cost a few substring searches.
+    Events are written in batches by a background thread, so the consoles are never held up by the disk.
+    When a server the daemon ran live stops, its logs/latest.log is recorded as parsed, so --events
+    without the daemon doesn't parse (and store) the same lines again.
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from MCSH.logging import log
+
+MODULE_NAME = "console_events"
+EVENTS_DATABASE = "MCSH/events.db"
+EVENTS_FLUSH_SIZE = 256
+EVENTS_FLUSH_INTERVAL = 1
+EVENTS_FLUSH_TIMEOUT = 5
+# Event type -> (keyword, pattern), per server type. Groups: 'player', 'value' (a number), 'text'.
+# A line is only matched against the patterns whose keyword it contains.
+EVENT_PATTERNS = {
+    "JE": {
+        "join": (" joined the game", r"\]: (?P<player>[A-Za-z0-9_]{1,16}) joined the game"),
+        "leave": (" left the game", r"\]: (?P<player>[A-Za-z0-9_]{1,16}) left the game"),
+        "chat": ("> ", r"\]: (?:\[Not Secure\] )?<(?P<player>[A-Za-z0-9_]{1,16})> (?P<text>.*)"),
+        "lag": ("Can't keep up!", r"Can't keep up! Is the server overloaded\? Running (?P<value>[0-9]+)ms"),
+        "tps": ("TPS from last", r"TPS from last 1m, 5m, 15m: \*?(?P<value>[0-9.]+)"),
+        "start": ("]: Done (", r"\]: Done \((?P<value>[0-9.]+)s\)!"),
+        "stop": ("]: Stopping", r"\]: Stopping (?:the )?server"),
+        "crash": ("crash report", r"(?:This crash report has been saved to: |Preparing crash report)(?P<text>.*)"),
+        "error": ("ERROR]: ", r"/ERROR\]: (?P<text>.*)"),
+        "fatal": ("FATAL]: ", r"/FATAL\]: (?P<text>.*)")
+    },
+    "BE": {
+        "join": ("Player connected: ", r"Player connected: (?P<player>[^,]+),"),
+        "leave": ("Player disconnected: ", r"Player disconnected: (?P<player>[^,]+),"),
+        "start": ("Server started.", r"Server started\."),
+        "stop": ("Stopping server", r"Stopping server\.\.\."),
+        "crash": ("Crash", r"(?P<text>Crash.*)"),
+        "error": ("ERROR] ", r"ERROR\] (?P<text>.*)")
+    }
+}
+EVENT_TYPES = ["join", "leave", "chat", "lag", "tps", "start", "stop", "crash", "error", "fatal"]
+
+
+class EventParser:
+    """
+    Classifies the console lines of one server type.
+    """
+
+    def __init__(self, server_type="JE"):
+        patterns = EVENT_PATTERNS.get(server_type, EVENT_PATTERNS["JE"])
+        # In the order they're tried: the first match wins
+        self.patterns = [(event_type, keyword, re.compile(pattern))
+                         for event_type, (keyword, pattern) in patterns.items()]
+
+    def parse(self, line):
+        """
+        Get the event of a line as (type, player, value, text), or None.
+        """
+        for event_type, keyword, pattern in self.patterns:
+            # Substring tests are far cheaper than regular expressions, and most lines match none
+            if keyword not in line:
+                continue
+            match = pattern.search(line)
+            if match is not None:
+                groups = match.groupdict()
+                value = groups.get("value")
+                return event_type, groups.get("player"), float(value) if value else None, groups.get("text")
+        return None
+
+
+def _date_lines(lines, mtime):
+    """
+    Get the timestamps of log lines ((line, HH:MM:SS or None) in file order), which only have a time of day.
+    The last lines are on the day the file was last written; going back, the day steps back
+    every time the time of day goes up (the log went past midnight there).
+    Lines without a time (e.g. stack traces) get the time of the line above them.
+    """
+    import datetime
+    day = datetime.date.fromtimestamp(mtime)
+    later_time = None
+    timestamps = [None] * len(lines)
+    for index in range(len(lines) - 1, -1, -1):
+        line_time = lines[index][1]
+        if line_time is None:
+            continue
+        if later_time is not None and line_time > later_time:
+            day -= datetime.timedelta(days=1)
+        later_time = line_time
+        timestamps[index] = time.mktime(time.strptime("{} {}".format(day, line_time), "%Y-%m-%d %H:%M:%S"))
+    previous = next((timestamp for timestamp in timestamps if timestamp is not None), mtime)
+    for index, timestamp in enumerate(timestamps):
+        if timestamp is None:
+            timestamps[index] = previous
+        else:
+            previous = timestamp
+    return timestamps
+
+
+class _LogRead:
+    """
+    A queued request to record a log file as parsed up to its end.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = os.path.abspath(file_name)
+
+
+class EventIndex(threading.Thread):
+    """
+    The event index, and its background writer.
+    """
+
+    def __init__(self, database=EVENTS_DATABASE):
+        super().__init__(name="MCSH-EventWriter", daemon=True)
+        self.database = database
+        self.queue = queue.SimpleQueue()
+        self.parsers = {}
+        # Listeners called with (server name, event) for every event, e.g. the lag detector
+        self.event_listeners = []
+        connection = self._connect()
+        connection.executescript(
+            "CREATE TABLE IF NOT EXISTS events (time REAL, server TEXT, type TEXT, player TEXT, "
+            "value REAL, text TEXT);"
+            "CREATE INDEX IF NOT EXISTS events_server_time ON events (server, time);"
+            "CREATE INDEX IF NOT EXISTS events_server_type_time ON events (server, type, time);"
+            "CREATE INDEX IF NOT EXISTS events_player_time ON events (player, time);"
+            "CREATE TABLE IF NOT EXISTS offsets (file TEXT PRIMARY KEY, inode INTEGER, offset INTEGER);")
+        connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.database, timeout=EVENTS_FLUSH_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def feed(self, server_name, server_type, line, timestamp=None):
+        """
+        Parse a console line, and queue its event (if it's one).
+        """
+        parser = self.parsers.get(server_type)
+        if parser is None:
+            parser = self.parsers[server_type] = EventParser(server_type)
+        event = parser.parse(line)
+        if event is None:
+            return None
+        event = (time.time() if timestamp is None else timestamp,) + event
+        self.queue.put((server_name,) + event)
+        for listener in self.event_listeners:
+            try:
+                listener(server_name, event)
+            except Exception:
+                log(MODULE_NAME, "ERROR", "An event listener failed for server {}.", server_name)
+        return event
+
+    def line_listener(self, server, line):
+        """
+        The line listener for MCSH.supervisor.
+        """
+        self.feed(server.name, server.server_type, line)
+
+    def state_listener(self, server, old_state, new_state):
+        """
+        The state listener for MCSH.supervisor: the log of a server that stopped was parsed live.
+        """
+        from MCSH.supervisor import STATE_CRASHED, STATE_STOPPED
+        if new_state in (STATE_STOPPED, STATE_CRASHED) and server.cwd is not None:
+            self.mark_read(os.path.join(server.cwd, "logs", "latest.log"))
+
+    def mark_read(self, file_name):
+        """
+        Record a log file as parsed up to its end (by the writer, after the events queued before).
+        """
+        self.queue.put(_LogRead(file_name))
+
+    def ingest_file(self, server_name, server_type, file_name):
+        """
+        Parse the part of a log file (e.g. logs/latest.log) that wasn't parsed yet.
+        Returns the number of events.
+        """
+        stat = os.stat(file_name)
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT inode, offset FROM offsets WHERE file = ?",
+                                     (os.path.abspath(file_name),)).fetchone()
+            offset = row[1] if row is not None and row[0] == stat.st_ino and row[1] <= stat.st_size else 0
+            lines = []
+            with open(file_name, "rb") as f:
+                f.seek(offset)
+                for raw_line in f:
+                    if not raw_line.endswith(b"\n"):
+                        break
+                    offset += len(raw_line)
+                    line = raw_line.decode(errors="replace").rstrip("\r\n")
+                    line_time = re.match(r"\[([0-9]{2}:[0-9]{2}:[0-9]{2})", line)
+                    lines.append((line, line_time.group(1) if line_time else None))
+            count = 0
+            for line, timestamp in zip([line for line, line_time in lines], _date_lines(lines, stat.st_mtime)):
+                if self.feed(server_name, server_type, line, timestamp) is not None:
+                    count += 1
+            connection.execute("INSERT OR REPLACE INTO offsets VALUES (?, ?, ?)",
+                               (os.path.abspath(file_name), stat.st_ino, offset))
+            connection.commit()
+        finally:
+            connection.close()
+        self.flush()
+        return count
+
+    def run(self):
+        connection = self._connect()
+        batch = []
+        flushed = []
+        stopping = False
+        last_write = time.monotonic()
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=EVENTS_FLUSH_INTERVAL)
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    flushed.append(item)
+                elif isinstance(item, _LogRead):
+                    self._write_offset(connection, item.file_name)
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            if stopping or flushed or len(batch) >= EVENTS_FLUSH_SIZE \
+                    or time.monotonic() - last_write >= EVENTS_FLUSH_INTERVAL:
+                if batch:
+                    try:
+                        connection.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                                               [(event[1], event[0]) + event[2:] for event in batch])
+                        connection.commit()
+                    except sqlite3.Error as e:
+                        log(MODULE_NAME, "ERROR", "Failed to write {} event(s): {}", len(batch), e)
+                    batch = []
+                last_write = time.monotonic()
+                for event in flushed:
+                    event.set()
+                flushed = []
+        connection.close()
+
+    @staticmethod
+    def _write_offset(connection, file_name):
+        try:
+            stat = os.stat(file_name)
+            connection.execute("INSERT OR REPLACE INTO offsets VALUES (?, ?, ?)",
+                               (file_name, stat.st_ino, stat.st_size))
+            connection.commit()
+        except FileNotFoundError:
+            pass
+        except sqlite3.Error as e:
+            log(MODULE_NAME, "ERROR", "Failed to record the offset of {}: {}", file_name, e)
+
+    def flush(self, timeout=EVENTS_FLUSH_TIMEOUT):
+        """
+        Block until everything queued before this call is written.
+        """
+        if not self.is_alive():
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait(timeout)
+
+    def stop(self, timeout=EVENTS_FLUSH_TIMEOUT):
+        if self.is_alive():
+            self.queue.put(None)
+            self.join(timeout)
+
+    def query(self, server_name=None, event_type=None, player=None, start=None, end=None, limit=1000):
+        """
+        Get the latest events (up to limit) matching all the given conditions, oldest first, as dicts.
+        """
+        conditions = []
+        parameters = []
+        for column, value in [("server", server_name), ("type", event_type), ("player", player)]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                parameters.append(value)
+        if start is not None:
+            conditions.append("time >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("time < ?")
+            parameters.append(end)
+        self.flush()
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT time, server, type, player, value, text FROM events{} ORDER BY time DESC LIMIT ?".format(
+                    " WHERE " + " AND ".join(conditions) if conditions else ""), parameters + [limit]).fetchall()
+        finally:
+            connection.close()
+        return [dict(zip(["time", "server", "type", "player", "value", "text"], row)) for row in reversed(rows)]
+
+
+def events_command(server_name):
+    """
+    Show the console events of a server. (--events)
+    """
+    from MCSH.consts import config_instance
+    from MCSH.servers import get_registry
+    parser_args = config_instance.parser_args
+    if parser_args.event_type is not None and parser_args.event_type not in EVENT_TYPES:
+        log(MODULE_NAME, "ERROR", "Unknown event type {}. Event types: {}",
+            parser_args.event_type, ", ".join(EVENT_TYPES))
+        return
+    from MCSH.daemon import running_daemon
+    if running_daemon is not None:
+        index = running_daemon.event_index
+    else:
+        index = EventIndex()
+        index.start()
+        # Without the daemon, the events are parsed from the log of the server
+        server = get_registry().get(server_name)
+        if server is not None:
+            latest_log = os.path.join(server["directory"], "logs", "latest.log")
+            if os.path.exists(latest_log):
+                index.ingest_file(server_name, server["type"], latest_log)
+    events = index.query(server_name, parser_args.event_type, parser_args.player,
+                         time.time() - parser_args.days * 86400)
+    if running_daemon is None:
+        index.stop()
+    if not events:
+        log(MODULE_NAME, "INFO", "No event found.")
+        return
+    log(MODULE_NAME, "INFO", lambda: "{} event(s):\n".format(len(events)) + "\n".join(
+        ["{} {:<6} {}{}{}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event["time"])), event["type"],
+                                  event["player"] + " " if event["player"] else "",
+                                  "{:g} ".format(event["value"]) if event["value"] is not None else "",
+                                  event["text"] or "")
+         for event in events]))
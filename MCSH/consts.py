@@ -20,6 +20,24 @@ Description: {description}
 Program Traceback:
 {program_traceback}
 
+-- System Details --
+Details:
+{computer_crash_info}
+'''
+LAG_REPORT_FORMAT = '''---- MCSH Lag Report ----
+Time: {time}
+Server: {server} (PID {pid})
+Description: {description}
+
+-- Recent Observations --
+{observations}
+
+-- Resource Snapshot --
+{resources}
+
+-- Thread Dumps ({dump_tool}) --
+{thread_dumps}
+
 -- System Details --
 Details:
 {computer_crash_info}
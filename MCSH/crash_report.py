@@ -13,10 +13,13 @@
 """
 import os
 import sys
-import tarfile
 import time
 
 from MCSH.consts import CRASH_REPORT_FORMAT
+from MCSH.rotation import Rotator
+
+# Crash reports kept outside the archive
+CRASH_REPORT_KEEP_UNARCHIVED = 9
 
 
 def generate_crash_report(crash_description, crash_detailed_exception, computer_crash_info, program_traceback):
@@ -25,21 +28,12 @@ def generate_crash_report(crash_description, crash_detailed_exception, computer_
     """
     if not os.path.exists("./MCSH/crash_report"):
         os.mkdir("./MCSH/crash_report")
-    if len(
-            [lists for lists in os.listdir("./MCSH/crash_report")
-             if os.path.isfile(os.path.join("./MCSH/crash_report", lists))]
-    ) >= 10:
-        try:
-            tar = tarfile.open("./MCSH/crash_report/pack.tar.gz", "w:gz")
-            for root, directory, files in os.walk("./MCSH/crash_report"):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if os.path.splitext(file)[1] == ".log":
-                        tar.add(file_path)
-                        os.remove(file_path)
-            tar.close()
-        except Exception as e:
-            print("[??-??] [crash_report/ERROR]: Failed to pack crash reports.")
+    # Older crash reports go to ./MCSH/crash_report/archive
+    try:
+        Rotator("./MCSH/crash_report", max_bytes=0, rotate_daily=False) \
+            .archive_old(keep=CRASH_REPORT_KEEP_UNARCHIVED)
+    except Exception:
+        print("[??-??] [crash_report/ERROR]: Failed to pack crash reports.")
 
     formatted_crash_info = ""
     crash_report_filename = "CRASH_" + time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()) + ".log"
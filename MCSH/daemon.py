@@ -0,0 +1,410 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.daemon
+ Module Revision: 0.0.1-18
+ Module Description:
+    The resident MCSH daemon. (--daemon)
+    Keeps the config, computer info and server states in memory, and
+    answers JSON-RPC 2.0 requests (one JSON object per line) on a local socket:
+    a Unix domain socket (MCSH/mcshd.sock) where available, otherwise localhost TCP.
+    Edits of MCSH/config/MCSH.json are applied while it runs (MCSH.program_config).
+    Methods: execute {argv} -> {output, exit_code}, status, resources, metrics, events, rcon,
+    start, stop, shutdown.
+    The installed servers are run by its supervisor (MCSH.jvm_tuning, MCSH.bedrock).
+    Lag of the servers it runs is watched, and captured into lag reports (MCSH.lag_detector).
+"""
+import asyncio
+import contextvars
+import inspect
+import io
+import json
+import os
+import secrets
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from MCSH.console_events import EventIndex
+from MCSH.consts import MCSH_version
+from MCSH.daemon_client import DAEMON_INFO_FILE, DaemonUnavailable, call
+from MCSH.lag_detector import LagDetector
+from MCSH.logging import log, set_color_enabled
+from MCSH.metrics_store import MetricsStore
+from MCSH.program_config import get_program_config
+from MCSH.rcon import RconPool
+from MCSH.resource_sampler import ResourceSampler
+from MCSH.supervisor import SupervisorThread
+
+MODULE_NAME = "daemon"
+DAEMON_SOCKET_FILE = "MCSH/mcshd.sock"
+METRICS_MAINTAIN_INTERVAL = 3600
+running_daemon = None
+# Where the output of the command run by the current request goes (None: the daemon's own output)
+_command_output = contextvars.ContextVar("command_output", default=None)
+
+
+class _OutputRouter(io.TextIOBase):
+    """
+    Stands in for sys.stdout and sys.stderr while the daemon runs: writes go to the output of the command
+    being executed in the current context, or to the original stream.
+    The other threads (the supervisor, the event index...) keep logging to the daemon's own output,
+    while the threads a command starts (downloads, scheduled jobs) run in a copy of its context.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        output = _command_output.get()
+        return (output if output is not None else self.stream).write(text)
+
+    def flush(self):
+        if _command_output.get() is None:
+            self.stream.flush()
+
+    def isatty(self):
+        return _command_output.get() is None and self.stream.isatty()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    @property
+    def encoding(self):
+        return self.stream.encoding
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles the requests of one connection.
+    """
+
+    def handle(self):
+        for request_line in self.rfile:
+            if not request_line.strip():
+                continue
+            response = self.server.daemon.handle_request(request_line)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class Daemon:
+    """
+    The MCSH daemon.
+    """
+
+    def __init__(self, config_instance):
+        self.config_instance = config_instance
+        self.token = secrets.token_hex(16)
+        self.start_time = time.time()
+        self.server = None
+        self.supervisor_thread = SupervisorThread()
+        self.resource_sampler = ResourceSampler()
+        self.resource_sampler.attach(self.supervisor_thread.supervisor)
+        self.metrics_store = MetricsStore()
+        self.resource_sampler.sample_listeners.append(self.metrics_store.append_sample)
+        self.event_index = EventIndex()
+        self.supervisor_thread.supervisor.line_listeners.append(self.event_index.line_listener)
+        self.supervisor_thread.supervisor.state_listeners.append(self.event_index.state_listener)
+        self.lag_detector = LagDetector(self.supervisor_thread.supervisor, self.metrics_store)
+        self.event_index.event_listeners.append(self.lag_detector.event_listener)
+        self.rcon_pool = RconPool(self.supervisor_thread.supervisor)
+        self.supervisor_thread.supervisor.state_listeners.append(self._record_state)
+        # Writes the states to the registry off the event loop, in order
+        self._state_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MCSH-StateWriter")
+        # Commands share the config instance, so they run one at a time.
+        self._execute_lock = threading.Lock()
+        self.methods = {
+            "execute": self.execute,
+            "status": self.status,
+            "resources": self.resources,
+            "metrics": self.metrics,
+            "events": self.events,
+            "rcon": self.rcon,
+            "start": self.start,
+            "stop": self.stop,
+            "shutdown": self.shutdown
+        }
+
+    def _create_server(self):
+        """
+        Create the socket server, and write the daemon info file for clients.
+        """
+        if hasattr(socketserver, "ThreadingUnixStreamServer"):
+            if os.path.exists(DAEMON_SOCKET_FILE):
+                os.remove(DAEMON_SOCKET_FILE)
+            self.server = socketserver.ThreadingUnixStreamServer(DAEMON_SOCKET_FILE, _RequestHandler)
+            os.chmod(DAEMON_SOCKET_FILE, 0o600)
+            daemon_info = {"family": "unix", "address": DAEMON_SOCKET_FILE}
+        else:
+            self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _RequestHandler)
+            daemon_info = {"family": "tcp", "address": list(self.server.server_address)}
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        daemon_info["token"] = self.token
+        daemon_info["pid"] = os.getpid()
+        with open(DAEMON_INFO_FILE, "w") as f:
+            f.write(json.dumps(daemon_info))
+            f.close()
+        try:
+            os.chmod(DAEMON_INFO_FILE, 0o600)
+        except OSError:
+            pass
+
+    def _on_config_change(self, old_config, config):
+        """
+        Apply an edited program config without restarting.
+        """
+        self.config_instance.program_config = config
+        set_color_enabled(config["color_enabled"])
+
+    def _reset_states(self):
+        """
+        No server runs under a daemon that just started: clear the states a previous one left behind.
+        """
+        from MCSH.servers import DEFAULT_STATE, get_registry
+        registry = get_registry()
+        for server_name in registry.names():
+            if registry.get(server_name).get("state", DEFAULT_STATE) != DEFAULT_STATE:
+                registry.update(server_name, state=DEFAULT_STATE)
+
+    def _add_servers(self):
+        """
+        Add the installed servers to the supervisor.
+        """
+        from MCSH.install import managed_server
+        from MCSH.servers import get_registry
+        for server_name, record in get_registry().items():
+            self.supervisor_thread.call_function(self.supervisor_thread.supervisor.add_server,
+                                                 managed_server(server_name, record))
+
+    def _record_state(self, server, old_state, new_state):
+        """
+        Keep the states of the servers in the registry (the registry is locked and synced to the disk,
+        so it's done by the state writer rather than on the event loop).
+        """
+        self._state_writer.submit(self._write_state, server.name, new_state)
+
+    @staticmethod
+    def _write_state(server_name, state):
+        from MCSH.servers import get_registry
+        registry = get_registry()
+        try:
+            if server_name in registry:
+                registry.update(server_name, state=state)
+        except Exception:
+            log(MODULE_NAME, "ERROR", "Failed to record the state of server {}:\n{}", server_name,
+                traceback.format_exc())
+
+    def _remove_files(self):
+        for file in [DAEMON_INFO_FILE, DAEMON_SOCKET_FILE]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+    def serve(self):
+        """
+        Serve requests until shut down.
+        """
+        self._create_server()
+        self._reset_states()
+        self.event_index.start()
+        self.supervisor_thread.start()
+        self._add_servers()
+        program_config = get_program_config()
+        program_config.change_listeners.append(self._on_config_change)
+        program_config.watch()
+        self.supervisor_thread.submit(self.resource_sampler.run())
+        self.supervisor_thread.submit(self._maintain_metrics())
+        log(MODULE_NAME, "INFO", "MCSH daemon started (PID {}).", os.getpid())
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _OutputRouter(stdout), _OutputRouter(stderr)
+        try:
+            self.server.serve_forever()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            self.server.server_close()
+            self.supervisor_thread.loop.call_soon_threadsafe(self.rcon_pool.close)
+            self.supervisor_thread.stop()
+            self._state_writer.shutdown()
+            self.metrics_store.close()
+            self.event_index.stop()
+            program_config.stop_watching()
+            program_config.change_listeners.remove(self._on_config_change)
+            self._remove_files()
+            log(MODULE_NAME, "INFO", "MCSH daemon stopped.")
+
+    def handle_request(self, request_line):
+        """
+        Handle a single JSON-RPC request, and return the response.
+        """
+        request_id = None
+        try:
+            request = json.loads(request_line.decode())
+            if not isinstance(request, dict):
+                return self._error(None, -32600, "Invalid Request.")
+            request_id = request.get("id")
+            if request.get("token") != self.token:
+                return self._error(request_id, -32001, "Invalid token.")
+            method = self.methods.get(request.get("method"))
+            if method is None:
+                return self._error(request_id, -32601, "Method not found.")
+            params = request.get("params", {})
+            if not isinstance(params, dict):
+                return self._error(request_id, -32602, "Invalid params.")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError:
+                return self._error(request_id, -32602, "Invalid params.")
+            return {"jsonrpc": "2.0", "id": request_id, "result": method(**params)}
+        except ValueError:
+            return self._error(request_id, -32700, "Parse error.")
+        except Exception:
+            log(MODULE_NAME, "ERROR", "Failed to handle a request:\n{}", traceback.format_exc())
+            return self._error(request_id, -32603, "Internal error.")
+
+    @staticmethod
+    def _error(request_id, code, message):
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+    def execute(self, argv):
+        """
+        Execute a command line, as if it's entered to mcsh_cli.py.
+        """
+        output = io.StringIO()
+        exit_code = 0
+        with self._execute_lock:
+            # Only this request's output is captured (see _OutputRouter)
+            token = _command_output.set(output)
+            try:
+                self.config_instance.parser_parse([str(i) for i in argv])
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            finally:
+                _command_output.reset(token)
+        return {"output": output.getvalue(), "exit_code": exit_code}
+
+    def status(self):
+        """
+        The status of the daemon.
+        """
+        return {
+            "version": MCSH_version,
+            "pid": os.getpid(),
+            "uptime": time.time() - self.start_time,
+            "servers": self.supervisor_thread.supervisor.states()
+        }
+
+    def resources(self):
+        """
+        The latest resource usage sample of every server.
+        """
+        return self.resource_sampler.latest()
+
+    def metrics(self, server_name, start, end=None, resolution=None):
+        """
+        The metric records of a server within [start, end).
+        """
+        return self.metrics_store.query(server_name, start, end, resolution)
+
+    def events(self, server_name=None, event_type=None, player=None, start=None, end=None, limit=1000):
+        """
+        The console events matching all the given conditions.
+        """
+        return self.event_index.query(server_name, event_type, player, start, end, limit)
+
+    def rcon(self, command, server_names=None):
+        """
+        Run a command through RCON on many servers at once (all the running ones by default).
+        Returns server name -> {result} or {error}.
+        """
+        results = self.supervisor_thread.call(self.rcon_pool.broadcast(command, server_names))
+        return {server_name: {"error": str(result)} if isinstance(result, Exception) else {"result": result}
+                for server_name, result in results.items()}
+
+    def start(self, server_name):
+        """
+        Start a server (it's restarted if it crashes). Returns its state, or {error}.
+        """
+        supervisor = self.supervisor_thread.supervisor
+        if server_name not in supervisor.servers:
+            return {"error": "Server {} isn't run by the daemon.".format(server_name)}
+        self.supervisor_thread.call(supervisor.start(server_name))
+        return supervisor.servers[server_name].snapshot()
+
+    def stop(self, server_name):
+        """
+        Stop a server gracefully. Returns its state, or {error}.
+        """
+        supervisor = self.supervisor_thread.supervisor
+        if server_name not in supervisor.servers:
+            return {"error": "Server {} isn't run by the daemon.".format(server_name)}
+        self.supervisor_thread.call(supervisor.stop(server_name))
+        return supervisor.servers[server_name].snapshot()
+
+    async def _maintain_metrics(self):
+        """
+        Downsample and clean up the metrics store regularly, off the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.metrics_store.maintain)
+            except Exception:
+                log(MODULE_NAME, "ERROR", "Failed to maintain the metrics store:\n{}", traceback.format_exc())
+            await asyncio.sleep(METRICS_MAINTAIN_INTERVAL)
+
+    def shutdown(self):
+        """
+        Stop the daemon after this request.
+        """
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return True
+
+
+def run_daemon():
+    """
+    Run MCSH as a resident daemon in the foreground. (--daemon)
+    """
+    global running_daemon
+    if running_daemon is not None:
+        log(MODULE_NAME, "ERROR", "The daemon is already running.")
+        return
+    try:
+        call("status")
+        log(MODULE_NAME, "ERROR", "Another MCSH daemon is already running.")
+        return
+    except DaemonUnavailable:
+        pass
+    from MCSH.consts import config_instance
+    # Probe once now, so no command has to do it later
+    config_instance.computer_info
+    running_daemon = Daemon(config_instance)
+    try:
+        running_daemon.serve()
+    except KeyboardInterrupt:
+        log(MODULE_NAME, "INFO", "Interrupted.")
+    finally:
+        running_daemon = None
+
+
+def stop_daemon():
+    """
+    Stop the running daemon. (--daemon-stop)
+    """
+    if running_daemon is not None:
+        running_daemon.shutdown()
+        log(MODULE_NAME, "INFO", "Stopping the daemon...")
+        return
+    try:
+        call("shutdown")
+        log(MODULE_NAME, "INFO", "Stopping the daemon...")
+    except DaemonUnavailable:
+        log(MODULE_NAME, "ERROR", "No running daemon.")
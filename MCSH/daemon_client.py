@@ -0,0 +1,97 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.daemon_client
+ Module Revision: 0.0.1-18
+ Module Description:
+    The client of the MCSH daemon (see MCSH.daemon).
+    mcsh_cli.py uses it to forward commands to a running daemon.
+    It only imports the standard library, so forwarding takes milliseconds.
+"""
+import json
+import os
+import socket
+
+DAEMON_INFO_FILE = "MCSH/mcshd.json"
+DAEMON_TIMEOUT = 600
+# Arguments that are never forwarded to the daemon
+LOCAL_ONLY_ARGUMENTS = ["--daemon", "--startup-profile"]
+
+
+class DaemonUnavailable(Exception):
+    """
+    Raised when no daemon is running (or it can't be reached).
+    """
+
+
+def _connect():
+    """
+    Connect to the daemon described by the daemon info file.
+    Returns the connected socket and the access token.
+    """
+    try:
+        with open(DAEMON_INFO_FILE, "r") as f:
+            daemon_info = json.load(f)
+            f.close()
+    except Exception:
+        raise DaemonUnavailable("No daemon info file.")
+    try:
+        if daemon_info["family"] == "unix":
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(daemon_info["address"])
+        else:
+            connection = socket.create_connection(tuple(daemon_info["address"]), timeout=1)
+    except (OSError, AttributeError, KeyError):
+        raise DaemonUnavailable("Can't connect to the daemon.")
+    connection.settimeout(DAEMON_TIMEOUT)
+    return connection, daemon_info.get("token")
+
+
+def call(method, params=None, request_id=1):
+    """
+    Call a JSON-RPC method of the daemon.
+    Returns the result, or raises DaemonUnavailable/RuntimeError.
+    """
+    connection, token = _connect()
+    try:
+        request = {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": method,
+            "params": params or {},
+            "token": token
+        }
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        reader = connection.makefile("rb")
+        response_line = reader.readline()
+        reader.close()
+    except OSError:
+        raise DaemonUnavailable("Connection to the daemon lost.")
+    finally:
+        connection.close()
+    if not response_line:
+        raise DaemonUnavailable("The daemon closed the connection.")
+    response = json.loads(response_line.decode())
+    if "error" in response:
+        raise RuntimeError(response["error"].get("message", "Unknown daemon error"))
+    return response["result"]
+
+
+def forward_to_daemon(argv):
+    """
+    Forward the command line to a running daemon, and print its output.
+    Returns the exit code, or None if it should be executed locally.
+    """
+    if not os.path.exists(DAEMON_INFO_FILE) or not argv:
+        return None
+    if [i for i in argv if i in LOCAL_ONLY_ARGUMENTS]:
+        return None
+    try:
+        result = call("execute", {"argv": argv})
+    except DaemonUnavailable:
+        return None
+    print(result["output"], end="")
+    return result["exit_code"]
@@ -0,0 +1,381 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.download
+ Module Revision: 0.0.1-18
+ Module Description:
+    Downloads server programs.
+    Large files are fetched as HTTP range chunks over a pool of keep-alive connections,
+    and resumed after an interruption (the finished chunks are recorded next to the .part file).
+    The SHA-1/SHA-256 checksum is computed while downloading, not in a second pass.
+"""
+import contextvars
+import hashlib
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from MCSH.consts import MCSH_version
+from MCSH.logging import log
+
+MODULE_NAME = "download"
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_MAX_CONNECTIONS = 4
+DOWNLOAD_READ_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_MAX_REDIRECTS = 5
+# Out-of-order chunks kept in memory for hashing; the others are hashed back from the file
+HASH_REORDER_LIMIT = 64 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    """
+    Raised when a download fails, or its checksum doesn't match.
+    """
+
+
+class ConnectionPool:
+    """
+    A pool of keep-alive HTTP(S) connections, per host.
+    """
+
+    def __init__(self, max_connections=DOWNLOAD_MAX_CONNECTIONS, timeout=DOWNLOAD_TIMEOUT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """
+        Get an idle connection to the host, or a new one.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        return self.new(scheme, netloc)
+
+    def new(self, scheme, netloc):
+        """
+        Open a new connection to the host.
+        """
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def put(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_connections:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle = {}
+
+
+class _StreamingHasher:
+    """
+    Hashes the chunks in file order while they arrive in any order.
+    """
+
+    def __init__(self, algorithms, part_file, part_lock):
+        self.hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.part_file = part_file
+        self.part_lock = part_lock
+        self.next_offset = 0
+        # Offset -> (length, data or None if it has to be read back from the file)
+        self.pending = {}
+        self.pending_size = 0
+        self.lock = threading.Lock()
+
+    def _update(self, data):
+        for hash_object in self.hashes.values():
+            hash_object.update(data)
+
+    def _read_back(self, offset, length):
+        with self.part_lock:
+            self.part_file.seek(offset)
+            return self.part_file.read(length)
+
+    def add(self, offset, length, data=None):
+        """
+        Add a finished chunk. data may be None for chunks finished in an earlier run.
+        """
+        with self.lock:
+            if data is not None and offset != self.next_offset \
+                    and self.pending_size + length > HASH_REORDER_LIMIT:
+                data = None
+            self.pending[offset] = (length, data)
+            if data is not None:
+                self.pending_size += length
+            while self.next_offset in self.pending:
+                length, data = self.pending.pop(self.next_offset)
+                if data is None:
+                    data = self._read_back(self.next_offset, length)
+                else:
+                    self.pending_size -= length
+                self._update(data)
+                self.next_offset += length
+
+    def hexdigests(self):
+        return {algorithm: hash_object.hexdigest() for algorithm, hash_object in self.hashes.items()}
+
+
+class Downloader:
+    """
+    The download engine. One instance can run several downloads at once, sharing its connections.
+    """
+
+    def __init__(self, max_connections=DOWNLOAD_MAX_CONNECTIONS, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.max_connections = max_connections
+        self.chunk_size = chunk_size
+        self.pool = ConnectionPool(max_connections)
+
+    def close(self):
+        self.pool.close()
+
+    def _request(self, method, url, headers=None):
+        """
+        Send a request over a pooled connection, following redirects.
+        Returns (final url, connection, response); the caller gives the connection back.
+        """
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", MCSH_version)
+        for i in range(DOWNLOAD_MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            connection = self.pool.get(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                # An idle connection might have been closed by the server; retry on a new one
+                connection.close()
+                connection = self.pool.new(parts.scheme, parts.netloc)
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                self.pool.put(parts.scheme, parts.netloc, connection)
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            return url, connection, response
+        raise DownloadError("Too many redirects: {}".format(url))
+
+    def _release(self, url, connection, response):
+        parts = urlsplit(url)
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(parts.scheme, parts.netloc, connection)
+
+    def _probe(self, url):
+        """
+        Find the final URL, the size, and whether ranges are supported.
+        """
+        url, connection, response = self._request("GET", url, {"Range": "bytes=0-0"})
+        if response.status == 200:
+            # The server sends the whole file instead: don't read it here
+            connection.close()
+        else:
+            response.read()
+            self._release(url, connection, response)
+        if response.status == 206:
+            content_range = response.getheader("Content-Range", "")
+            size = int(content_range.split("/")[-1]) if "/" in content_range else None
+            return url, size, True, response.getheader("ETag")
+        if response.status == 200:
+            length = response.getheader("Content-Length")
+            return url, int(length) if length else None, False, response.getheader("ETag")
+        raise DownloadError("HTTP {} from {}".format(response.status, url))
+
+    def download(self, url, target, sha1=None, sha256=None, progress=None):
+        """
+        Download url to target, verifying the checksum(s) if given.
+        progress: Called with (downloaded bytes, total bytes) as chunks finish.
+        Returns the hex digests {"sha1": ..., "sha256": ...}.
+        """
+        expected = {algorithm: digest.lower() for algorithm, digest in
+                    [("sha1", sha1), ("sha256", sha256)] if digest}
+        log(MODULE_NAME, "INFO", "Downloading {}...", url)
+        url, size, ranges_supported, etag = self._probe(url)
+        if ranges_supported and size:
+            digests = self._download_chunked(url, target, size, etag, progress)
+        else:
+            digests = self._download_stream(url, target, progress)
+        for algorithm, digest in expected.items():
+            if digests[algorithm] != digest:
+                os.remove(target)
+                raise DownloadError("{} mismatch for {}: expected {}, got {}".format(
+                    algorithm.upper(), url, digest, digests[algorithm]))
+        log(MODULE_NAME, "INFO", "Downloaded {} ({} bytes).", target, os.path.getsize(target))
+        return digests
+
+    def _download_stream(self, url, target, progress):
+        """
+        Download without ranges (no resuming possible).
+        """
+        hashes = {algorithm: hashlib.new(algorithm) for algorithm in ["sha1", "sha256"]}
+        part_name = target + ".part"
+        url, connection, response = self._request("GET", url)
+        if response.status != 200:
+            response.read()
+            self._release(url, connection, response)
+            raise DownloadError("HTTP {} from {}".format(response.status, url))
+        total = int(response.getheader("Content-Length") or 0)
+        downloaded = 0
+        with open(part_name, "wb") as f:
+            while True:
+                data = response.read(DOWNLOAD_READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                for hash_object in hashes.values():
+                    hash_object.update(data)
+                downloaded += len(data)
+                if progress is not None:
+                    progress(downloaded, total)
+        self._release(url, connection, response)
+        os.replace(part_name, target)
+        return {algorithm: hash_object.hexdigest() for algorithm, hash_object in hashes.items()}
+
+    def _download_chunked(self, url, target, size, etag, progress):
+        """
+        Download the chunks concurrently into target.part, resuming a previous attempt if possible.
+        """
+        part_name = target + ".part"
+        state_name = target + ".part.json"
+        chunks = [(offset, min(self.chunk_size, size - offset)) for offset in range(0, size, self.chunk_size)]
+        state = {"url": url, "size": size, "etag": etag, "chunk_size": self.chunk_size, "done": []}
+        try:
+            with open(state_name, "r") as f:
+                saved_state = json.load(f)
+                f.close()
+            if os.path.exists(part_name) and all([saved_state.get(key) == state[key]
+                                                  for key in ["size", "etag", "chunk_size"]]):
+                state["done"] = saved_state["done"]
+                log(MODULE_NAME, "INFO", "Resuming download ({} of {} chunks done).",
+                    len(state["done"]), len(chunks))
+        except Exception:
+            pass
+        if not state["done"]:
+            with open(part_name, "wb") as f:
+                f.truncate(size)
+        state_lock = threading.Lock()
+        part_lock = threading.Lock()
+        errors = []
+        with open(part_name, "r+b") as part_file:
+            hasher = _StreamingHasher(["sha1", "sha256"], part_file, part_lock)
+            done = set(state["done"])
+            downloaded = [sum([length for offset, length in chunks if offset in done])]
+            for offset, length in chunks:
+                if offset in done:
+                    hasher.add(offset, length)
+            work = queue.SimpleQueue()
+            for chunk in chunks:
+                if chunk[0] not in done:
+                    work.put(chunk)
+
+            def worker():
+                while not errors:
+                    try:
+                        offset, length = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        data = self._fetch_chunk(url, offset, length)
+                    except Exception as e:
+                        errors.append(e)
+                        return
+                    with part_lock:
+                        part_file.seek(offset)
+                        part_file.write(data)
+                    hasher.add(offset, length, data)
+                    with state_lock:
+                        state["done"].append(offset)
+                        downloaded[0] += length
+                        with open(state_name, "w") as f:
+                            f.write(json.dumps(state))
+                            f.close()
+                        if progress is not None:
+                            progress(downloaded[0], size)
+
+            # Every worker runs in a copy of the caller's context (see MCSH.daemon._OutputRouter)
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker,),
+                                        name="MCSH-Download", daemon=True)
+                       for i in range(min(self.max_connections, len(chunks)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise DownloadError("Download of {} interrupted (it can be resumed): {}".format(url, errors[0]))
+            part_file.flush()
+            digests = hasher.hexdigests()
+        os.replace(part_name, target)
+        os.remove(state_name)
+        return digests
+
+    def _fetch_chunk(self, url, offset, length):
+        """
+        Fetch one chunk, retrying a few times.
+        """
+        for attempt in range(DOWNLOAD_RETRIES):
+            try:
+                url, connection, response = self._request(
+                    "GET", url, {"Range": "bytes={}-{}".format(offset, offset + length - 1)})
+                data = response.read()
+                self._release(url, connection, response)
+                if response.status != 206 or len(data) != length:
+                    raise DownloadError("Bad response for bytes {}-{}: HTTP {}, {} bytes".format(
+                        offset, offset + length - 1, response.status, len(data)))
+                return data
+            except (DownloadError, http.client.HTTPException, OSError) as e:
+                if attempt == DOWNLOAD_RETRIES - 1:
+                    raise
+                log(MODULE_NAME, "WARNING", "Retrying bytes {}-{}: {}", offset, offset + length - 1, e)
+                time.sleep(2 ** attempt)
+
+
+def download_server(entry_name):
+    """
+    Download the server program of a repository entry into the working directory,
+    e.g. --download paper-1.16.4. (--download)
+    The download goes through the artifact cache: installing the same version later doesn't download it again.
+    """
+    from MCSH.artifact_cache import ArtifactCache
+    from MCSH.repository import get_repository, resolve_download
+    from MCSH.update import artifact_name, download_progress
+    entry = get_repository().get(entry_name)
+    if entry is None:
+        log(MODULE_NAME, "ERROR", "{} isn't in the repository, see --reposearch.", entry_name)
+        return
+    cache = ArtifactCache()
+    downloader = Downloader()
+    try:
+        url, sha1, sha256 = resolve_download(entry)
+        digest = cache.fetch(url, sha256, sha1, downloader, artifact_name(entry), download_progress(entry["name"]))
+    except Exception as e:
+        log(MODULE_NAME, "ERROR", "Failed to download {}: {}", entry_name, e)
+        return
+    finally:
+        downloader.close()
+    target = artifact_name(entry)
+    cache.link(digest, target)
+    log(MODULE_NAME, "INFO", "Downloaded {} to {} (SHA-256: {}).", entry_name, os.path.abspath(target), digest)
@@ -25,6 +25,7 @@ def startup_guide():
     # Pre-requirements check
     _choose_colours()
     # Computer evaluation
+    _evaluate_computer()
 
 
 def _choose_colours():
@@ -45,10 +46,20 @@ def _choose_colours():
         config_instance.program_config["color_enabled"] = True
         config_instance.update_config()
     else:
-        log(MODULE_NAME, "INFO", "Successfully disabled console colouring.", True)
+        log(MODULE_NAME, "INFO", "Successfully disabled console colouring.", override_color=True)
         config_instance.program_config["color_enabled"] = False
         config_instance.update_config()
 
 
 def _evaluate_computer():
+    # The benchmark module is only needed here: importing it at the top would slow every startup
+    from MCSH.benchmark import BENCHMARK_TIME_BUDGET, print_results, run_benchmark
     log(MODULE_NAME, "DEBUG", "[Step 3/4] Evaluating computer...")
+    run_tests = input("Run the performance tests now? It takes about {} seconds. [y/n]: ".format(
+        round(sum(BENCHMARK_TIME_BUDGET.values()))))
+    if run_tests.lower() != "y":
+        log(MODULE_NAME, "INFO", "Skipped. Run 'mcsh_cli.py --benchmark' to test later.")
+        return
+    from MCSH.consts import config_instance
+    results = run_benchmark(".")
+    print_results(results, config_instance.computer_info.get("memory_total", 0))
@@ -12,26 +12,53 @@
     Because Linux and Windows handles information in very different ways,
     I had to split the way of getting information for different platforms.
     That means you can't run it on other platforms except for Windows and Linux.
+    The probed information is cached in MCSH/config/computer_info.json,
+    and psutil is only imported when the cache is missing or outdated.
+    Only the facts that don't change are cached: the memory usage is read when it's needed (memory_usage).
 """
-import fileinput
+import json
+import os
 import platform
-import subprocess
 import sys
-
-try:
-    import winreg
-except:
-    pass
-try:
-    import psutil
-except:
-    raise Exception("Pre-initialization error: module 'psutil' not found. "
-                    "Run 'pip install -r requirements.txt' under the root folder and try again.")
+import time
 
 from MCSH.consts import MCSH_version
 from MCSH.logging import log, crash
 
 MODULE_NAME = "get_computer_info"
+COMPUTER_INFO_CACHE_FILE = "MCSH/config/computer_info.json"
+COMPUTER_INFO_CACHE_TTL = 24 * 60 * 60
+# System info that changes while running, never cached
+VOLATILE_SYSTEM_INFO = ["Memory", "Startup Arguments"]
+
+
+def import_psutil():
+    """
+    Import psutil on demand, as importing it takes a noticeable part of the startup.
+    """
+    try:
+        import psutil
+    except:
+        raise Exception("Pre-initialization error: module 'psutil' not found. "
+                        "Run 'pip install -r requirements.txt' under the root folder and try again.")
+    return psutil
+
+
+def memory_usage():
+    """
+    The current memory usage, for the 'System Details' of crash reports.
+    """
+    try:
+        mem = import_psutil().virtual_memory()
+    except Exception:
+        return "Unable to read"
+    return "{mem_used} bytes ({mem_used_mb} MB) / {mem_total} bytes ({mem_total_mb} MB)".format(**{
+        "mem_used": mem.used,
+        "mem_used_mb": round(mem.used / 1024 / 1024),
+        "mem_total": mem.total,
+        "mem_total_mb": round(mem.total / 1024 / 1024)
+    })
+
 
 class ComputerInfo:
     def __init__(self):
@@ -113,14 +140,8 @@ class ComputerInfo:
         Get the memory size.
         """
         log(MODULE_NAME, "DEBUG", "Getting memory size...")
-        mem = psutil.virtual_memory()
-        self.crash_report_system_info["Memory"] = "{mem_used} bytes ({mem_used_mb} MB) / " \
-                                                  "{mem_total} bytes ({mem_total_mb} MB)".format(**{
-            "mem_used": mem.used,
-            "mem_used_mb": round(mem.used / 1024 / 1024),
-            "mem_total": mem.total,
-            "mem_total_mb": round(mem.total / 1024 / 1024)
-        })
+        mem = import_psutil().virtual_memory()
+        self.crash_report_system_info["Memory"] = memory_usage()
         self.computer_info["memory_total"] = round(mem.total / 1024 / 1024 / 1024)
 
     def _get_cpu_count(self):
@@ -128,8 +149,9 @@ class ComputerInfo:
         Get the CPU counts.
         """
         log(MODULE_NAME, "DEBUG", "Getting CPU counts...")
-        self.crash_report_system_info["CPU Count"] = psutil.cpu_count()
-        self.computer_info["cpu"] = psutil.cpu_count()
+        cpu_count = import_psutil().cpu_count()
+        self.crash_report_system_info["CPU Count"] = cpu_count
+        self.computer_info["cpu"] = cpu_count
 
     def _get_argv(self):
         """
@@ -154,15 +176,21 @@ class ComputerInfo:
         try:
             if platform.system() == "Linux":
                 log(MODULE_NAME, "DEBUG", "Linux platform - getting from /proc/cpuinfo...")
-                for line in fileinput.input("/proc/cpuinfo"):
+                with open("/proc/cpuinfo") as f:
+                    cpuinfo = f.read()
+                    f.close()
+                # All cores report their speed, the first one is enough
+                for line in cpuinfo.split("\n"):
                     if 'MHz' in line:
                         value = float(line.split(":")[1].strip())
                         speed = round(value / 1024, 1)
                         self.crash_report_system_info["CPU Speed (Ghz)"] = speed
                         self.computer_info["cpu_freq"] = speed
-                return True
+                        return True
+                raise Exception("No CPU speed in /proc/cpuinfo")
             elif platform.system() in ["Windows", "Win32"]:
                 log(MODULE_NAME, "DEBUG", "Windows platform -- getting from HARDWARE\DESCRIPTION...")
+                import winreg
                 key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"HARDWARE\DESCRIPTION\System\CentralProcessor\0")
                 speed, typeOfElement = winreg.QueryValueEx(key, "~MHz")
                 speed = round(float(speed) / 1024, 1)
@@ -171,6 +199,7 @@ class ComputerInfo:
                 return True
             elif platform.system() == "Darwin":
                 log(MODULE_NAME, "DEBUG", "Mac platform -- getting from system_profiler...")
+                import subprocess
                 command = 'system_profiler SPHardwareDataType | grep "Processor Speed" | cut -d ":" -f2'
                 proc = subprocess.Popen([command], shell=True, stdout=subprocess.PIPE)
                 output = proc.communicate()[0]
@@ -190,14 +219,63 @@ class ComputerInfo:
             self.computer_info["cpu_freq"] = None
             return False
 
-    def get_computer_info(self):
+    def _load_cache(self):
+        """
+        Load the cached hardware information.
+        The cache is only used if it's not outdated, and was made by the same MCSH, Python and OS.
+        """
+        try:
+            if time.time() - os.path.getmtime(COMPUTER_INFO_CACHE_FILE) > COMPUTER_INFO_CACHE_TTL:
+                log(MODULE_NAME, "DEBUG", "Computer info cache outdated.")
+                return False
+            with open(COMPUTER_INFO_CACHE_FILE, "r") as f:
+                cache = json.load(f)
+                f.close()
+            if cache["MCSH Version"] != MCSH_version \
+                    or cache["Python version"] != sys.version.replace('\n', '').replace('\r', '') \
+                    or cache["Operating System"] != platform.platform():
+                log(MODULE_NAME, "DEBUG", "Computer info cache doesn't match the current environment.")
+                return False
+            self.computer_info.update(cache["computer_info"])
+            self.crash_report_system_info.update({key: value for key, value in cache["crash_report_system_info"].items()
+                                                  if key not in VOLATILE_SYSTEM_INFO})
+        except Exception:
+            log(MODULE_NAME, "DEBUG", "No usable computer info cache.")
+            return False
+        log(MODULE_NAME, "DEBUG", "Loaded computer info from cache.")
+        return True
+
+    def _save_cache(self):
+        """
+        Save the probed hardware information to the cache.
+        """
+        try:
+            os.makedirs(os.path.dirname(COMPUTER_INFO_CACHE_FILE), exist_ok=True)
+            with open(COMPUTER_INFO_CACHE_FILE, "w") as f:
+                f.write(json.dumps({
+                    "MCSH Version": self.crash_report_system_info["MCSH Version"],
+                    "Python version": self.crash_report_system_info["Python version"],
+                    "Operating System": self.crash_report_system_info["Operating System"],
+                    "computer_info": self.computer_info,
+                    "crash_report_system_info": {key: value for key, value in self.crash_report_system_info.items()
+                                                 if key not in VOLATILE_SYSTEM_INFO}
+                }))
+                f.close()
+        except Exception:
+            log(MODULE_NAME, "DEBUG", "Failed to save computer info cache.")
+
+    def get_computer_info(self, use_cache=True):
         """
         The main function of this module.
         Gets all the information.
+        use_cache: Use the cached hardware information if possible.
         """
         log(MODULE_NAME, "DEBUG", "get_computer_info called -- getting infos...")
         self._pre_check_req_python()
         self._pre_check_req_system()
+        if use_cache and self._load_cache():
+            self._get_argv()
+            return
         self._get_MCSH_version()
         self._get_operating_system()
         self._get_python_version()
@@ -211,3 +289,4 @@ class ComputerInfo:
             log("get_computer_info", "WARNING", "Can't determine CPU speed "
                                                 "(Probably using platforms except Linux, Windows or Mac). "
                                                 "'Performance Tester' will be unavailable.")
+        self._save_cache()
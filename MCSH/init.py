@@ -15,6 +15,7 @@ from MCSH.config import Config
 from MCSH.consts import insert_cfg_instance
 from MCSH.first_time_setup import startup_guide
 from MCSH.logging import initialize_logger, log
+from MCSH.startup_profile import phase, print_report
 
 config_instance = None
 MODULE_NAME = "init"
@@ -24,22 +25,33 @@ def init():
     """
     Initializes all modules.
     """
+    try:
+        _init()
+    finally:
+        print_report()
+
+
+def _init():
     # Logger Module
     global config_instance
-    initialize_logger()
+    with phase("Initialize logger"):
+        initialize_logger()
     log(MODULE_NAME, "DEBUG", "Pre-initializing...")
     # If it's first time to run this program
     if not os.path.exists("./MCSH/logs") or not os.path.exists("./MCSH/config/MCSH.json"):
         log(MODULE_NAME, "DEBUG", "Detected first time to use this program -- starting up guide...")
-        config_instance = Config(flag_first_time_start=True)
+        with phase("Initialize config"):
+            config_instance = Config(flag_first_time_start=True)
         log(MODULE_NAME, "DEBUG", "Inserting CFG instance to INSTANCES...")
         insert_cfg_instance(config_instance)
         startup_guide()
     else:
         # Config Module
         log(MODULE_NAME, "DEBUG", "Initializing config module...")
-        config_instance = Config()
+        with phase("Initialize config"):
+            config_instance = Config()
         log(MODULE_NAME, "DEBUG", "Inserting CFG instance to INSTANCES...")
         insert_cfg_instance(config_instance)
         log(MODULE_NAME, "DEBUG", "Config initialised -- parsing arguments...")
-        config_instance.parser_parse()
+        with phase("Parse arguments"):
+            config_instance.parser_parse()
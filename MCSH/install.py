@@ -0,0 +1,164 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.install
+ Module Revision: 0.0.1-18
+ Module Description:
+    Installs, removes and reinstalls servers.
+    Server directories: ./MCSH/servers/<name>
+"""
+import os
+
+from MCSH.logging import log
+
+MODULE_NAME = "install"
+SERVERS_PATH = "./MCSH/servers"
+JE_JAR_FILE = "server.jar"
+
+
+def _daemon_supervisor_thread():
+    """
+    Get the supervisor thread of the daemon if this runs in it, or None.
+    """
+    from MCSH.daemon import running_daemon
+    return running_daemon.supervisor_thread if running_daemon is not None else None
+
+
+def managed_server(server_name, record):
+    """
+    Get the supervisor entry (MCSH.supervisor.ManagedServer) of an installed server.
+    """
+    if record["type"] == "BE":
+        from MCSH.bedrock import managed_server as bedrock_server
+        return bedrock_server(server_name, record)
+    from MCSH.jvm_tuning import managed_server as java_server
+    return java_server(server_name, record)
+
+
+def install_server(arguments):
+    """
+    Install a server of a repository entry, e.g. --install bedrock-1.16.201.02 Test. (--install)
+    """
+    from MCSH.artifact_cache import ArtifactCache
+    from MCSH.download import Downloader
+    from MCSH.repository import get_repository, resolve_download
+    from MCSH.servers import get_registry
+    from MCSH.update import artifact_name, download_progress
+    entry_name, server_name = arguments
+    registry = get_registry()
+    if server_name in registry:
+        log(MODULE_NAME, "ERROR", "Server {} already exists.", server_name)
+        return
+    entry = get_repository().get(entry_name)
+    if entry is None:
+        log(MODULE_NAME, "ERROR", "{} isn't in the repository, see --reposearch.", entry_name)
+        return
+    directory = os.path.join(SERVERS_PATH, server_name)
+    if os.path.isdir(directory) and os.listdir(directory):
+        log(MODULE_NAME, "ERROR", "{} already exists and isn't empty.", directory)
+        return
+    cache = ArtifactCache()
+    downloader = Downloader()
+    try:
+        url, sha1, sha256 = resolve_download(entry)
+        digest = cache.fetch(url, sha256, sha1, downloader, artifact_name(entry), download_progress(entry["name"]))
+    except Exception as e:
+        log(MODULE_NAME, "ERROR", "Failed to download {}: {}", entry_name, e)
+        return
+    finally:
+        downloader.close()
+    record = {"type": entry["type"], "flavour": entry["flavour"], "version": entry["version"],
+              "channel": entry["channel"], "build": entry["build"], "directory": os.path.abspath(directory),
+              "artifact": digest}
+    if entry["type"] == "BE":
+        from MCSH.bedrock import install_bedrock
+        install_bedrock(registry, server_name, directory, digest, cache)
+    else:
+        record["jar"] = JE_JAR_FILE
+        cache.link(digest, os.path.join(directory, JE_JAR_FILE))
+    registry.add(server_name, record)
+    supervisor_thread = _daemon_supervisor_thread()
+    if supervisor_thread is not None:
+        from MCSH.jvm_tuning import update_launch_profiles
+        supervisor_thread.call_function(supervisor_thread.supervisor.add_server,
+                                        managed_server(server_name, registry.get(server_name)))
+        # The other servers have a smaller share of the RAM now
+        update_launch_profiles(supervisor_thread)
+    log(MODULE_NAME, "INFO", "Installed server {} ({} {}) in {}.", server_name, entry["flavour"],
+        entry["version"], directory)
+
+
+def remove_servers(server_names):
+    """
+    Remove server(s), with their directories. (--remove)
+    Their backups are kept.
+    """
+    import shutil
+    from MCSH.artifact_cache import ArtifactCache
+    from MCSH.servers import DEFAULT_STATE, get_registry
+    registry = get_registry()
+    cache = ArtifactCache()
+    removed = 0
+    for server_name in server_names:
+        server = registry.get(server_name)
+        if server is None:
+            log(MODULE_NAME, "ERROR", "There's no server named {}.", server_name)
+            continue
+        if server.get("state", DEFAULT_STATE) != DEFAULT_STATE:
+            log(MODULE_NAME, "ERROR", "Server {} is {}. Stop it first.", server_name, server["state"])
+            continue
+        cache.release_directory(server["directory"])
+        try:
+            shutil.rmtree(server["directory"])
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log(MODULE_NAME, "ERROR", "Failed to remove the directory of server {}: {}", server_name, e)
+            continue
+        registry.remove(server_name)
+        supervisor_thread = _daemon_supervisor_thread()
+        if supervisor_thread is not None and server_name in supervisor_thread.supervisor.servers:
+            supervisor_thread.call_function(supervisor_thread.supervisor.remove_server, server_name)
+        removed += 1
+        log(MODULE_NAME, "INFO", "Removed server {}.", server_name)
+    if removed:
+        supervisor_thread = _daemon_supervisor_thread()
+        if supervisor_thread is not None:
+            from MCSH.jvm_tuning import update_launch_profiles
+            update_launch_profiles(supervisor_thread)
+        # Server jars no other server uses
+        cache.garbage_collect()
+
+
+def reinstall_server(server_name):
+    """
+    Reinstall the program of a server (the same version), keeping its worlds and settings. (--reinstall)
+    """
+    from MCSH.artifact_cache import ArtifactCache
+    from MCSH.download import Downloader
+    from MCSH.repository import get_repository
+    from MCSH.servers import get_registry
+    from MCSH.update import UpdatePlanner
+    registry = get_registry()
+    server = registry.get(server_name)
+    if server is None:
+        log(MODULE_NAME, "ERROR", "There's no server named {}.", server_name)
+        return
+    repository = get_repository()
+    entry = repository.get("{}-{}".format(server["flavour"], server["version"]))
+    if entry is None:
+        log(MODULE_NAME, "ERROR", "{} {} isn't in the repository.", server["flavour"], server["version"])
+        return
+    downloader = Downloader()
+    try:
+        planner = UpdatePlanner(registry, repository, ArtifactCache(), downloader)
+        planner.plan_server(server_name, entry)
+        if planner.run():
+            log(MODULE_NAME, "INFO", "Server {} is reinstalled.", server_name)
+        else:
+            log(MODULE_NAME, "ERROR", "Failed to reinstall server {}, see the log above.", server_name)
+    finally:
+        downloader.close()
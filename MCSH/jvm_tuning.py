@@ -0,0 +1,262 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.jvm_tuning
+ Module Revision: 0.0.1-18
+ Module Description:
+    Generates the launch profile (heap size, GC and thread flags) of Java Edition servers.
+    The host RAM left after the OS reserve is split between all the installed servers, JE and BE
+    (by their expected players: 'players' of the record, or max-players), capped by the 'optimal'
+    tier of perf_recommend/je.json. ZGC is used only when the server's Java is known to support it.
+    Profiles are saved to MCSH/config/launch_profiles.json, and reused
+    as long as the hardware and the co-hosted servers stay the same.
+    The daemon launches the JE servers with them (managed_server), and updates the profiles
+    of all of them when a server is installed or removed (update_launch_profiles).
+"""
+import json
+import os
+import re
+
+from MCSH.logging import log
+
+MODULE_NAME = "jvm_tuning"
+LAUNCH_PROFILES_FILE = "MCSH/config/launch_profiles.json"
+# RAM kept for the OS and others: the larger of the two (MB)
+OS_RESERVED_MIN_MB = 1024
+OS_RESERVED_RATIO = 0.1
+# Part of a server's RAM share used as heap; the rest is for metaspace, threads, direct buffers...
+HEAP_RATIO = 0.85
+HEAP_MIN_MB = 1024
+# Heaps this large are tuned with the 'large heap' G1 settings
+G1_LARGE_HEAP_MB = 12 * 1024
+# ZGC is used for huge heaps when the Java version supports it well
+ZGC_MIN_HEAP_MB = 32 * 1024
+ZGC_MIN_JAVA_VERSION = 17
+JAVA_VERSION_TIMEOUT = 10
+# Expected players of a server without 'players' or max-players (the vanilla default of max-players)
+DEFAULT_PLAYERS = 20
+# Java command -> major version (or None), found once per run
+_java_versions = {}
+
+
+def _heap_cap_mb():
+    """
+    The heap cap: RAM of the 'optimal' tier in perf_recommend/je.json.
+    """
+    try:
+        with open("MCSH/perf_recommend/je.json", "r") as f:
+            tiers = json.load(f)
+            f.close()
+        return int(tiers["optimal"]["RAM"] * 1024)
+    except Exception:
+        return 16 * 1024
+
+
+def compute_launch_profile(memory_total_gb, cpu_count, server_count=1,
+                           weight=1, total_weight=None, java_version=None):
+    """
+    Compute the launch profile of a server.
+    memory_total_gb, cpu_count: The host hardware (see MCSH.get_computer_info).
+    server_count: How many servers share the host.
+    weight, total_weight: The server's share (e.g. expected players) and the sum of all shares.
+    java_version: The Java major version, if known.
+    """
+    server_count = max(int(server_count), 1)
+    total_weight = total_weight or server_count
+    memory_total_mb = int(memory_total_gb * 1024)
+    available_mb = memory_total_mb - max(OS_RESERVED_MIN_MB, int(memory_total_mb * OS_RESERVED_RATIO))
+    share_mb = available_mb * weight / total_weight
+    heap_mb = int(share_mb * HEAP_RATIO) // 256 * 256
+    heap_mb = min(max(heap_mb, HEAP_MIN_MB), _heap_cap_mb())
+    if heap_mb > share_mb:
+        log(MODULE_NAME, "WARNING", "A {} MB heap doesn't fit in the server's {} MB share of the RAM, "
+                                    "the servers might be swapped out.", heap_mb, int(share_mb))
+    cpu_share = max((cpu_count or 1) // server_count, 1)
+    parallel_gc_threads = cpu_share
+    concurrent_gc_threads = max(parallel_gc_threads // 4, 1)
+    flags = ["-Xms{}M".format(heap_mb), "-Xmx{}M".format(heap_mb), "-XX:+AlwaysPreTouch",
+             "-XX:+DisableExplicitGC", "-XX:+ParallelRefProcEnabled", "-XX:+PerfDisableSharedMem"]
+    if heap_mb >= ZGC_MIN_HEAP_MB and java_version is not None and java_version >= ZGC_MIN_JAVA_VERSION:
+        gc = "ZGC"
+        flags += ["-XX:+UseZGC", "-XX:ConcGCThreads={}".format(concurrent_gc_threads)]
+    else:
+        # G1 settings for Minecraft servers, following Aikar's flags
+        gc = "G1"
+        large_heap = heap_mb >= G1_LARGE_HEAP_MB
+        region_size_mb = 16 if large_heap else 8
+        flags += ["-XX:+UseG1GC",
+                  "-XX:+UnlockExperimentalVMOptions",
+                  "-XX:MaxGCPauseMillis=200",
+                  "-XX:G1NewSizePercent={}".format(40 if large_heap else 30),
+                  "-XX:G1MaxNewSizePercent={}".format(50 if large_heap else 40),
+                  "-XX:G1HeapRegionSize={}M".format(region_size_mb),
+                  "-XX:G1ReservePercent=20",
+                  "-XX:G1HeapWastePercent=5",
+                  "-XX:G1MixedGCCountTarget=4",
+                  "-XX:InitiatingHeapOccupancyPercent={}".format(15 if large_heap else 20),
+                  "-XX:G1MixedGCLiveThresholdPercent=90",
+                  "-XX:G1RSetUpdatingPauseTimePercent=5",
+                  "-XX:SurvivorRatio=32",
+                  "-XX:MaxTenuringThreshold=1",
+                  "-XX:ParallelGCThreads={}".format(parallel_gc_threads),
+                  "-XX:ConcGCThreads={}".format(concurrent_gc_threads)]
+    return {
+        "heap_mb": heap_mb,
+        "gc": gc,
+        "parallel_gc_threads": parallel_gc_threads,
+        "concurrent_gc_threads": concurrent_gc_threads,
+        "flags": flags
+    }
+
+
+def java_version(java="java"):
+    """
+    Get the major version of a Java runtime (from 'java -version'), or None if it can't be run.
+    """
+    if java not in _java_versions:
+        import subprocess
+        version = None
+        try:
+            output = subprocess.run([java, "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    timeout=JAVA_VERSION_TIMEOUT).stdout.decode(errors="replace")
+            # 'version "1.8.0_275"' (Java 8 and older) or 'version "17.0.1"'
+            match = re.search(r'version "(?:1\.)?([0-9]+)', output)
+            if match is not None:
+                version = int(match.group(1))
+        except (OSError, subprocess.SubprocessError):
+            pass
+        if version is None:
+            log(MODULE_NAME, "WARNING", "Can't find the version of Java '{}'.", java)
+        _java_versions[java] = version
+    return _java_versions[java]
+
+
+def server_weight(record):
+    """
+    The expected players of a server: 'players' of its record, or max-players of its server.properties.
+    """
+    from MCSH.server_properties import read_server_properties
+    if record.get("players"):
+        return int(record["players"])
+    try:
+        return max(int(read_server_properties(record["directory"]).get("max-players", DEFAULT_PLAYERS)), 1)
+    except ValueError:
+        return DEFAULT_PLAYERS
+
+
+def _load_profiles():
+    try:
+        with open(LAUNCH_PROFILES_FILE, "r") as f:
+            profiles = json.load(f)
+            f.close()
+        return profiles
+    except Exception:
+        return {}
+
+
+def _save_profiles(profiles):
+    temp_file = "{}.{}.tmp".format(LAUNCH_PROFILES_FILE, os.getpid())
+    try:
+        with open(temp_file, "w") as f:
+            f.write(json.dumps(profiles))
+            f.close()
+        os.replace(temp_file, LAUNCH_PROFILES_FILE)
+    except Exception:
+        log(MODULE_NAME, "WARNING", "Failed to save the launch profiles.")
+
+
+def get_launch_profile(server_name, computer_info, server_count=1, weight=1, total_weight=None,
+                       java_version=None, recompute=False):
+    """
+    Get the saved launch profile of a server, computing (and saving) it if
+    there's none, or the hardware or the co-hosted servers changed.
+    computer_info: The computer_info dict of MCSH.get_computer_info.
+    """
+    inputs = {
+        "memory_total": computer_info.get("memory_total"),
+        "cpu": computer_info.get("cpu"),
+        "server_count": server_count,
+        "weight": weight,
+        "total_weight": total_weight,
+        "java_version": java_version
+    }
+    profiles = _load_profiles()
+    saved = profiles.get(server_name)
+    if not recompute and saved is not None and saved.get("inputs") == inputs:
+        log(MODULE_NAME, "DEBUG", "Reusing the launch profile of {}.", server_name)
+        return saved["profile"]
+    profile = compute_launch_profile(inputs["memory_total"] or 0, inputs["cpu"] or 1,
+                                     server_count, weight, total_weight, java_version)
+    log(MODULE_NAME, "INFO", "Launch profile of {}: {} MB heap, {} GC, {} GC threads.",
+        server_name, profile["heap_mb"], profile["gc"], profile["parallel_gc_threads"])
+    profiles[server_name] = {"inputs": inputs, "profile": profile}
+    _save_profiles(profiles)
+    return profile
+
+
+def build_java_command(profile, jar_file, java="java", nogui=True):
+    """
+    Build the command line to launch a JE server with the profile.
+    """
+    command = [java] + profile["flags"] + ["-jar", jar_file]
+    if nogui:
+        command.append("nogui")
+    return command
+
+
+def _java_command(server_name, record, records):
+    """
+    Build the command line of a JE server, with its share of the RAM of the servers (name -> record).
+    """
+    from MCSH.consts import config_instance
+    weights = {name: server_weight(other) for name, other in records.items()}
+    weights.setdefault(server_name, server_weight(record))
+    java = record.get("java", "java")
+    profile = get_launch_profile(server_name, config_instance.computer_info, server_count=len(weights),
+                                 weight=weights[server_name], total_weight=sum(weights.values()),
+                                 java_version=java_version(java))
+    return build_java_command(profile, record["jar"], java)
+
+
+def managed_server(server_name, record):
+    """
+    Get the supervisor entry (MCSH.supervisor.ManagedServer) of a JE server,
+    launched with its launch profile. The RAM is shared by all the installed servers.
+    """
+    from MCSH.servers import get_registry
+    from MCSH.supervisor import ManagedServer
+    directory = os.path.abspath(record["directory"])
+    return ManagedServer(server_name, "JE", _java_command(server_name, record, dict(get_registry().items())),
+                         cwd=directory)
+
+
+def update_launch_profiles(supervisor_thread):
+    """
+    Recompute the launch profiles of the JE servers of a supervisor (MCSH.supervisor.SupervisorThread)
+    after servers were installed or removed (the servers that are running get theirs when they're restarted),
+    and forget the removed servers.
+    """
+    from MCSH.servers import get_registry
+    supervisor = supervisor_thread.supervisor
+    records = dict(get_registry().items())
+    # The profiles are computed here; only the commands are changed on the supervisor loop
+    servers = supervisor_thread.call_function(
+        lambda: [(server_name, server.server_type) for server_name, server in supervisor.servers.items()])
+    commands = {server_name: _java_command(server_name, records[server_name], records)
+                for server_name, server_type in servers if server_type == "JE" and server_name in records}
+
+    def set_commands():
+        for server_name, command in commands.items():
+            if server_name in supervisor.servers:
+                supervisor.servers[server_name].command = command
+
+    supervisor_thread.call_function(set_commands)
+    profiles = _load_profiles()
+    removed = [server_name for server_name in profiles if server_name not in records]
+    if removed:
+        for server_name in removed:
+            del profiles[server_name]
+        _save_profiles(profiles)
@@ -0,0 +1,276 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.lag_detector
+ Module Revision: 0.0.1-18
+ Module Description:
+    Watches the TPS/MSPT of the servers, and captures a lag report on a sustained regression.
+    Observations come from the console events ("Can't keep up!" warnings, TPS lines),
+    or from anything calling observe() (e.g. RCON polling).
+    A lag report holds a few thread dumps of the server (jcmd or jstack, if a JDK is found),
+    the per-thread CPU usage during the lag and a resource snapshot, and goes to the
+    crash report folder (./MCSH/crash_report/LAG_<server>_<time>.log).
+    Captures are rate-limited per server and overall, and old reports are archived.
+"""
+import collections
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from MCSH.consts import LAG_REPORT_FORMAT
+from MCSH.crash_report import CRASH_REPORT_KEEP_UNARCHIVED
+from MCSH.get_computer_info import import_psutil
+from MCSH.logging import log
+from MCSH.rotation import Rotator
+
+MODULE_NAME = "lag_detector"
+LAG_REPORT_PATH = "./MCSH/crash_report"
+# An observation is bad if the TPS is below this, or a tick takes longer than this (ms)
+LAG_TPS_THRESHOLD = 18.0
+LAG_MSPT_THRESHOLD = 50.0
+# A regression is sustained when this many bad observations happen within the window (seconds)
+LAG_TRIGGER_COUNT = 3
+LAG_WINDOW = 300
+# Rate limits: seconds between two captures of a server, and captures per hour of all the servers
+LAG_CAPTURE_COOLDOWN = 1800
+LAG_CAPTURES_PER_HOUR = 4
+# Thread dumps taken per capture, a few seconds apart, so stuck threads stand out
+LAG_DUMP_COUNT = 3
+LAG_DUMP_INTERVAL = 2
+LAG_DUMP_TIMEOUT = 30
+LAG_TOP_THREADS = 10
+LAG_OBSERVATIONS_KEPT = 20
+
+
+def _find_dump_tool(command):
+    """
+    Find jcmd or jstack, next to the java of the server command first.
+    Returns (tool name, path), or (None, None).
+    """
+    java_directory = os.path.dirname(command[0]) if command else ""
+    for tool in ["jcmd", "jstack"]:
+        path = (shutil.which(tool, path=java_directory) if java_directory else None) or shutil.which(tool)
+        if path is not None:
+            return tool, path
+    return None, None
+
+
+def take_thread_dumps(pid, command=None, count=LAG_DUMP_COUNT, interval=LAG_DUMP_INTERVAL):
+    """
+    Take thread dumps of a Java process.
+    Returns (tool name, list of dumps).
+    """
+    tool, path = _find_dump_tool(command)
+    if tool is None:
+        return None, ["Unavailable: neither jcmd nor jstack was found (a JDK is needed, not only a JRE)."]
+    arguments = [path, str(pid), "Thread.print", "-l"] if tool == "jcmd" else [path, "-l", str(pid)]
+    dumps = []
+    for i in range(count):
+        if i:
+            time.sleep(interval)
+        try:
+            result = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True, timeout=LAG_DUMP_TIMEOUT)
+            dumps.append("[{}] {}".format(time.strftime("%H:%M:%S"), result.stdout.strip()))
+        except (OSError, subprocess.SubprocessError) as e:
+            dumps.append("[{}] Failed: {}".format(time.strftime("%H:%M:%S"), e))
+    return tool, dumps
+
+
+def take_resource_snapshot(pid):
+    """
+    Take a resource snapshot of a process and of the system, as text.
+    The CPU usage (also per thread) is measured over a second.
+    """
+    psutil = import_psutil()
+    lines = []
+    psutil.cpu_percent(interval=None)
+    try:
+        process = psutil.Process(pid)
+        threads_before = {thread.id: thread.user_time + thread.system_time for thread in process.threads()}
+        cpu_percent = process.cpu_percent(interval=1)
+        with process.oneshot():
+            memory = process.memory_info()
+            lines.append("  Process CPU: {}%".format(cpu_percent))
+            lines.append("  Process Memory: RSS {} MB, VMS {} MB".format(
+                round(memory.rss / 1024 / 1024, 1), round(memory.vms / 1024 / 1024, 1)))
+            lines.append("  Threads: {}".format(process.num_threads()))
+            if hasattr(process, "num_fds"):
+                lines.append("  Open File Descriptors: {}".format(process.num_fds()))
+            if hasattr(process, "io_counters"):
+                io = process.io_counters()
+                lines.append("  IO: {} MB read, {} MB written".format(
+                    round(io.read_bytes / 1024 / 1024, 1), round(io.write_bytes / 1024 / 1024, 1)))
+            threads = process.threads()
+        # The thread IDs are the 'nid' of the thread dumps
+        thread_usage = sorted([(thread.user_time + thread.system_time - threads_before.get(thread.id, 0), thread)
+                               for thread in threads], key=lambda item: item[0], reverse=True)[:LAG_TOP_THREADS]
+        lines.append("  Busiest Threads (last second):")
+        lines.extend(["    nid={}: {}% CPU ({}s in total)".format(
+            hex(thread.id), round(usage * 100, 1), round(thread.user_time + thread.system_time, 1))
+            for usage, thread in thread_usage])
+    except psutil.Error as e:
+        lines.append("  Process: unavailable ({})".format(e))
+    memory = psutil.virtual_memory()
+    lines.append("  System CPU: {}%".format(psutil.cpu_percent(interval=None)))
+    if hasattr(os, "getloadavg"):
+        lines.append("  Load Average: {}".format(", ".join(["{:.2f}".format(i) for i in os.getloadavg()])))
+    lines.append("  System Memory: {}% used, {} MB available".format(
+        memory.percent, round(memory.available / 1024 / 1024, 1)))
+    lines.append("  Swap: {}% used".format(psutil.swap_memory().percent))
+    return "\n".join(lines)
+
+
+def write_lag_report(server_name, pid, description, observations, resources, dump_tool, thread_dumps):
+    """
+    Write a lag report to the crash report folder. Returns its file name.
+    """
+    os.makedirs(LAG_REPORT_PATH, exist_ok=True)
+    # Older reports go to ./MCSH/crash_report/archive, like the crash reports
+    try:
+        Rotator(LAG_REPORT_PATH, max_bytes=0, rotate_daily=False).archive_old(keep=CRASH_REPORT_KEEP_UNARCHIVED)
+    except Exception:
+        log(MODULE_NAME, "WARNING", "Failed to pack the old reports.")
+    from MCSH.consts import config_instance
+    computer_crash_info = config_instance.crash_info if config_instance is not None else None
+    report = LAG_REPORT_FORMAT.format(**{
+        "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+        "server": server_name,
+        "pid": pid,
+        "description": description,
+        "observations": "\n".join(observations) or "-",
+        "resources": resources,
+        "dump_tool": dump_tool or "none",
+        "thread_dumps": "\n\n".join(thread_dumps),
+        "computer_crash_info": "".join(["  {}: {}\n".format(key, value)
+                                        for key, value in computer_crash_info.items()])
+        if computer_crash_info else "???"
+    })
+    report_name = os.path.join(LAG_REPORT_PATH, "LAG_{}_{}.log".format(
+        re.sub(r"[^A-Za-z0-9_.-]", "_", server_name), time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())))
+    with open(report_name, "w") as f:
+        f.write(report)
+        f.close()
+    return report_name
+
+
+class LagDetector:
+    """
+    Detects sustained lag of the servers of a supervisor, and captures lag reports.
+    """
+
+    def __init__(self, supervisor=None, metrics_store=None):
+        """
+        supervisor: Where the processes of the servers are found.
+        metrics_store: If given, the observed TPS and MSPT are stored in it.
+        """
+        self.supervisor = supervisor
+        self.metrics_store = metrics_store
+        self.bad_observations = {}
+        self.observations = {}
+        self.last_capture = {}
+        self.capture_times = collections.deque()
+        self.capturing = set()
+        self._lock = threading.Lock()
+
+    def observe(self, server_name, tps=None, mspt=None, lag=None, timestamp=None):
+        """
+        Observe the TPS, the MSPT (ms per tick) or a lag warning (ms behind) of a server.
+        Returns True if it starts a capture.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.metrics_store is not None and (tps is not None or mspt is not None):
+            self.metrics_store.append(server_name, timestamp, tps=tps, mspt=mspt)
+        bad = lag is not None or (tps is not None and tps < LAG_TPS_THRESHOLD) \
+            or (mspt is not None and mspt > LAG_MSPT_THRESHOLD)
+        with self._lock:
+            observations = self.observations.setdefault(server_name,
+                                                        collections.deque(maxlen=LAG_OBSERVATIONS_KEPT))
+            observations.append("  {}{}{}{}{}".format(
+                time.strftime("%H:%M:%S", time.localtime(timestamp)),
+                " TPS {:g}".format(tps) if tps is not None else "",
+                " MSPT {:g}".format(mspt) if mspt is not None else "",
+                " {:g}ms behind".format(lag) if lag is not None else "", " (bad)" if bad else ""))
+            if not bad:
+                return False
+            window = self.bad_observations.setdefault(server_name, collections.deque())
+            window.append(timestamp)
+            # Observations from before the window (e.g. parsed from an old log) never trigger a capture
+            while window and window[0] < time.time() - LAG_WINDOW:
+                window.popleft()
+            if len(window) < LAG_TRIGGER_COUNT or not self._may_capture(server_name):
+                return False
+            window.clear()
+            self.capturing.add(server_name)
+            self.last_capture[server_name] = self.capture_times[-1]
+            observations = list(observations)
+        description = "{} bad TPS/MSPT observations within {} seconds.".format(LAG_TRIGGER_COUNT, LAG_WINDOW)
+        log(MODULE_NAME, "WARNING", "Server {} is lagging, capturing a lag report...", server_name)
+        threading.Thread(target=self._capture, args=(server_name, description, observations),
+                         name="MCSH-LagCapture", daemon=True).start()
+        return True
+
+    def _may_capture(self, server_name):
+        """
+        Check the rate limits (holding the lock), and count a capture if it's allowed.
+        """
+        now = time.time()
+        while self.capture_times and self.capture_times[0] < now - 3600:
+            self.capture_times.popleft()
+        if server_name in self.capturing:
+            return False
+        if now - self.last_capture.get(server_name, 0) < LAG_CAPTURE_COOLDOWN:
+            log(MODULE_NAME, "DEBUG", "Server {} is lagging, but it was captured recently.", server_name)
+            return False
+        if len(self.capture_times) >= LAG_CAPTURES_PER_HOUR:
+            log(MODULE_NAME, "DEBUG", "Server {} is lagging, but the hourly capture limit is reached.", server_name)
+            return False
+        self.capture_times.append(now)
+        return True
+
+    def event_listener(self, server_name, event):
+        """
+        The event listener for MCSH.console_events.
+        """
+        event_time, event_type, player, value, text = event
+        if event_type == "lag":
+            self.observe(server_name, lag=value, timestamp=event_time)
+        elif event_type == "tps" and value is not None:
+            self.observe(server_name, tps=value, timestamp=event_time)
+
+    def capture(self, server_name, description="Requested.", observations=()):
+        """
+        Capture a lag report of a server now (bypassing the rate limits).
+        Returns the report file name, or None if the server isn't running.
+        """
+        server = self.supervisor.servers.get(server_name) if self.supervisor is not None else None
+        pid = server.pid if server is not None else None
+        if pid is None:
+            log(MODULE_NAME, "WARNING", "Server {} isn't running, no lag report is captured.", server_name)
+            return None
+        start = time.perf_counter()
+        resources = take_resource_snapshot(pid)
+        if server.server_type == "JE":
+            dump_tool, thread_dumps = take_thread_dumps(pid, server.command)
+        else:
+            dump_tool, thread_dumps = None, ["Unavailable: not a Java server."]
+        report_name = write_lag_report(server_name, pid, description, list(observations), resources,
+                                       dump_tool, thread_dumps)
+        log(MODULE_NAME, "WARNING", "Lag report of server {} captured in {}s: {}", server_name,
+            round(time.perf_counter() - start, 1), report_name)
+        return report_name
+
+    def _capture(self, server_name, description, observations):
+        try:
+            self.capture(server_name, description, observations)
+        except Exception as e:
+            log(MODULE_NAME, "ERROR", "Failed to capture a lag report of server {}: {}", server_name, e)
+        finally:
+            with self._lock:
+                self.capturing.discard(server_name)
@@ -9,63 +9,283 @@
  Module Description:
     A module for all the shared functions.
     Including Logging, Downloading, etc.
+    Log records are handed to sinks (console and file) with their own level threshold.
+    The file sink uses a background writer thread,
+    which keeps the log file open and writes records in batches.
 """
+import atexit
 import os
-import tarfile
+import queue
+import threading
 import time
 
 from MCSH.consts import LOGGING_COLORS
 from MCSH.crash_report import generate_crash_report
+from MCSH.rotation import Rotator
 
 logging_file_name = ""
 DEBUG = False
 color_enabled = False
+LOG_LEVELS = {
+    "FATAL": 50,
+    "ERROR": 40,
+    "WARNING": 30,
+    "INFO": 20,
+    "DEBUG": 10
+}
+# Batch thresholds of the log writer
+LOG_FLUSH_SIZE = 64
+LOG_FLUSH_INTERVAL = 0.5
+LOG_FLUSH_TIMEOUT = 5
+# Logs of previous runs kept outside the archive
+LOG_KEEP_UNARCHIVED = 9
+_log_writer = None
+_log_rotator = None
+_log_sinks = []
+# The lowest level any sink accepts; anything below is dropped in one comparison.
+_log_min_level = LOG_LEVELS["INFO"]
 
 
-# The logger in-program.
-def log(log_module, log_severity, log_text, override_color=False):
+class LogRecord:
     """
-    The logging function for MCSH.
-    log_severity: FATAL, ERROR, WARNING, INFO, DEBUG
+    A single log message.
+    The message is rendered only once, and every sink formats the record itself.
     """
-    try:
-        if color_enabled:
-            log_color = LOGGING_COLORS[log_severity]
-        else:
-            log_color = ""
-    except:
-        log_color = ""
-    # Color override (in case config isn't here)
-    if override_color:
-        log_color = ""
-    # Convert to string
-    log_text = str(log_text)
-    log_text_lines = log_text.split("\n")
-    for log_text in log_text_lines:
-        log_formatted_text = "[{time}-{process_time}] [{log_module}/{log_severity}]: {log}".format(**{
-            "time": time.strftime("%H:%M:%S", time.localtime()),
-            "process_time": time.process_time(),
-            "log_module": log_module,
-            "log_severity": log_severity,
-            "log": log_text
+    __slots__ = ("time", "process_time", "module", "severity", "level",
+                 "text", "args", "override_color", "_message")
+
+    def __init__(self, log_module, log_severity, log_level, log_text, log_args, override_color):
+        self.time = time.time()
+        self.process_time = time.process_time()
+        self.module = log_module
+        self.severity = log_severity
+        self.level = log_level
+        self.text = log_text
+        self.args = log_args
+        self.override_color = override_color
+        self._message = None
+
+    @property
+    def message(self):
+        """
+        The rendered message.
+        """
+        return self.render()
+
+    def render(self):
+        """
+        Render the message (only the first time), and return it.
+        log_text may be a format string (with args), or a callable returning the message.
+        """
+        if self._message is None:
+            if callable(self.text):
+                message = self.text()
+            else:
+                message = self.text
+            if self.args:
+                message = str(message).format(*self.args)
+            self._message = str(message)
+        return self._message
+
+    def format(self):
+        """
+        Format the record into (multiple) plain log lines.
+        """
+        log_prefix = "[{time}-{process_time}] [{log_module}/{log_severity}]: ".format(**{
+            "time": time.strftime("%H:%M:%S", time.localtime(self.time)),
+            "process_time": self.process_time,
+            "log_module": self.module,
+            "log_severity": self.severity
         })
-        log_formatted_output = "{color}{log}\033[0m".format(**{
+        return log_prefix + self.message.replace("\n", "\n" + log_prefix)
+
+
+class ConsoleSink:
+    """
+    Prints log records to the console, coloured if enabled.
+    """
+
+    def __init__(self, level="INFO"):
+        self.level = LOG_LEVELS[level]
+
+    def emit(self, record):
+        if record.level < self.level:
+            return
+        log_color = ""
+        if color_enabled and not record.override_color:
+            log_color = LOGGING_COLORS.get(record.severity, "")
+        print("{color}{log}\033[0m".format(**{
             "color": log_color,
-            "log": log_formatted_text
-        })
-        if logging_file_name != "":
+            "log": record.format().replace("\n", "\033[0m\n" + log_color)
+        }))
+
+
+class FileSink:
+    """
+    Hands log records to the background log writer.
+    """
+
+    def __init__(self, writer, level="INFO"):
+        self.writer = writer
+        self.level = LOG_LEVELS[level]
+
+    def emit(self, record):
+        if record.level < self.level:
+            return
+        # Render the message here, so the writer sees it as it was when logged.
+        record.render()
+        self.writer.write(record)
+
+
+class _LogWriter(threading.Thread):
+    """
+    The background log writer.
+    Keeps the log file open, and writes queued records in batches
+    once LOG_FLUSH_SIZE records are pending or LOG_FLUSH_INTERVAL seconds have passed.
+    After each batch, the log file is rotated if the rotator asks for it.
+    """
+
+    def __init__(self, file_name, rotator=None):
+        super().__init__(name="MCSH-LogWriter", daemon=True)
+        self.file_name = file_name
+        self.file = open(file_name, "a")
+        self.file_opened_time = time.time()
+        self.rotator = rotator
+        if rotator is not None:
+            rotator.hold(self.file)
+        self.queue = queue.SimpleQueue()
+        self.batch = []
+
+    def write(self, record):
+        """
+        Queue a log record (or a piece of text) to be written.
+        """
+        self.queue.put(record)
+
+    def flush(self, timeout=LOG_FLUSH_TIMEOUT):
+        """
+        Block until everything queued before this call is written.
+        """
+        if not self.is_alive():
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait(timeout)
+
+    def stop(self, timeout=LOG_FLUSH_TIMEOUT):
+        """
+        Write all pending records, then stop the writer and close the file.
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join(timeout)
+
+    def _write_batch(self):
+        if self.batch:
             try:
-                with open(logging_file_name, "a+") as f:
-                    f.write(log_formatted_text + "\n")
-                f.close()
-            except:
+                self.file.write("".join(self.batch))
+                self.file.flush()
+            except Exception:
                 pass
-        # If DEBUG is False, don't output debug messages
-        if log_severity == "DEBUG":
-            if DEBUG:
-                print(log_formatted_output)
-        else:
-            print(log_formatted_output)
+            self.batch = []
+            if self.rotator is not None and \
+                    self.rotator.should_rotate(self.file.tell(), self.file_opened_time):
+                self._rotate()
+
+    def _rotate(self):
+        """
+        Switch to a new log file, and archive the old one in the background.
+        """
+        global logging_file_name
+        try:
+            new_file_name = self.rotator.new_segment_name()
+            new_file = open(new_file_name, "a")
+        except Exception:
+            return
+        self.rotator.hold(new_file)
+        self.file.close()
+        self.rotator.archive([self.file_name])
+        self.file, self.file_name = new_file, new_file_name
+        self.file_opened_time = time.time()
+        logging_file_name = new_file_name
+
+    def run(self):
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                self._write_batch()
+                item.set()
+                continue
+            if isinstance(item, LogRecord):
+                self.batch.append(item.format() + "\n")
+            elif item is not False:
+                self.batch.append(item)
+            if len(self.batch) >= LOG_FLUSH_SIZE or time.monotonic() >= deadline:
+                self._write_batch()
+                deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        self._write_batch()
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+
+def _set_log_sinks(sinks):
+    """
+    Replace the active sinks, and recalculate the level threshold.
+    """
+    global _log_sinks, _log_min_level
+    _log_sinks = sinks
+    _log_min_level = min([sink.level for sink in sinks], default=LOG_LEVELS["FATAL"] + 1)
+
+
+_set_log_sinks([ConsoleSink()])
+
+
+# The logger in-program.
+def log(log_module, log_severity, log_text, *log_args, override_color=False):
+    """
+    The logging function for MCSH.
+    log_severity: FATAL, ERROR, WARNING, INFO, DEBUG
+    log_text: The message, a format string (filled with log_args lazily),
+              or a callable that returns the message.
+    The message is only rendered when at least one sink accepts the severity.
+    """
+    log_level = LOG_LEVELS.get(log_severity, LOG_LEVELS["INFO"])
+    if log_level < _log_min_level:
+        return
+    record = LogRecord(log_module, log_severity, log_level, log_text, log_args, override_color)
+    for sink in _log_sinks:
+        sink.emit(record)
+
+
+def flush_logger():
+    """
+    Write all the pending log lines to the logging file.
+    """
+    if _log_writer is not None:
+        _log_writer.flush()
+
+
+def shutdown_logger():
+    """
+    Flush and close the logging file.
+    Registered to run at interpreter exit.
+    """
+    global _log_writer
+    if _log_writer is not None:
+        _set_log_sinks([sink for sink in _log_sinks if not isinstance(sink, FileSink)])
+        _log_writer.stop()
+        _log_writer = None
+
+
+atexit.register(shutdown_logger)
 
 
 def crash(crash_info):
@@ -75,6 +295,7 @@ def crash(crash_info):
     log("crash_watchdog", "FATAL", "MCSH had crashed!\n"
                                    "For detailed information, "
                                    "see crash reports under ./MCSH/crash_report folder.")
+    flush_logger()
     try:
         program_traceback = crash_info["program_traceback"]
     except KeyError:
@@ -86,13 +307,22 @@ def crash(crash_info):
                           crash_info["computer_info"],
                           program_traceback)
 
+
+def set_color_enabled(enabled):
+    """
+    Enable or disable the console colouring (e.g. when the config is reloaded).
+    """
+    global color_enabled
+    color_enabled = bool(enabled)
+
+
 def initialize_logger():
     """
     Initialize the logging file handler.
     Default log output directory: ./MCSH/logs
-    Default log threshold: 10 logs
+    Default log threshold: 10 logs (the older ones go to ./MCSH/logs/archive)
     """
-    global DEBUG, color_enabled
+    global DEBUG, color_enabled, _log_writer
     path = "./MCSH/logs"
     from MCSH.debug import debugging_check
     DEBUG = debugging_check(suppress_warning=True)
@@ -101,34 +331,31 @@ def initialize_logger():
         os.mkdir(path)
     # Logging color detection
     try:
-        from MCSH.consts import config_instance
-        with open("./MCSH/config/MCSH.json", "r") as f:
-            import json
-            temp_config = json.load(f)
-            f.close()
-        color_enabled = bool(temp_config["color_enabled"])
-    except:
+        # Parsed once here: the config module gets the cached config
+        from MCSH.program_config import get_program_config
+        color_enabled = bool(get_program_config().get("color_enabled", False))
+    except Exception:
         color_enabled = False
-    # Auto-packing logs
-    if len([lists for lists in os.listdir(path) if os.path.isfile(os.path.join(path, lists))]) >= 10:
-        try:
-            tar = tarfile.open("./MCSH/logs/pack.tar.gz", "w:gz")
-            for root, directory, files in os.walk("./MCSH/logs"):
-                for file in files:
-                    if file != "pack.tar.gz":
-                        file_path = os.path.join(root, file)
-                        tar.add(file_path, arcname=file)
-                        os.remove(file_path)
-            tar.close()
-        except:
-            print("Failed to pack logs. Please delete logs manually under ./MCSH/logs.")
     # Set the logging file name
-    global logging_file_name
-    logging_file_name = "{}/{}.log".format(path, time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()))
+    global logging_file_name, _log_rotator
+    shutdown_logger()
+    _log_rotator = Rotator(path)
+    logging_file_name = _log_rotator.new_segment_name()
     try:
         with open(logging_file_name, "w+") as f:
             f.write("Logger initialized -- Start logging...\n")
             f.close()
+        _log_writer = _LogWriter(logging_file_name, _log_rotator)
+        _log_writer.start()
     except:
         print("WARNING: Can't write a log to the file. Logging function will be disabled.")
         logging_file_name = ""
+        _log_writer = None
+    # Auto-archiving logs of the previous runs in the background
+    _log_rotator.archive_old(keep=LOG_KEEP_UNARCHIVED, exclude=[logging_file_name])
+    # DEBUG messages are only rendered (to both console and file) when debugging is enabled
+    log_level = "DEBUG" if DEBUG else "INFO"
+    log_sinks = [ConsoleSink(log_level)]
+    if _log_writer is not None:
+        log_sinks.append(FileSink(_log_writer, log_level))
+    _set_log_sinks(log_sinks)
@@ -0,0 +1,237 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.metrics_store
+ Module Revision: 0.0.1-18
+ Module Description:
+    An append-only, fixed-record binary store for server metrics.
+    Default directory: ./MCSH/metrics/<server>/<resolution>/<YYYY-MM-DD>.bin
+    Every record is METRIC_FIELDS packed as little-endian doubles, sorted by time,
+    so a range query memory-maps the segments it needs and binary-searches them.
+    Old raw (1s) data is downsampled to 1m, then 1h, and the oldest segments are
+    deleted once the total size exceeds the retention size.
+    Days (of the segments) and buckets are both in UTC, so a bucket never straddles two segments.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from MCSH.logging import log
+
+MODULE_NAME = "metrics_store"
+METRICS_PATH = "./MCSH/metrics"
+METRIC_FIELDS = ("time", "cpu_percent", "rss", "threads", "tps", "mspt", "players")
+RECORD_FORMAT = struct.Struct("<" + "d" * len(METRIC_FIELDS))
+# Resolution name -> bucket size (seconds), from the finest
+RESOLUTIONS = {"1s": 1, "1m": 60, "1h": 3600}
+# Days to keep a resolution before it's downsampled to the next one
+RESOLUTION_KEEP_DAYS = {"1s": 2, "1m": 30}
+RETENTION_MAX_BYTES = 256 * 1024 * 1024
+FLUSH_INTERVAL = 1
+
+
+def _day_of(timestamp):
+    """
+    The UTC day of a timestamp: the bucket boundaries (multiples of the bucket size) are UTC as well.
+    """
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+class MetricsStore:
+    """
+    The metrics store.
+    """
+
+    def __init__(self, path=METRICS_PATH, retention_bytes=RETENTION_MAX_BYTES):
+        self.path = path
+        self.retention_bytes = retention_bytes
+        # (server, day) -> open raw segment file
+        self._files = {}
+        self._last_flush = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _segment_directory(self, server_name, resolution):
+        if not server_name or server_name in (".", "..") or "/" in server_name or "\\" in server_name:
+            raise ValueError("Invalid server name: {}".format(server_name))
+        return os.path.join(self.path, server_name, resolution)
+
+    def _segment_name(self, server_name, resolution, day):
+        return os.path.join(self._segment_directory(server_name, resolution), day + ".bin")
+
+    def append(self, server_name, timestamp=None, **values):
+        """
+        Append a raw (1s) record.
+        Metrics that aren't given are stored as NaN.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        record = RECORD_FORMAT.pack(timestamp, *[float(values.get(field, math.nan))
+                                                 for field in METRIC_FIELDS[1:]])
+        day = _day_of(timestamp)
+        with self._lock:
+            segment = self._files.get((server_name, day))
+            if segment is None:
+                # A new day: close the segment of the previous day
+                for key in [key for key in self._files if key[0] == server_name]:
+                    self._files.pop(key).close()
+                directory = self._segment_directory(server_name, "1s")
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                segment = open(self._segment_name(server_name, "1s", day), "ab")
+                self._files[(server_name, day)] = segment
+            segment.write(record)
+            if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                self._flush()
+
+    def append_sample(self, server_name, sample):
+        """
+        Append a sample of MCSH.resource_sampler (usable as its sample listener).
+        """
+        self.append(server_name, sample[0], cpu_percent=sample[1], rss=sample[2], threads=sample[3])
+
+    def _flush(self):
+        for segment in self._files.values():
+            segment.flush()
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            for segment in self._files.values():
+                segment.close()
+            self._files = {}
+
+    @staticmethod
+    def _read_segment(segment_name, start, end):
+        """
+        Read the records within [start, end) of a segment, using a memory map.
+        """
+        size = os.path.getsize(segment_name)
+        count = size // RECORD_FORMAT.size
+        if not count:
+            return []
+        with open(segment_name, "rb") as f, \
+                mmap.mmap(f.fileno(), count * RECORD_FORMAT.size, access=mmap.ACCESS_READ) as mapped:
+            def time_at(index):
+                return struct.unpack_from("<d", mapped, index * RECORD_FORMAT.size)[0]
+
+            # Binary search for the first record at or after the start
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                if time_at(middle) < start:
+                    low = middle + 1
+                else:
+                    high = middle
+            records = []
+            for index in range(low, count):
+                record = RECORD_FORMAT.unpack_from(mapped, index * RECORD_FORMAT.size)
+                if record[0] >= end:
+                    break
+                records.append(record)
+        return records
+
+    def query(self, server_name, start, end=None, resolution=None):
+        """
+        Get the records of a server within [start, end), oldest first.
+        resolution: 1s, 1m or 1h. Without it, every segment in the range is read,
+                    from whichever resolution it's kept in.
+        """
+        end = time.time() if end is None else end
+        resolutions = [resolution] if resolution else list(RESOLUTIONS)
+        self.flush()
+        records = []
+        for resolution in resolutions:
+            directory = self._segment_directory(server_name, resolution)
+            if not os.path.exists(directory):
+                continue
+            start_day, end_day = _day_of(start), _day_of(end)
+            for file in sorted(os.listdir(directory)):
+                day = file[:-len(".bin")]
+                if file.endswith(".bin") and start_day <= day <= end_day:
+                    records.extend(self._read_segment(os.path.join(directory, file), start, end))
+        records.sort(key=lambda record: record[0])
+        return [dict(zip(METRIC_FIELDS, record)) for record in records]
+
+    @staticmethod
+    def _downsample_records(records, bucket_size):
+        """
+        Average the records per bucket (NaN values are ignored).
+        """
+        buckets = {}
+        for record in records:
+            buckets.setdefault(int(record[0] // bucket_size) * bucket_size, []).append(record)
+        downsampled = []
+        for bucket_time in sorted(buckets):
+            values = [bucket_time]
+            for field_index in range(1, len(METRIC_FIELDS)):
+                field_values = [record[field_index] for record in buckets[bucket_time]
+                                if not math.isnan(record[field_index])]
+                values.append(sum(field_values) / len(field_values) if field_values else math.nan)
+            downsampled.append(RECORD_FORMAT.pack(*values))
+        return downsampled
+
+    def _downsample_segment(self, server_name, resolution, next_resolution, day):
+        segment_name = self._segment_name(server_name, resolution, day)
+        records = self._read_segment(segment_name, -math.inf, math.inf)
+        next_directory = self._segment_directory(server_name, next_resolution)
+        if not os.path.exists(next_directory):
+            os.makedirs(next_directory)
+        with open(self._segment_name(server_name, next_resolution, day), "ab") as f:
+            f.write(b"".join(self._downsample_records(records, RESOLUTIONS[next_resolution])))
+        os.remove(segment_name)
+
+    def maintain(self, now=None):
+        """
+        Downsample old segments, then enforce the retention size.
+        """
+        now = time.time() if now is None else now
+        resolutions = list(RESOLUTIONS)
+        for server_name in os.listdir(self.path):
+            for resolution, next_resolution in zip(resolutions, resolutions[1:]):
+                directory = os.path.join(self.path, server_name, resolution)
+                if not os.path.isdir(directory):
+                    continue
+                oldest_kept_day = _day_of(now - RESOLUTION_KEEP_DAYS[resolution] * 86400)
+                for file in sorted(os.listdir(directory)):
+                    day = file[:-len(".bin")]
+                    if file.endswith(".bin") and day < oldest_kept_day:
+                        with self._lock:
+                            if (server_name, day) in self._files:
+                                continue
+                        log(MODULE_NAME, "DEBUG", "Downsampling {}/{}/{} to {}...",
+                            server_name, resolution, day, next_resolution)
+                        self._downsample_segment(server_name, resolution, next_resolution, day)
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        """
+        Delete the oldest segments until the total size meets the retention limit.
+        """
+        if not self.retention_bytes:
+            return
+        segments = []
+        for root, directories, files in os.walk(self.path):
+            for file in files:
+                if file.endswith(".bin"):
+                    segment_name = os.path.join(root, file)
+                    segments.append((file, segment_name, os.path.getsize(segment_name)))
+        total_size = sum([segment[2] for segment in segments])
+        # Sorted by day, the oldest first
+        for file, segment_name, size in sorted(segments):
+            if total_size <= self.retention_bytes:
+                break
+            if file == _day_of(time.time()) + ".bin":
+                continue
+            os.remove(segment_name)
+            total_size -= size
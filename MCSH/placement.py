@@ -0,0 +1,276 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.placement
+ Module Revision: 0.0.1-18
+ Module Description:
+    Plans which host every server goes to. (--export-probe, --plan)
+    Every host exports a probe snapshot (its computer info, benchmark results and free disk),
+    and the plan is made offline from the snapshots.
+    The needs of a server come from perf_recommend/<type>.json: a tier is read as what one
+    server of that many players needs, and player counts between the tiers are interpolated.
+    Servers are packed best fit decreasing: the most demanding servers first, each onto the
+    host it fills the most, keeping PLACEMENT_HEADROOM of every resource free.
+"""
+import json
+import os
+import time
+
+from MCSH.logging import log
+
+MODULE_NAME = "placement"
+PROBE_FORMAT_VERSION = 1
+# Part of every host resource that can be planned; the rest is kept for peaks
+PLACEMENT_HEADROOM = 0.2
+# Disk space (GB) a server takes when the plan doesn't tell
+SERVER_DISK_DEFAULT = {"JE": 10, "BE": 5}
+# Resource -> unit; CPUFreq (single-core speed) is checked, not consumed
+RESOURCES = {
+    "RAM": "GB RAM",
+    "CPUMulti": "effective GHz CPU",
+    "DiskWrite": "MB/s disk writes",
+    "Disk": "GB disk"
+}
+
+
+def _cpu_freq(value):
+    """
+    Read a CPU speed as GHz: a number, or a text like "2.3 GHz" (system_profiler on macOS).
+    Returns None if it's unknown or can't be read.
+    """
+    import re
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    match = re.match(r'\s*([0-9]+(?:[.,][0-9]+)?)\s*([GM]Hz)?\s*$', str(value or ""), re.IGNORECASE)
+    if match is None:
+        return None
+    speed = float(match.group(1).replace(",", "."))
+    if (match.group(2) or "").lower() == "mhz":
+        speed /= 1000
+    return speed or None
+
+
+def export_probe(file_name):
+    """
+    Export the probe snapshot of this host. (--export-probe)
+    """
+    import shutil
+    import socket
+    from MCSH.benchmark import load_benchmark
+    from MCSH.consts import config_instance
+    file_name = file_name or "{}.probe.json".format(socket.gethostname())
+    benchmark = load_benchmark()
+    if benchmark is None:
+        log(MODULE_NAME, "WARNING", "No benchmark results: the CPU is estimated from its speed, and the disk speed "
+                                    "isn't planned. Run --benchmark first for better plans.")
+    snapshot = {
+        "version": PROBE_FORMAT_VERSION,
+        "host": socket.gethostname(),
+        "time": time.time(),
+        "computer_info": dict(config_instance.computer_info,
+                              cpu_freq=_cpu_freq(config_instance.computer_info.get("cpu_freq"))),
+        "benchmark": benchmark,
+        "disk_free": round(shutil.disk_usage("MCSH").free / 1024 ** 3, 1)
+    }
+    with open(file_name, "w") as f:
+        f.write(json.dumps(snapshot, indent=2))
+        f.close()
+    log(MODULE_NAME, "INFO", "Probe snapshot of {} exported to {}.", snapshot["host"], file_name)
+
+
+def _interpolate(tiers, players, key):
+    """
+    Interpolate a tier value by the players, growing with the last step beyond the last tier.
+    """
+    points = [(tier["players"], tier[key]) for tier in tiers]
+    if players <= points[0][0]:
+        return points[0][1]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if players <= x1:
+            return y0 + (y1 - y0) * (players - x0) / (x1 - x0)
+    (x0, y0), (x1, y1) = points[-2:]
+    return y1 + (y1 - y0) * (players - x1) / (x1 - x0)
+
+
+def server_demand(server):
+    """
+    Get the needs of a server ({name, type, players, disk}) as resource -> amount,
+    plus the single-core speed (CPUFreq) it needs, and the tier it's sized by.
+    """
+    from MCSH.benchmark import PERF_RECOMMEND_TIERS, load_perf_recommend
+    tiers_by_name = load_perf_recommend(server["type"])
+    tiers = [tiers_by_name[tier_name] for tier_name in PERF_RECOMMEND_TIERS]
+    players = server["players"]
+    demand = {key: _interpolate(tiers, players, key) for key in ["RAM", "CPUMulti", "DiskWrite"]}
+    demand["Disk"] = server.get("disk", SERVER_DISK_DEFAULT[server["type"]])
+    # A faster core than the last tier's isn't needed: more players need more cores instead
+    demand["CPUFreq"] = min(_interpolate(tiers, players, "CPUFreq"), tiers[-1]["CPUFreq"])
+    tier_name = next((tier_name for tier_name, tier in zip(PERF_RECOMMEND_TIERS, tiers)
+                      if players <= tier["players"]), PERF_RECOMMEND_TIERS[-1])
+    return demand, tier_name
+
+
+def host_capacity(snapshot):
+    """
+    Get what can be planned on a host (its probe snapshot) as resource -> amount (None if unknown),
+    plus its single-core speed.
+    """
+    from MCSH.benchmark import is_current
+    from MCSH.jvm_tuning import OS_RESERVED_MIN_MB, OS_RESERVED_RATIO
+    computer_info = snapshot["computer_info"]
+    benchmark = snapshot.get("benchmark") or {}
+    if not is_current(benchmark):
+        # Older results have uncalibrated CPU scores: only the disk is planned with them
+        benchmark = {"disk_write": benchmark.get("disk_write")}
+    memory_total = computer_info["memory_total"]
+    memory = memory_total - max(OS_RESERVED_MIN_MB / 1024, memory_total * OS_RESERVED_RATIO)
+    cpu_freq = computer_info.get("cpu_freq")
+    cpu_single = benchmark.get("cpu_single") or cpu_freq
+    cpu_multi = benchmark.get("cpu_multi") or (computer_info.get("cpu", 0) * cpu_freq if cpu_freq else None)
+    capacity = {
+        "RAM": memory,
+        "CPUMulti": cpu_multi,
+        "DiskWrite": benchmark.get("disk_write"),
+        "Disk": snapshot.get("disk_free")
+    }
+    capacity = {key: value * (1 - PLACEMENT_HEADROOM) if value is not None else None
+                for key, value in capacity.items()}
+    capacity["CPUFreq"] = cpu_single
+    return capacity
+
+
+def _format_resources(amounts):
+    return ", ".join(["{:.1f} {}".format(amounts[key], unit)
+                      for key, unit in RESOURCES.items() if amounts.get(key) is not None])
+
+
+def _rejection(demand, capacity, free):
+    """
+    Get why a server doesn't fit on a host, or None if it fits.
+    """
+    if capacity["CPUFreq"] is not None and capacity["CPUFreq"] < demand["CPUFreq"]:
+        return "single-core speed {} GHz < {} GHz".format(round(capacity["CPUFreq"], 2),
+                                                          round(demand["CPUFreq"], 2))
+    reasons = ["{:.1f} free {} < {:.1f}".format(free[key], RESOURCES[key], demand[key])
+               for key in RESOURCES if free[key] is not None and free[key] < demand[key]]
+    return "; ".join(reasons) or None
+
+
+def plan_placement(servers, hosts):
+    """
+    Place servers onto hosts.
+    servers: [{name, type, players, disk}]
+    hosts: host name -> probe snapshot
+    Returns (server name -> host name or None, server name -> explanation, host name -> free resources).
+    """
+    capacities = {host_name: host_capacity(snapshot) for host_name, snapshot in hosts.items()}
+    free = {host_name: {key: capacity[key] for key in RESOURCES} for host_name, capacity in capacities.items()}
+    totals = {key: sum([capacity[key] for capacity in capacities.values() if capacity[key] is not None])
+              for key in RESOURCES}
+    demands = {server["name"]: server_demand(server) for server in servers}
+
+    def dominant_share(server):
+        # The largest part of the fleet's resources the server needs: those go first
+        demand = demands[server["name"]][0]
+        return max([demand[key] / totals[key] for key in RESOURCES if totals[key]] or [0])
+
+    placement = {}
+    explanations = {}
+    for server in sorted(servers, key=lambda server: (-dominant_share(server), server["name"])):
+        demand, tier_name = demands[server["name"]]
+        needs = "{} ({}, {} players, sized by the '{}' tier) needs {}, and a {} GHz core.".format(
+            server["name"], server["type"], server["players"], tier_name, _format_resources(demand),
+            round(demand["CPUFreq"], 2))
+        candidates = []
+        rejected = []
+        for host_name in sorted(hosts):
+            reason = _rejection(demand, capacities[host_name], free[host_name])
+            if reason is not None:
+                rejected.append("{}: {}".format(host_name, reason))
+                continue
+            # Best fit: the host with the least room left (as parts of its capacity) after the server
+            left = [(free[host_name][key] - demand[key]) / capacities[host_name][key] for key in RESOURCES
+                    if capacities[host_name][key]]
+            candidates.append((sum(left) / len(left) if left else 1, host_name))
+        if not candidates:
+            placement[server["name"]] = None
+            explanations[server["name"]] = needs + " Not placed: " + " | ".join(rejected)
+            continue
+        score, host_name = min(candidates)
+        for key in RESOURCES:
+            if free[host_name][key] is not None:
+                free[host_name][key] -= demand[key]
+        placement[server["name"]] = host_name
+        explanation = needs + " Placed on {}, {}; {} left there.".format(
+            host_name, "the only host it fits" if len(candidates) == 1 else
+            "the tightest fit of {} hosts".format(len(candidates)),
+            _format_resources(free[host_name]) or "nothing measured")
+        if rejected:
+            explanation += " Rejected: " + " | ".join(rejected)
+        explanations[server["name"]] = explanation
+    return placement, explanations, free
+
+
+def _load_plan(file_name):
+    """
+    Load a plan file, and the probe snapshots it names (relative to the plan file).
+    """
+    with open(file_name, "r") as f:
+        plan = json.load(f)
+        f.close()
+    hosts = {}
+    for snapshot_file in plan["hosts"]:
+        with open(os.path.join(os.path.dirname(os.path.abspath(file_name)), snapshot_file), "r") as f:
+            snapshot = json.load(f)
+            f.close()
+        if snapshot.get("version") != PROBE_FORMAT_VERSION:
+            raise ValueError("{} isn't a probe snapshot of this MCSH version.".format(snapshot_file))
+        if snapshot["host"] in hosts:
+            raise ValueError("Host {} is in the plan twice.".format(snapshot["host"]))
+        computer_info = snapshot["computer_info"]
+        cpu_freq = _cpu_freq(computer_info.get("cpu_freq"))
+        if cpu_freq is None and computer_info.get("cpu_freq") is not None:
+            log(MODULE_NAME, "WARNING", "Can't read the CPU speed of {}: {}", snapshot["host"],
+                computer_info["cpu_freq"])
+        computer_info["cpu_freq"] = cpu_freq
+        hosts[snapshot["host"]] = snapshot
+    servers = []
+    for server in plan["servers"]:
+        server = dict(server)
+        server.setdefault("type", "JE")
+        server["players"] = int(server["players"])
+        if server["type"] not in SERVER_DISK_DEFAULT:
+            raise ValueError("Server {} has an unknown type: {}".format(server["name"], server["type"]))
+        servers.append(server)
+    if len(set([server["name"] for server in servers])) != len(servers):
+        raise ValueError("Some servers are in the plan twice.")
+    return servers, hosts
+
+
+def plan_command(file_name):
+    """
+    Plan the placement of the servers of a plan file onto its hosts. (--plan)
+    """
+    try:
+        servers, hosts = _load_plan(file_name)
+    except KeyError as e:
+        log(MODULE_NAME, "ERROR", "Can't read the plan {}: {} is missing.", file_name, e)
+        return
+    except (OSError, ValueError) as e:
+        log(MODULE_NAME, "ERROR", "Can't read the plan {}: {}", file_name, e)
+        return
+    placement, explanations, free = plan_placement(servers, hosts)
+    for server in servers:
+        log(MODULE_NAME, "INFO" if placement[server["name"]] else "WARNING", "{}", explanations[server["name"]])
+    log(MODULE_NAME, "INFO", lambda: "-- Placement --\n" + "\n".join(
+        ["{}: {}".format(host_name, ", ".join(sorted([server_name for server_name, placed in placement.items()
+                                                      if placed == host_name])) or "(empty)")
+         for host_name in sorted(hosts)]))
+    unplaced = sorted([server_name for server_name, host_name in placement.items() if host_name is None])
+    if unplaced:
+        log(MODULE_NAME, "WARNING", "{} server(s) don't fit on any host: {}", len(unplaced), ", ".join(unplaced))
@@ -0,0 +1,26 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.process_pool
+ Module Revision: 0.0.1-18
+ Module Description:
+    Process pools for CPU-bound work (backups, world scans and pruning, the CPU benchmark).
+    The daemon runs many threads (event loop, event writer, scheduler...), and forking a
+    multi-threaded process can copy a lock some other thread holds, leaving the child stuck.
+    The workers are therefore started by a fork server (or spawned where there's none).
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(workers=None):
+    """
+    A ProcessPoolExecutor whose workers aren't forked from this process. workers: default to the CPU count.
+    """
+    start_methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context)
@@ -0,0 +1,288 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.program_config
+ Module Revision: 0.0.1-18
+ Module Description:
+    The program config (MCSH/config/MCSH.json), shared by every module that needs it.
+    The file is parsed, migrated to the current schema and validated once;
+    after that, it's only read again if its mtime or size changed.
+    Older files are migrated step by step (PROGRAM_CONFIG_MIGRATIONS), and saved back.
+    A watcher (inotify where available, polling otherwise) reloads the file when it's
+    edited, and tells the listeners, so the daemon picks up edits without restarting.
+"""
+import json
+import os
+import threading
+
+from MCSH.consts import MCSH_version
+from MCSH.logging import log
+
+MODULE_NAME = "program_config"
+PROGRAM_CONFIG_FILE = "MCSH/config/MCSH.json"
+PROGRAM_CONFIG_SCHEMA_VERSION = 1
+# Key -> (type, default). Other keys are kept as they are.
+PROGRAM_CONFIG_SCHEMA = {
+    "schema_version": (int, PROGRAM_CONFIG_SCHEMA_VERSION),
+    "version": (str, MCSH_version),
+    "color_enabled": (bool, False),
+    "locale": (str, "en_us")
+}
+PROGRAM_CONFIG_POLL_INTERVAL = 2
+
+
+class ConfigError(Exception):
+    """
+    Raised when the program config is missing or can't be parsed.
+    """
+
+
+def _migrate_0_to_1(config):
+    # The first files had no schema version, and not always every key
+    config.setdefault("color_enabled", False)
+    config.setdefault("locale", "en_us")
+    return config
+
+
+# Schema version -> the function that migrates a config of that version to the next one
+PROGRAM_CONFIG_MIGRATIONS = {
+    0: _migrate_0_to_1
+}
+
+
+def _stat(file_name):
+    try:
+        stat = os.stat(file_name)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+class ProgramConfig:
+    """
+    The program config, cached by the mtime and size of the file.
+    """
+
+    def __init__(self, file_name=PROGRAM_CONFIG_FILE):
+        self.file_name = file_name
+        self.config = None
+        self._stat = None
+        # Called with (old config, new config) when the file is changed by someone else
+        self.change_listeners = []
+        self._watcher = None
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        Get the config (the cached one if the file didn't change).
+        """
+        with self._lock:
+            file_stat = _stat(self.file_name)
+            if file_stat is None:
+                raise ConfigError("{} is missing.".format(self.file_name))
+            if file_stat == self._stat and self.config is not None:
+                return self.config
+            try:
+                with open(self.file_name, "r") as f:
+                    config = json.load(f)
+                    f.close()
+            except (OSError, ValueError) as e:
+                raise ConfigError("{} is corrupted: {}".format(self.file_name, e))
+            if not isinstance(config, dict):
+                raise ConfigError("{} is corrupted: not a JSON object.".format(self.file_name))
+            migrated = self._migrate(config)
+            self.config = self._validate(config)
+            self._stat = file_stat
+            if migrated:
+                self.save(self.config)
+            return self.config
+
+    @staticmethod
+    def _migrate(config):
+        """
+        Migrate a config to the current schema version. Returns whether it was migrated.
+        """
+        schema_version = config.get("schema_version", 0)
+        if schema_version > PROGRAM_CONFIG_SCHEMA_VERSION:
+            log(MODULE_NAME, "WARNING", "The program config is from a newer MCSH (schema version {}).",
+                schema_version)
+            return False
+        start_version = schema_version
+        while schema_version < PROGRAM_CONFIG_SCHEMA_VERSION:
+            config = PROGRAM_CONFIG_MIGRATIONS[schema_version](config)
+            schema_version += 1
+            config["schema_version"] = schema_version
+        if schema_version != start_version:
+            log(MODULE_NAME, "INFO", "Migrated the program config from schema version {} to {}.",
+                start_version, schema_version)
+            config["version"] = MCSH_version
+            return True
+        return False
+
+    @staticmethod
+    def _validate(config):
+        """
+        Replace the missing values, and the values of the wrong type, with the defaults.
+        """
+        for key, (value_type, default) in PROGRAM_CONFIG_SCHEMA.items():
+            if key not in config:
+                config[key] = default
+            elif not isinstance(config[key], value_type) or (value_type is int and isinstance(config[key], bool)):
+                log(MODULE_NAME, "WARNING", "Invalid value of {} in the program config: {!r}. Using {!r}.",
+                    key, config[key], default)
+                config[key] = default
+        return config
+
+    def get(self, key, default=None):
+        """
+        Get a value, or the default if the config can't be loaded.
+        """
+        try:
+            return self.load().get(key, default)
+        except ConfigError:
+            return default
+
+    def save(self, config=None):
+        """
+        Save the config (the given one, or the cached one).
+        It's written to a temporary file first, so a failed write never leaves a broken file.
+        """
+        with self._lock:
+            config = self._validate(dict(config if config is not None else self.config))
+            with open(self.file_name + ".tmp", "w") as f:
+                f.write(json.dumps(config))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.file_name + ".tmp", self.file_name)
+            self.config = config
+            self._stat = _stat(self.file_name)
+
+    def generate(self):
+        """
+        Write a new config with the default values.
+        """
+        self.save({key: default for key, (value_type, default) in PROGRAM_CONFIG_SCHEMA.items()})
+
+    def reload(self):
+        """
+        Reload the file if it changed, and tell the listeners.
+        """
+        old_config = self.config
+        try:
+            config = self.load()
+        except ConfigError as e:
+            log(MODULE_NAME, "WARNING", "Keeping the current program config: {}", e)
+            return
+        if config is old_config:
+            return
+        log(MODULE_NAME, "INFO", "The program config is reloaded.")
+        for listener in self.change_listeners:
+            try:
+                listener(old_config, config)
+            except Exception:
+                log(MODULE_NAME, "ERROR", "A config change listener failed.")
+
+    def watch(self):
+        """
+        Start watching the file for changes (in a background thread).
+        """
+        if self._watcher is None:
+            self._watcher = ConfigWatcher(self)
+            self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Reloads a program config when its file changes.
+    """
+    # inotify events on the directory: the file may be written in place, or replaced by a rename.
+    # Only finished writes count, so a file that's being written isn't read half-written.
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+
+    def __init__(self, program_config, interval=PROGRAM_CONFIG_POLL_INTERVAL):
+        super().__init__(name="MCSH-ConfigWatcher", daemon=True)
+        self.program_config = program_config
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def _inotify(self):
+        """
+        Get an inotify file descriptor watching the directory of the file, or None if it's not available.
+        """
+        import ctypes
+        import ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        directory = os.path.dirname(os.path.abspath(self.program_config.file_name))
+        if libc.inotify_add_watch(fd, directory.encode(), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _read_events(self, fd):
+        """
+        Read the pending inotify events. Returns whether one is about the file.
+        """
+        import struct
+        file_name = os.path.basename(self.program_config.file_name).encode()
+        changed = False
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return False
+        position = 0
+        while position + 16 <= len(data):
+            watch, mask, cookie, length = struct.unpack_from("iIII", data, position)
+            name = data[position + 16:position + 16 + length].rstrip(b"\x00")
+            position += 16 + length
+            if name == file_name:
+                changed = True
+        return changed
+
+    def run(self):
+        fd = self._inotify()
+        if fd is None:
+            log(MODULE_NAME, "DEBUG", "inotify isn't available, polling the program config.")
+            while not self._stopping.wait(self.interval):
+                self.program_config.reload()
+            return
+        import select
+        try:
+            while not self._stopping.is_set():
+                readable, writable, failed = select.select([fd], [], [], self.interval)
+                if readable and self._read_events(fd):
+                    self.program_config.reload()
+        finally:
+            os.close(fd)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self.is_alive():
+            self.join(timeout or self.interval + 1)
+
+
+_program_config = None
+
+
+def get_program_config():
+    """
+    Get the program config of this process.
+    """
+    global _program_config
+    if _program_config is None:
+        _program_config = ProgramConfig()
+    return _program_config
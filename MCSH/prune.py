@@ -0,0 +1,245 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.prune
+ Module Revision: 0.0.1-18
+ Module Description:
+    Removes stale chunks from a world, and compacts its region files. (--prune)
+    A chunk is removed if players spent less than the InhabitedTime threshold in it,
+    or if it's outside the keep-radius around the world spawn (whichever is given).
+    Every region file is rewritten without gaps between its chunks, in parallel, and the external
+    chunk files (c.<x>.<z>.mcc) of the removed chunks are deleted.
+    The world must not be in use: the server it belongs to has to be stopped (the registry, or the
+    supervisor of the daemon, tells), and no server may hold its session.lock.
+"""
+import os
+
+from MCSH.logging import log
+from MCSH.process_pool import process_pool
+from MCSH.region import (SECTOR_SIZE, HEADER_SIZE, REGION_FILE_PATTERN, COMPRESSION_EXTERNAL,
+                         read_locations, read_timestamps, read_chunk, decompress_chunk, find_region_files)
+
+MODULE_NAME = "prune"
+# The NBT tag of InhabitedTime (a TAG_Long, in ticks)
+INHABITED_TIME_TAG = b"\x04\x00\x0dInhabitedTime"
+# Region files of the same chunks, next to the terrain 'region' directory (1.14+)
+CHUNK_DATA_DIRECTORIES = ["entities", "poi"]
+
+
+def _read_nbt_number(data, tag, size):
+    """
+    Find a number tag in NBT data, without parsing the whole NBT. Returns None if it's missing.
+    """
+    position = data.find(tag)
+    if position < 0:
+        return None
+    position += len(tag)
+    return int.from_bytes(data[position:position + size], "big", signed=True)
+
+
+def read_spawn(world_directory):
+    """
+    Get the spawn chunk of a world from its level.dat, or (0, 0).
+    """
+    import gzip
+    try:
+        with gzip.open(os.path.join(world_directory, "level.dat"), "rb") as f:
+            data = f.read()
+        spawn_x = _read_nbt_number(data, b"\x03\x00\x06SpawnX", 4) or 0
+        spawn_z = _read_nbt_number(data, b"\x03\x00\x06SpawnZ", 4) or 0
+        return spawn_x >> 4, spawn_z >> 4
+    except (OSError, EOFError):
+        return 0, 0
+
+
+def _chunks_to_remove(file_name, region_x, region_z, min_inhabited_time, keep_radius, spawn):
+    """
+    Get the indexes of the chunks of a terrain region file to remove.
+    """
+    with open(file_name, "rb") as f:
+        data = f.read()
+    removed = set()
+    for index, offset, length in read_locations(data):
+        chunk_x, chunk_z = region_x * 32 + index % 32, region_z * 32 + index // 32
+        if keep_radius is not None and max(abs(chunk_x - spawn[0]), abs(chunk_z - spawn[1])) > keep_radius:
+            removed.add(index)
+            continue
+        if min_inhabited_time is None or offset + 5 > len(data):
+            continue
+        compression, chunk_data = read_chunk(data, offset)
+        if compression & COMPRESSION_EXTERNAL:
+            continue
+        try:
+            inhabited_time = _read_nbt_number(decompress_chunk(compression, chunk_data), INHABITED_TIME_TAG, 8)
+        except Exception:
+            continue
+        if inhabited_time is not None and inhabited_time < min_inhabited_time:
+            removed.add(index)
+    return removed
+
+
+def _remove_external_chunks(file_name, removed, dry_run):
+    """
+    Delete the external chunk files (c.<x>.<z>.mcc, for chunks too large for the region file)
+    of the removed chunks of a region file. Returns their size.
+    """
+    match = REGION_FILE_PATTERN.match(os.path.basename(file_name))
+    if match is None:
+        return 0
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    size = 0
+    for index in removed:
+        external_file_name = os.path.join(os.path.dirname(file_name), "c.{}.{}.mcc".format(
+            region_x * 32 + index % 32, region_z * 32 + index // 32))
+        if os.path.exists(external_file_name):
+            size += os.path.getsize(external_file_name)
+            if not dry_run:
+                os.remove(external_file_name)
+    return size
+
+
+def compact_region(file_name, removed=(), dry_run=False):
+    """
+    Rewrite a region file without the removed chunks, and without gaps.
+    The file is deleted if no chunk is left. The external chunk files of the removed chunks are deleted.
+    Returns (size before, size after).
+    """
+    with open(file_name, "rb") as f:
+        data = f.read()
+    external_size = _remove_external_chunks(file_name, removed, dry_run)
+    if len(data) < HEADER_SIZE:
+        return len(data) + external_size, len(data)
+    timestamps = read_timestamps(data)
+    locations = bytearray(SECTOR_SIZE)
+    new_timestamps = bytearray(SECTOR_SIZE)
+    body = []
+    sector = HEADER_SIZE // SECTOR_SIZE
+    # Kept in the order of the file, so the chunks stay where the game put them relative to each other
+    for index, offset, length in sorted(read_locations(data), key=lambda location: location[1]):
+        if index in removed or offset < HEADER_SIZE or offset + 5 > len(data):
+            continue
+        chunk_length = int.from_bytes(data[offset:offset + 4], "big")
+        sectors = (chunk_length + 4 + SECTOR_SIZE - 1) // SECTOR_SIZE
+        if not 0 < sectors <= length // SECTOR_SIZE:
+            # Damaged: keep the sectors the header points at
+            sectors = length // SECTOR_SIZE
+        chunk = data[offset:offset + sectors * SECTOR_SIZE]
+        body.append(chunk + bytes(sectors * SECTOR_SIZE - len(chunk)))
+        locations[index * 4:index * 4 + 4] = ((sector << 8) | sectors).to_bytes(4, "big")
+        new_timestamps[index * 4:index * 4 + 4] = timestamps[index].to_bytes(4, "big")
+        sector += sectors
+    new_size = sector * SECTOR_SIZE if body else 0
+    if dry_run:
+        return len(data) + external_size, new_size
+    if not body:
+        os.remove(file_name)
+        return len(data) + external_size, 0
+    with open(file_name + ".compacting", "wb") as f:
+        f.write(bytes(locations) + bytes(new_timestamps) + b"".join(body))
+    os.replace(file_name + ".compacting", file_name)
+    return len(data) + external_size, new_size
+
+
+def prune_region(file_name, min_inhabited_time=None, keep_radius=None, spawn=(0, 0), dry_run=False):
+    """
+    Prune and compact a terrain region file, and the entities/poi region files of the same chunks.
+    Returns (chunks removed, size before, size after).
+    """
+    match = REGION_FILE_PATTERN.match(os.path.basename(file_name))
+    removed = set()
+    if match and (min_inhabited_time is not None or keep_radius is not None):
+        removed = _chunks_to_remove(file_name, int(match.group(1)), int(match.group(2)),
+                                    min_inhabited_time, keep_radius, spawn)
+    size_before, size_after = compact_region(file_name, removed, dry_run)
+    dimension_directory = os.path.dirname(os.path.dirname(file_name))
+    for directory in CHUNK_DATA_DIRECTORIES:
+        data_file_name = os.path.join(dimension_directory, directory, os.path.basename(file_name))
+        if os.path.exists(data_file_name):
+            before, after = compact_region(data_file_name, removed, dry_run)
+            size_before += before
+            size_after += after
+    return len(removed), size_before, size_after
+
+
+def world_in_use(world_directory):
+    """
+    Whether a server holds the session.lock of the world (or of a world in the directory).
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # The lock can't be tested here
+        return False
+    for root, directories, files in os.walk(world_directory):
+        if "session.lock" not in files:
+            continue
+        with open(os.path.join(root, "session.lock"), "a") as f:
+            try:
+                fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.lockf(f, fcntl.LOCK_UN)
+            except OSError:
+                return True
+        # Worlds don't contain worlds
+        directories[:] = []
+    return False
+
+
+def prune_world(world_directory, min_inhabited_time=None, keep_radius=None, dry_run=False, workers=None):
+    """
+    Prune all the dimensions of a world in parallel.
+    Returns (chunks removed, size before, size after).
+    """
+    files = [file_name for dimension_files in find_region_files(world_directory).values()
+             for file_name in dimension_files]
+    spawns = []
+    for file_name in files:
+        # The world directory of <world>/region, <world>/DIM-1/region, <world>/dimensions/<ns>/<name>/region
+        world = os.path.dirname(os.path.dirname(file_name))
+        while world and not os.path.exists(os.path.join(world, "level.dat")) \
+                and os.path.abspath(world) != os.path.abspath(world_directory):
+            world = os.path.dirname(world)
+        spawns.append(read_spawn(world))
+    total_removed = total_before = total_after = 0
+    with process_pool(workers) as executor:
+        results = executor.map(prune_region, files, [min_inhabited_time] * len(files), [keep_radius] * len(files),
+                               spawns, [dry_run] * len(files), chunksize=max(len(files) // 64, 1))
+        for removed, size_before, size_after in results:
+            total_removed += removed
+            total_before += size_before
+            total_after += size_after
+    return total_removed, total_before, total_after
+
+
+def prune_command(world_directory):
+    """
+    Remove stale chunks from a world, or the worlds of a server, and compact the region files. (--prune)
+    """
+    from MCSH.consts import config_instance
+    from MCSH.servers import DEFAULT_STATE, get_registry, owner_server, server_state
+    parser_args = config_instance.parser_args
+    server_name, server = world_directory, get_registry().get(world_directory)
+    if server is not None:
+        world_directory = server["directory"]
+    if not os.path.isdir(world_directory):
+        log(MODULE_NAME, "ERROR", "{} isn't a directory or a server.", world_directory)
+        return
+    if server is None:
+        server_name, server = owner_server(world_directory)
+    # Old servers don't lock their worlds, and BE worlds have no session.lock: the state tells
+    if server is not None and server_state(server_name, server) != DEFAULT_STATE:
+        log(MODULE_NAME, "ERROR", "Server {} is {}. Stop it first.", server_name, server_state(server_name, server))
+        return
+    if world_in_use(world_directory):
+        log(MODULE_NAME, "ERROR", "The world is in use. Stop the server first.")
+        return
+    log(MODULE_NAME, "INFO", "{} {} (InhabitedTime threshold: {}, keep-radius: {})...",
+        "Checking" if parser_args.dry_run else "Pruning", world_directory,
+        parser_args.inhabited_time, parser_args.keep_radius)
+    removed, size_before, size_after = prune_world(world_directory, parser_args.inhabited_time,
+                                                   parser_args.keep_radius, parser_args.dry_run)
+    log(MODULE_NAME, "INFO", "{} {} chunk(s): {} MB -> {} MB ({} MB saved).",
+        "Would remove" if parser_args.dry_run else "Removed", removed, round(size_before / 1024 / 1024, 1),
+        round(size_after / 1024 / 1024, 1), round((size_before - size_after) / 1024 / 1024, 1))
@@ -0,0 +1,402 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.rcon
+ Module Revision: 0.0.1-18
+ Module Description:
+    An asyncio RCON client pool. (--rcon)
+    Every server gets one persistent, authenticated connection, reused by all the commands,
+    and reconnected (with a backoff) when it's lost. Commands are written without waiting
+    for each other (up to the pipeline depth of a connection), and their responses are
+    matched by request ID, so a batch on many servers at once takes about one round trip.
+    The RCON address and password are read from the server.properties of the servers.
+"""
+import asyncio
+import os
+import struct
+import time
+
+from MCSH.logging import log
+from MCSH.server_properties import read_server_properties
+
+MODULE_NAME = "rcon"
+# Packet types
+TYPE_RESPONSE = 0
+TYPE_COMMAND = 2
+TYPE_AUTH_RESPONSE = 2
+TYPE_LOGIN = 3
+PACKET_HEADER = struct.Struct("<iii")
+RCON_DEFAULT_PORT = 25575
+RCON_TIMEOUT = 10
+# Longest command the server accepts (it reads packets into a 1460-byte buffer)
+RCON_MAX_COMMAND_LENGTH = 1446
+RCON_MAX_PACKET_SIZE = 4096 * 4 + 14
+# Responses are split into fragments of this many characters: a shorter fragment is the last one
+RCON_FRAGMENT_SIZE = 4096
+# How long to wait for another fragment after a full one
+RCON_FRAGMENT_WAIT = 0.05
+# Commands written before their responses arrive, per connection.
+# The vanilla server drops the connection if one socket read gets more than one packet, so it's 1 by default;
+# raise it for servers (or proxies) that read packets properly.
+RCON_PIPELINE_DEPTH = 1
+# Reconnect backoff (seconds) after a failed connection
+RCON_RECONNECT_MIN = 1
+RCON_RECONNECT_MAX = 60
+
+
+class RconError(Exception):
+    """
+    Raised when RCON isn't enabled for a server, or its password is refused.
+    """
+
+
+def encode_packet(request_id, packet_type, body):
+    payload = body.encode("utf-8")
+    return PACKET_HEADER.pack(len(payload) + 10, request_id, packet_type) + payload + b"\x00\x00"
+
+
+async def read_packet(reader):
+    """
+    Read a packet. Returns (request ID, type, body).
+    """
+    length = struct.unpack("<i", await reader.readexactly(4))[0]
+    if not 10 <= length <= RCON_MAX_PACKET_SIZE:
+        raise ConnectionError("Invalid RCON packet length: {}".format(length))
+    data = await reader.readexactly(length)
+    request_id, packet_type = struct.unpack_from("<ii", data)
+    return request_id, packet_type, data[8:-2].decode("utf-8", errors="replace")
+
+
+class RconConnection:
+    """
+    A persistent RCON connection to a server.
+    """
+
+    def __init__(self, host, port, password, timeout=RCON_TIMEOUT, pipeline_depth=RCON_PIPELINE_DEPTH):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.responses = 0
+        self._reader_task = None
+        self._next_id = 0
+        # Request ID -> [future, fragments, fragment timer], in the order they were sent
+        self._pending = {}
+        self._window = asyncio.Semaphore(pipeline_depth)
+
+    @property
+    def connected(self):
+        return self.writer is not None
+
+    def _new_id(self):
+        # -1 is the ID of refused logins
+        self._next_id = self._next_id % 0x7FFFFFFF + 1
+        return self._next_id
+
+    async def connect(self):
+        """
+        Connect and log in.
+        """
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                          self.timeout)
+        try:
+            self.writer.write(encode_packet(self._new_id(), TYPE_LOGIN, self.password))
+            await self.writer.drain()
+            while True:
+                request_id, packet_type, body = await asyncio.wait_for(read_packet(self.reader), self.timeout)
+                # Some servers send an empty response before the login result
+                if packet_type == TYPE_AUTH_RESPONSE:
+                    break
+            if request_id == -1:
+                raise RconError("The RCON password of {}:{} is refused.".format(self.host, self.port))
+        except BaseException:
+            self.close()
+            raise
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    def close(self, error=None):
+        """
+        Close the connection, failing the commands still waiting for a response.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+        if self._reader_task is not None and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+        self._reader_task = None
+        error = error or ConnectionError("The RCON connection to {}:{} is closed.".format(self.host, self.port))
+        for request_id in list(self._pending):
+            future, fragments, timer = self._pending.pop(request_id)
+            if timer is not None:
+                timer.cancel()
+            if not future.done():
+                future.set_exception(error)
+            self._window.release()
+
+    def _finish(self, request_id):
+        entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+        future, fragments, timer = entry
+        if timer is not None:
+            timer.cancel()
+        if not future.done():
+            future.set_result("".join(fragments))
+        self.responses += 1
+        self._window.release()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                request_id, packet_type, body = await read_packet(self.reader)
+                entry = self._pending.get(request_id)
+                if entry is None:
+                    # e.g. the response of a command that timed out
+                    continue
+                # Responses come in order: a response to a later command ends the earlier ones
+                for earlier_id in list(self._pending):
+                    if earlier_id == request_id:
+                        break
+                    self._finish(earlier_id)
+                entry[1].append(body)
+                if entry[2] is not None:
+                    entry[2].cancel()
+                    entry[2] = None
+                if len(body) < RCON_FRAGMENT_SIZE:
+                    self._finish(request_id)
+                else:
+                    entry[2] = asyncio.get_event_loop().call_later(RCON_FRAGMENT_WAIT, self._finish, request_id)
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            log(MODULE_NAME, "DEBUG", "The RCON connection to {}:{} is lost: {}", self.host, self.port, e)
+        self.close()
+
+    async def _send(self, command):
+        """
+        Write a command once the pipeline has room. Returns the future of its response.
+        """
+        if len(command.encode("utf-8")) > RCON_MAX_COMMAND_LENGTH:
+            raise ValueError("RCON commands can't be longer than {} bytes.".format(RCON_MAX_COMMAND_LENGTH))
+        await asyncio.wait_for(self._window.acquire(), self.timeout)
+        if self.writer is None:
+            self._window.release()
+            raise ConnectionError("The RCON connection to {}:{} is closed.".format(self.host, self.port))
+        request_id = self._new_id()
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = [future, [], None]
+        self.writer.write(encode_packet(request_id, TYPE_COMMAND, command))
+        return future
+
+    async def run_batch(self, commands):
+        """
+        Run commands in order. Returns their responses.
+        """
+        try:
+            futures = []
+            for command in commands:
+                futures.append(await self._send(command))
+            if self.writer is not None:
+                await self.writer.drain()
+            return await asyncio.wait_for(asyncio.gather(*futures), self.timeout)
+        except asyncio.TimeoutError:
+            # The server isn't answering: the responses can't be trusted to line up any more
+            self.close()
+            raise ConnectionError("The RCON server {}:{} didn't respond in time.".format(self.host, self.port))
+
+    async def run(self, command):
+        return (await self.run_batch([command]))[0]
+
+
+class RconPool:
+    """
+    One RCON connection per server, opened on first use.
+    """
+
+    def __init__(self, supervisor=None, timeout=RCON_TIMEOUT, pipeline_depth=RCON_PIPELINE_DEPTH):
+        """
+        supervisor: The supervisor of the servers (to find the running ones), if any.
+        """
+        self.supervisor = supervisor
+        self.timeout = timeout
+        self.pipeline_depth = pipeline_depth
+        self.connections = {}
+        # Server name -> (host, port, password), for servers not configured by server.properties
+        self.endpoints = {}
+        self._locks = {}
+        # Server name -> (time of the next attempt, backoff)
+        self._retry = {}
+        if supervisor is not None:
+            supervisor.state_listeners.append(self._on_state_change)
+
+    def add(self, server_name, host, port, password):
+        """
+        Set the RCON address and password of a server.
+        """
+        self.endpoints[server_name] = (host, port, password)
+
+    def _server_directory(self, server_name):
+        server = self.supervisor.servers.get(server_name) if self.supervisor is not None else None
+        if server is not None and server.cwd is not None:
+            return server.cwd
+        from MCSH.servers import get_registry
+        record = get_registry().get(server_name)
+        return record["directory"] if record is not None else None
+
+    def endpoint(self, server_name):
+        """
+        Get the RCON (host, port, password) of a server.
+        """
+        if server_name in self.endpoints:
+            return self.endpoints[server_name]
+        directory = self._server_directory(server_name)
+        if directory is None:
+            raise RconError("There's no server named {}.".format(server_name))
+        properties = read_server_properties(directory)
+        if properties.get("enable-rcon") != "true" or not properties.get("rcon.password"):
+            raise RconError("RCON isn't enabled for server {} (enable-rcon and rcon.password in {}).".format(
+                server_name, os.path.join(directory, "server.properties")))
+        return (properties.get("server-ip") or "127.0.0.1", int(properties.get("rcon.port") or RCON_DEFAULT_PORT),
+                properties["rcon.password"])
+
+    async def connection(self, server_name):
+        """
+        Get the connection of a server, connecting if it isn't connected.
+        """
+        connection = self.connections.get(server_name)
+        if connection is not None and connection.connected:
+            return connection
+        lock = self._locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            connection = self.connections.get(server_name)
+            if connection is not None and connection.connected:
+                return connection
+            retry_time, backoff = self._retry.get(server_name, (0, 0))
+            if time.monotonic() < retry_time:
+                raise ConnectionError("Can't connect to the RCON of server {}, retrying in {}s.".format(
+                    server_name, round(retry_time - time.monotonic())))
+            host, port, password = self.endpoint(server_name)
+            connection = RconConnection(host, port, password, self.timeout, self.pipeline_depth)
+            try:
+                await connection.connect()
+            except (OSError, asyncio.TimeoutError, RconError) as e:
+                backoff = min(max(backoff * 2, RCON_RECONNECT_MIN), RCON_RECONNECT_MAX)
+                self._retry[server_name] = (time.monotonic() + backoff, backoff)
+                if isinstance(e, RconError):
+                    raise
+                raise ConnectionError("Can't connect to the RCON of server {}: {}".format(server_name, e))
+            self._retry.pop(server_name, None)
+            self.connections[server_name] = connection
+            log(MODULE_NAME, "DEBUG", "Connected to the RCON of server {} ({}:{}).", server_name, host, port)
+            return connection
+
+    async def run_batch(self, server_name, commands):
+        """
+        Run commands on a server, in order. Returns their responses.
+        """
+        connection = self.connections.get(server_name)
+        reused = connection is not None and connection.connected
+        connection = await self.connection(server_name)
+        responses = connection.responses
+        try:
+            return await connection.run_batch(commands)
+        except ConnectionError:
+            # A connection that broke while idle: nothing was answered, so nothing ran. Retry once.
+            if not reused or connection.responses != responses:
+                raise
+            connection.close()
+            return await (await self.connection(server_name)).run_batch(commands)
+
+    async def run(self, server_name, command):
+        return (await self.run_batch(server_name, [command]))[0]
+
+    def running_servers(self):
+        """
+        The servers to broadcast to: the running ones, or all the installed ones without a supervisor.
+        """
+        if self.supervisor is None:
+            from MCSH.servers import get_registry
+            return sorted(set(get_registry().names()) | set(self.endpoints))
+        from MCSH.supervisor import STATE_RUNNING
+        return [name for name, server in self.supervisor.servers.items() if server.state == STATE_RUNNING]
+
+    async def broadcast(self, commands, server_names=None):
+        """
+        Run a command (or a batch of commands) on many servers at once, all the running ones by default.
+        Returns server name -> responses (a list for a batch), or the exception of that server.
+        """
+        batch = [commands] if isinstance(commands, str) else commands
+        server_names = self.running_servers() if server_names is None else server_names
+        results = await asyncio.gather(*[self.run_batch(server_name, batch) for server_name in server_names],
+                                       return_exceptions=True)
+        return {server_name: result[0] if isinstance(commands, str) and isinstance(result, list) else result
+                for server_name, result in zip(server_names, results)}
+
+    def _on_state_change(self, server, old_state, new_state):
+        from MCSH.supervisor import STATE_RUNNING
+        if new_state != STATE_RUNNING:
+            connection = self.connections.pop(server.name, None)
+            if connection is not None:
+                connection.close()
+            # The server may be back soon: don't keep it waiting for the backoff
+            self._retry.pop(server.name, None)
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
+
+def run_commands(server_name, commands):
+    """
+    Run commands on a server, through the pool of the daemon if it's running.
+    Returns their responses.
+    """
+    from MCSH.daemon import running_daemon
+    if running_daemon is not None:
+        supervisor_thread = running_daemon.supervisor_thread
+        return supervisor_thread.call(running_daemon.rcon_pool.run_batch(server_name, commands))
+
+    async def run():
+        pool = RconPool()
+        try:
+            return await pool.run_batch(server_name, commands)
+        finally:
+            pool.close()
+    return asyncio.run(run())
+
+
+def rcon_command(arguments):
+    """
+    Run a command on servers through RCON, all the running ones by default. (--rcon)
+    """
+    command, server_names = arguments[0], arguments[1:] or None
+    start = time.perf_counter()
+    from MCSH.daemon import running_daemon
+    if running_daemon is not None:
+        supervisor_thread = running_daemon.supervisor_thread
+        results = supervisor_thread.call(running_daemon.rcon_pool.broadcast(command, server_names))
+    else:
+        async def run():
+            pool = RconPool()
+            try:
+                return await pool.broadcast(command, server_names)
+            finally:
+                pool.close()
+        results = asyncio.run(run())
+    if not results:
+        log(MODULE_NAME, "WARNING", "No server to run the command on.")
+        return
+    for server_name, result in sorted(results.items()):
+        if isinstance(result, Exception):
+            log(MODULE_NAME, "ERROR", "[{}] {}", server_name, result)
+        else:
+            log(MODULE_NAME, "INFO", "[{}] {}", server_name, result)
+    log(MODULE_NAME, "DEBUG", "Ran on {} server(s) in {} ms.", len(results),
+        round((time.perf_counter() - start) * 1000, 1))
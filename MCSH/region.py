@@ -0,0 +1,272 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.region
+ Module Revision: 0.0.1-18
+ Module Description:
+    Reads Anvil region files (.mca), and scans worlds. (--scan)
+    A region file starts with the chunk locations (4 KB) and timestamps (4 KB) of
+    its 32x32 chunks, followed by the chunks in 4 KB sectors. The scanner only reads
+    the headers (and the 5-byte header of every chunk) through a memory map, and
+    decompresses the chunks only if asked to; the region files are scanned in parallel.
+    Scan results are saved to MCSH/config/world_stats.json, so the next scan can tell
+    which regions grew.
+"""
+import json
+import mmap
+import os
+import re
+import time
+import zlib
+
+from MCSH.logging import log
+from MCSH.process_pool import process_pool
+
+MODULE_NAME = "region"
+SECTOR_SIZE = 4096
+HEADER_SIZE = 2 * SECTOR_SIZE
+REGION_CHUNKS = 1024
+# Compression types of chunks
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+# Flag of chunks stored in an external .mcc file
+COMPRESSION_EXTERNAL = 128
+WORLD_STATS_FILE = "MCSH/config/world_stats.json"
+REGION_FILE_PATTERN = re.compile(r"^r\.(-?[0-9]+)\.(-?[0-9]+)\.mca$")
+DIMENSION_DIRECTORIES = {"DIM-1": "the_nether", "DIM1": "the_end"}
+
+
+def read_locations(buffer):
+    """
+    Read the chunk locations of a region header.
+    Returns a list of (chunk index, offset, length) in bytes, for the chunks that exist.
+    """
+    locations = []
+    for index in range(REGION_CHUNKS):
+        location = int.from_bytes(buffer[index * 4:index * 4 + 4], "big")
+        if location:
+            locations.append((index, (location >> 8) * SECTOR_SIZE, (location & 0xFF) * SECTOR_SIZE))
+    return locations
+
+
+def read_timestamps(buffer):
+    """
+    Read the last-modified timestamps (seconds) of the 1024 chunks of a region header.
+    """
+    return [int.from_bytes(buffer[SECTOR_SIZE + index * 4:SECTOR_SIZE + index * 4 + 4], "big")
+            for index in range(REGION_CHUNKS)]
+
+
+def read_chunk(buffer, offset):
+    """
+    Read the (compressed) data of a chunk.
+    Returns (compression type, data).
+    """
+    length = int.from_bytes(buffer[offset:offset + 4], "big")
+    compression = buffer[offset + 4]
+    return compression, bytes(buffer[offset + 5:offset + 4 + length])
+
+
+def decompress_chunk(compression, data):
+    """
+    Decompress the data of a chunk to its NBT.
+    """
+    if compression == COMPRESSION_GZIP:
+        import gzip
+        return gzip.decompress(data)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_NONE:
+        return data
+    raise ValueError("Unsupported chunk compression: {}".format(compression))
+
+
+def scan_region(file_name, decompress=False):
+    """
+    Get the statistics of a region file.
+    decompress: Also measure the decompressed size of the chunks (much slower).
+    """
+    match = REGION_FILE_PATTERN.match(os.path.basename(file_name))
+    stats = {
+        "file": file_name,
+        "x": int(match.group(1)) if match else None,
+        "z": int(match.group(2)) if match else None,
+        "size": os.path.getsize(file_name),
+        "chunks": 0,
+        "used": 0,
+        "payload": 0,
+        "free": 0,
+        "fragmentation": 0.0,
+        "oldest": None,
+        "newest": None,
+        "external": 0,
+        "corrupted": 0
+    }
+    if decompress:
+        stats["decompressed"] = 0
+    if stats["size"] < HEADER_SIZE:
+        return stats
+    with open(file_name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        locations = read_locations(mapped)
+        timestamps = read_timestamps(mapped)
+        sector_count = (stats["size"] + SECTOR_SIZE - 1) // SECTOR_SIZE
+        used_sectors = bytearray(sector_count)
+        for index, offset, length in locations:
+            if offset < HEADER_SIZE or offset + 5 > stats["size"]:
+                stats["corrupted"] += 1
+                continue
+            stats["chunks"] += 1
+            stats["used"] += length
+            for sector in range(offset // SECTOR_SIZE, min((offset + length) // SECTOR_SIZE, sector_count)):
+                used_sectors[sector] = 1
+            chunk_length = int.from_bytes(mapped[offset:offset + 4], "big")
+            compression = mapped[offset + 4]
+            stats["payload"] += chunk_length
+            if compression & COMPRESSION_EXTERNAL:
+                stats["external"] += 1
+            elif decompress:
+                try:
+                    stats["decompressed"] += len(decompress_chunk(*read_chunk(mapped, offset)))
+                except Exception:
+                    stats["corrupted"] += 1
+            if timestamps[index]:
+                stats["oldest"] = min(stats["oldest"] or timestamps[index], timestamps[index])
+                stats["newest"] = max(stats["newest"] or 0, timestamps[index])
+    # Unused sectors between the header and the last used sector are gaps
+    last_used = max([sector for sector in range(sector_count) if used_sectors[sector]], default=1)
+    data_sectors = last_used - 1
+    stats["free"] = sum([1 for sector in range(2, last_used + 1) if not used_sectors[sector]]) * SECTOR_SIZE
+    stats["fragmentation"] = round(stats["free"] / (data_sectors * SECTOR_SIZE), 4) if data_sectors > 0 else 0.0
+    return stats
+
+
+def find_region_files(world_directory):
+    """
+    Find the region files of a world (or all the worlds in a directory), by dimension.
+    Returns dimension name -> list of region files.
+    """
+    dimensions = {}
+    for root, directories, files in os.walk(world_directory):
+        directories.sort()
+        region_files = sorted([file for file in files if REGION_FILE_PATTERN.match(file)])
+        # Entities and POI (1.14+) are region files too, but not the terrain
+        if not region_files or os.path.basename(root) != "region":
+            continue
+        # <world>/region, <world>/DIM-1/region, <world>/dimensions/<namespace>/<name>/region (1.16+)...
+        parts = os.path.relpath(root, world_directory).replace(os.sep, "/").split("/")[:-1]
+        if parts and parts[-1] in DIMENSION_DIRECTORIES:
+            world, dimension = parts[:-1], DIMENSION_DIRECTORIES[parts[-1]]
+        elif len(parts) >= 3 and parts[-3] == "dimensions":
+            world, dimension = parts[:-3], ":".join(parts[-2:])
+        else:
+            world, dimension = parts, "overworld"
+        dimension = "/".join(world + [dimension])
+        dimensions[dimension] = [os.path.join(root, file) for file in region_files]
+    return dimensions
+
+
+def scan_world(world_directory, decompress=False, workers=None):
+    """
+    Scan all the region files of a world in parallel.
+    Returns {"time", "world", "dimensions": {dimension: totals}, "regions": [region stats]}.
+    """
+    dimensions = find_region_files(world_directory)
+    jobs = [(dimension, file_name) for dimension, files in dimensions.items() for file_name in files]
+    with process_pool(workers) as executor:
+        regions = list(executor.map(scan_region, [file_name for dimension, file_name in jobs],
+                                    [decompress] * len(jobs), chunksize=max(len(jobs) // 64, 1)))
+    totals = {}
+    for (dimension, file_name), stats in zip(jobs, regions):
+        stats["dimension"] = dimension
+        stats["name"] = os.path.relpath(file_name, world_directory).replace(os.sep, "/")
+        total = totals.setdefault(dimension, {"regions": 0, "chunks": 0, "size": 0, "used": 0,
+                                              "free": 0, "newest": None})
+        total["regions"] += 1
+        for key in ["chunks", "size", "used", "free"]:
+            total[key] += stats[key]
+        if stats["newest"]:
+            total["newest"] = max(total["newest"] or 0, stats["newest"])
+    for total in totals.values():
+        total["fragmentation"] = round(total["free"] / total["size"], 4) if total["size"] else 0.0
+    return {"time": time.time(), "world": os.path.abspath(world_directory), "dimensions": totals,
+            "regions": regions}
+
+
+def _load_world_stats():
+    try:
+        with open(WORLD_STATS_FILE, "r") as f:
+            world_stats = json.load(f)
+            f.close()
+        return world_stats
+    except Exception:
+        return {}
+
+
+def _save_world_stats(scan):
+    """
+    Save the sizes of the scan, replacing the previous scan of the world.
+    """
+    world_stats = _load_world_stats()
+    world_stats[scan["world"]] = {
+        "time": scan["time"],
+        "dimensions": scan["dimensions"],
+        "regions": {stats["name"]: stats["size"] for stats in scan["regions"]}
+    }
+    try:
+        with open(WORLD_STATS_FILE, "w") as f:
+            f.write(json.dumps(world_stats))
+            f.close()
+    except Exception:
+        log(MODULE_NAME, "WARNING", "Failed to save the world stats.")
+
+
+def _format_size(size):
+    return "{} MB".format(round(size / 1024 / 1024, 1))
+
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+
+def scan_command(world_directory):
+    """
+    Scan a world, or the worlds of a server, and show the statistics. (--scan)
+    """
+    from MCSH.servers import get_registry
+    server = get_registry().get(world_directory)
+    if server is not None:
+        world_directory = server["directory"]
+    if not os.path.isdir(world_directory):
+        log(MODULE_NAME, "ERROR", "{} isn't a directory or a server.", world_directory)
+        return
+    start = time.perf_counter()
+    scan = scan_world(world_directory)
+    if not scan["regions"]:
+        log(MODULE_NAME, "WARNING", "There's no region file in {}.", world_directory)
+        return
+    log(MODULE_NAME, "INFO", "Scanned {} region file(s) in {}s.", len(scan["regions"]),
+        round(time.perf_counter() - start, 2))
+    log(MODULE_NAME, "INFO", lambda: "-- Dimensions --\n" + "\n".join(
+        ["{}: {} regions, {} chunks, {}, {} fragmented, last modified {}".format(
+            dimension, total["regions"], total["chunks"], _format_size(total["size"]),
+            "{}%".format(round(total["fragmentation"] * 100, 1)), _format_time(total["newest"]))
+         for dimension, total in sorted(scan["dimensions"].items())]))
+    largest = sorted(scan["regions"], key=lambda stats: stats["size"], reverse=True)[:10]
+    log(MODULE_NAME, "INFO", lambda: "-- Largest Regions --\n" + "\n".join(
+        ["{} r.{}.{}: {} chunks, {}, {}% fragmented, last modified {}".format(
+            stats["dimension"], stats["x"], stats["z"], stats["chunks"], _format_size(stats["size"]),
+            round(stats["fragmentation"] * 100, 1), _format_time(stats["newest"])) for stats in largest]))
+    previous = _load_world_stats().get(scan["world"])
+    if previous is not None:
+        days = max((scan["time"] - previous["time"]) / 86400, 1 / 24)
+        growth = sorted([(stats["size"] - previous["regions"].get(stats["name"], 0), stats)
+                         for stats in scan["regions"]], key=lambda item: item[0], reverse=True)[:10]
+        log(MODULE_NAME, "INFO", lambda: "-- Fastest Growing Regions (since {}) --\n".format(
+            _format_time(previous["time"])) + "\n".join(
+            ["{} r.{}.{}: +{}/day".format(stats["dimension"], stats["x"], stats["z"], _format_size(delta / days))
+             for delta, stats in growth if delta > 0]))
+    _save_world_stats(scan)
@@ -0,0 +1,356 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.repository
+ Module Revision: 0.0.1-18
+ Module Description:
+    The server repository.
+    A local index of the JE/BE versions of every server flavour, built from the
+    REPOSITORY_SOURCES, and saved to MCSH/config/repository.idx (marshal) when it changes.
+    Every source is refreshed with a conditional request (ETag/If-Modified-Since),
+    so unchanged sources cost a '304 Not Modified' only; when offline, the last
+    saved index is used, and the sources aren't tried again for REPOSITORY_RETRY_INTERVAL.
+    When the sources were checked (and last tried) is saved to MCSH/config/repository_state.json.
+    Paper publishes new builds of a version without changing its version list,
+    so the latest build of its newest version is checked as well.
+    The index stores the entries as tuples of ENTRY_FIELDS, and the sorted
+    search tokens with their entries, so a search is a few binary searches.
+"""
+import bisect
+import json
+import marshal
+import os
+import re
+import sys
+import time
+
+from MCSH.consts import MCSH_version
+from MCSH.logging import log
+
+MODULE_NAME = "repository"
+REPOSITORY_INDEX_FILE = "MCSH/config/repository.idx"
+REPOSITORY_STATE_FILE = "MCSH/config/repository_state.json"
+REPOSITORY_INDEX_VERSION = 2
+# Seconds before the sources are checked again
+REPOSITORY_REFRESH_INTERVAL = 86400
+# Seconds before a source that couldn't be reached is tried again
+REPOSITORY_RETRY_INTERVAL = 600
+REPOSITORY_TIMEOUT = 10
+REPOSITORY_SOURCES = {
+    "vanilla": "https://launchermeta.mojang.com/mc/game/version_manifest.json",
+    "paper": "https://api.papermc.io/v2/projects/paper",
+    "bedrock": "https://net-secondary.web.minecraft-services.net/api/v1.0/download/links"
+}
+# name: <flavour>-<version>; url: Where the details (or the server itself, for BE) are;
+# build: The latest build of the version, or None if the flavour has no builds (or it's unknown)
+ENTRY_FIELDS = ("name", "type", "flavour", "version", "channel", "time", "url", "build")
+_TOKEN_SPLIT = re.compile(r"[\s\-_]+")
+
+
+def _parse_vanilla(data):
+    manifest = json.loads(data)
+    return [("vanilla-" + version["id"], "JE", "vanilla", version["id"], version["type"],
+             version.get("releaseTime", ""), version["url"], None) for version in manifest["versions"]]
+
+
+def _parse_paper(data):
+    project = json.loads(data)
+    return [("paper-" + version, "JE", "paper", version, "release", "",
+             REPOSITORY_SOURCES["paper"] + "/versions/" + version, None) for version in project["versions"]]
+
+
+def _parse_bedrock(data):
+    links = json.loads(data)["result"]["links"]
+    platform = "Windows" if sys.platform == "win32" else "Linux"
+    entries = []
+    for link in links:
+        match = re.search(r"bedrock-server-([0-9.]+)\.zip", link.get("downloadUrl", ""))
+        if match is None or not link.get("downloadType", "").endswith(platform):
+            continue
+        channel = "preview" if "Preview" in link["downloadType"] else "release"
+        entries.append(("bedrock-" + match.group(1), "BE", "bedrock", match.group(1), channel, "",
+                        link["downloadUrl"], None))
+    return entries
+
+
+SOURCE_PARSERS = {
+    "vanilla": _parse_vanilla,
+    "paper": _parse_paper,
+    "bedrock": _parse_bedrock
+}
+
+
+def tokenize(text):
+    """
+    Split a name or a query into lowercase search tokens.
+    """
+    return [token for token in _TOKEN_SPLIT.split(text.lower()) if token]
+
+
+class RepositoryIndex:
+    """
+    The repository index.
+    """
+
+    def __init__(self, index_file=REPOSITORY_INDEX_FILE, state_file=REPOSITORY_STATE_FILE):
+        self.index_file = index_file
+        self.state_file = state_file
+        # Source name -> {"etag", "last_modified", "entries"}
+        self.sources = {}
+        # Source name -> {"checked": last successful check, "attempted": last try}
+        self.state = {}
+        self.entries = []
+        self.names = {}
+        self.tokens = []
+        self.postings = []
+        self.load()
+
+    def load(self):
+        """
+        Load the saved index, if there's a usable one.
+        """
+        try:
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+        except Exception:
+            self.state = {}
+        try:
+            with open(self.index_file, "rb") as f:
+                saved = marshal.load(f)
+                f.close()
+            if saved["version"] != REPOSITORY_INDEX_VERSION:
+                return False
+        except Exception:
+            return False
+        self.sources = saved["sources"]
+        self.entries = saved["entries"]
+        self.tokens = saved["tokens"]
+        self.postings = saved["postings"]
+        self.names = {entry[0]: index for index, entry in enumerate(self.entries)}
+        return True
+
+    def save(self):
+        temp_file = self.index_file + ".tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                marshal.dump({"version": REPOSITORY_INDEX_VERSION, "sources": self.sources,
+                              "entries": self.entries, "tokens": self.tokens,
+                              "postings": self.postings}, f)
+                f.close()
+            os.replace(temp_file, self.index_file)
+        except Exception:
+            log(MODULE_NAME, "WARNING", "Failed to save the repository index.")
+
+    def save_state(self):
+        temp_file = self.state_file + ".tmp"
+        try:
+            with open(temp_file, "w") as f:
+                json.dump(self.state, f)
+            os.replace(temp_file, self.state_file)
+        except Exception:
+            log(MODULE_NAME, "WARNING", "Failed to save the repository state.")
+
+    def _build(self):
+        """
+        Merge the entries of the sources, and build the token index.
+        """
+        entries = []
+        for source_name in sorted(self.sources):
+            entries.extend(self.sources[source_name]["entries"])
+        token_entries = {}
+        for index, entry in enumerate(entries):
+            tokens = set(tokenize(entry[0]))
+            tokens.update([entry[1].lower(), entry[2], entry[3], entry[4]])
+            for token in tokens:
+                token_entries.setdefault(token, []).append(index)
+        self.entries = entries
+        self.names = {entry[0]: index for index, entry in enumerate(entries)}
+        self.tokens = sorted(token_entries)
+        self.postings = [tuple(token_entries[token]) for token in self.tokens]
+
+    def _fetch(self, source_name, source):
+        """
+        Fetch a source if it changed.
+        Returns the new data, or None if it's not modified.
+        """
+        import urllib.error
+        import urllib.request
+        headers = {"User-Agent": MCSH_version}
+        if source.get("etag"):
+            headers["If-None-Match"] = source["etag"]
+        if source.get("last_modified"):
+            headers["If-Modified-Since"] = source["last_modified"]
+        request = urllib.request.Request(REPOSITORY_SOURCES[source_name], headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=REPOSITORY_TIMEOUT) as response:
+                data = response.read()
+                source["etag"] = response.headers.get("ETag")
+                source["last_modified"] = response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        return data
+
+    @staticmethod
+    def _check_paper_build(source):
+        """
+        Set the latest build of the newest Paper version.
+        Returns whether it changed.
+        """
+        if not source["entries"]:
+            return False
+        entry = source["entries"][-1]
+        build = _get_json(entry[6])["builds"][-1]
+        if entry[7] == build:
+            return False
+        source["entries"][-1] = entry[:7] + (build,)
+        log(MODULE_NAME, "DEBUG", "{} has a new build: {}.", entry[0], build)
+        return True
+
+    def _due(self, source_name, now):
+        state = self.state.get(source_name, {})
+        return now - state.get("checked", 0) >= REPOSITORY_REFRESH_INTERVAL and \
+            now - state.get("attempted", 0) >= REPOSITORY_RETRY_INTERVAL
+
+    def refresh(self, force=False):
+        """
+        Refresh the sources that weren't checked within REPOSITORY_REFRESH_INTERVAL
+        (nor tried within REPOSITORY_RETRY_INTERVAL).
+        A source that can't be reached keeps its saved entries. The index is saved only if it changed.
+        Returns whether anything changed.
+        """
+        import urllib.error
+        changed = False
+        offline = False
+        now = time.time()
+        due = [source_name for source_name in REPOSITORY_SOURCES if force or self._due(source_name, now)]
+        for source_name in due:
+            source = self.sources.setdefault(source_name, {"etag": None, "last_modified": None, "entries": []})
+            state = self.state.setdefault(source_name, {"checked": 0, "attempted": 0})
+            state["attempted"] = now
+            if offline:
+                # Another source couldn't be reached: don't wait for this one's timeout as well
+                continue
+            log(MODULE_NAME, "DEBUG", "Checking repository source {}...", source_name)
+            try:
+                data = self._fetch(source_name, source)
+                if data is not None:
+                    source["entries"] = SOURCE_PARSERS[source_name](data)
+                    changed = True
+                    log(MODULE_NAME, "DEBUG", "Source {} updated ({} entries).",
+                        source_name, len(source["entries"]))
+                if source_name == "paper":
+                    changed = self._check_paper_build(source) or changed
+                state["checked"] = now
+            except Exception as e:
+                log(MODULE_NAME, "WARNING", "Can't refresh repository source {}, using the saved index: {}",
+                    source_name, e)
+                # No connection (rather than an HTTP error, or a response that can't be parsed)
+                offline = isinstance(e, OSError) and not isinstance(e, urllib.error.HTTPError)
+        if changed:
+            self._build()
+            self.save()
+        if due:
+            self.save_state()
+        return changed
+
+    def get(self, name):
+        """
+        Get an entry by name (as a dict), or None.
+        """
+        index = self.names.get(name)
+        if index is None:
+            return None
+        return dict(zip(ENTRY_FIELDS, self.entries[index]))
+
+    def search(self, query):
+        """
+        Get the entries matching every term of the query; a term matches the tokens it prefixes.
+        """
+        result = None
+        for term in tokenize(query):
+            # The tokens starting with the term are a contiguous range of the sorted tokens
+            start = bisect.bisect_left(self.tokens, term)
+            end = bisect.bisect_left(self.tokens, term + "\uffff", start)
+            matches = set()
+            for postings in self.postings[start:end]:
+                matches.update(postings)
+            result = matches if result is None else result & matches
+            if not result:
+                return []
+        return [dict(zip(ENTRY_FIELDS, self.entries[index])) for index in sorted(result or [])]
+
+
+def _get_json(url):
+    import urllib.request
+    request = urllib.request.Request(url, headers={"User-Agent": MCSH_version})
+    with urllib.request.urlopen(request, timeout=REPOSITORY_TIMEOUT) as response:
+        return json.loads(response.read())
+
+
+def resolve_download(entry):
+    """
+    Find the download of an entry (as a dict).
+    Returns (url, SHA-1 or None, SHA-256 or None).
+    """
+    if entry["flavour"] == "vanilla":
+        download = _get_json(entry["url"])["downloads"]["server"]
+        return download["url"], download.get("sha1"), None
+    if entry["flavour"] == "paper":
+        build = entry.get("build") or _get_json(entry["url"])["builds"][-1]
+        build_url = "{}/builds/{}".format(entry["url"], build)
+        application = _get_json(build_url)["downloads"]["application"]
+        return "{}/downloads/{}".format(build_url, application["name"]), None, application.get("sha256")
+    return entry["url"], None, None
+
+
+def get_repository():
+    """
+    Get the repository index, refreshing it when it's due.
+    """
+    repository = RepositoryIndex()
+    repository.refresh()
+    if not repository.entries:
+        log(MODULE_NAME, "ERROR", "The repository is empty, and can't be downloaded.")
+    return repository
+
+
+def _log_entries(entries):
+    log(MODULE_NAME, "INFO", lambda: "{} server(s):\n".format(len(entries)) + "\n".join(
+        ["{:<28} {:<3} {:<8} {}".format(entry["name"], entry["type"], entry["channel"], entry["time"][:10])
+         for entry in entries]))
+
+
+def repository_list():
+    """
+    List all server(s) in the repository. (--repolist)
+    """
+    repository = get_repository()
+    _log_entries([dict(zip(ENTRY_FIELDS, entry)) for entry in repository.entries])
+
+
+def repository_search(server_name):
+    """
+    Search for server(s) in the repository. (--reposearch)
+    """
+    entries = get_repository().search(server_name)
+    if not entries:
+        log(MODULE_NAME, "WARNING", "No server matches '{}'.", server_name)
+        return
+    _log_entries(entries)
+
+
+def repository_show(server_name):
+    """
+    Show the specific server detail in the repository. (--reposhow)
+    """
+    entry = get_repository().get(server_name)
+    if entry is None:
+        log(MODULE_NAME, "ERROR", "There's no '{}' in the repository, try --reposearch.", server_name)
+        return
+    log(MODULE_NAME, "INFO", "\n".join(["{}: {}".format(field.capitalize(), entry[field] or "-")
+                                        for field in ENTRY_FIELDS]))
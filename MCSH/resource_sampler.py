@@ -0,0 +1,183 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.resource_sampler
+ Module Revision: 0.0.1-18
+ Module Description:
+    Samples the resource usage of the server processes.
+    One sampling loop reads all the processes each tick (using psutil's oneshot()),
+    and keeps the samples in a fixed-size ring buffer per server,
+    so the memory used stays the same no matter how long MCSH runs.
+"""
+import asyncio
+import time
+from array import array
+
+from MCSH.get_computer_info import import_psutil
+from MCSH.logging import log
+
+MODULE_NAME = "resource_sampler"
+SAMPLE_FIELDS = ("time", "cpu_percent", "rss", "threads", "open_files", "read_bytes", "write_bytes")
+SAMPLE_INTERVAL = 5
+# One hour of samples with the default interval
+SAMPLE_CAPACITY = 720
+
+
+class RingBuffer:
+    """
+    A fixed-size ring buffer of samples.
+    Every field is stored in its own array of doubles.
+    """
+
+    def __init__(self, capacity=SAMPLE_CAPACITY, fields=SAMPLE_FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.columns = {field: array("d", bytes(8 * capacity)) for field in fields}
+        self.next_index = 0
+        self.count = 0
+
+    def append(self, sample):
+        """
+        Append a sample (a tuple, in the order of the fields), overwriting the oldest one if full.
+        """
+        for field, value in zip(self.fields, sample):
+            self.columns[field][self.next_index] = value
+        self.next_index = (self.next_index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def __len__(self):
+        return self.count
+
+    def _indexes(self):
+        start = (self.next_index - self.count) % self.capacity
+        return [(start + i) % self.capacity for i in range(self.count)]
+
+    def latest(self):
+        """
+        The latest sample as a dict, or None if there's no sample.
+        """
+        if not self.count:
+            return None
+        index = (self.next_index - 1) % self.capacity
+        return {field: self.columns[field][index] for field in self.fields}
+
+    def column(self, field):
+        """
+        All the values of a field, oldest first.
+        """
+        values = self.columns[field]
+        return [values[i] for i in self._indexes()]
+
+    def samples(self):
+        """
+        All the samples as dicts, oldest first.
+        """
+        return [{field: self.columns[field][i] for field in self.fields} for i in self._indexes()]
+
+
+class ResourceSampler:
+    """
+    Samples the resource usage of many processes in one loop.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, capacity=SAMPLE_CAPACITY):
+        self.interval = interval
+        self.capacity = capacity
+        self.buffers = {}
+        # Server name -> psutil.Process (kept, as cpu_percent() compares with the previous call)
+        self.processes = {}
+        # Called with (server name, sample tuple) for every sample
+        self.sample_listeners = []
+        self._psutil = import_psutil()
+
+    def track(self, name, pid):
+        """
+        Start sampling a server process.
+        """
+        try:
+            process = self._psutil.Process(pid)
+            process.cpu_percent(None)
+        except self._psutil.Error:
+            log(MODULE_NAME, "WARNING", "Can't sample server {} (PID {}).", name, pid)
+            return
+        self.processes[name] = process
+        if name not in self.buffers:
+            self.buffers[name] = RingBuffer(self.capacity)
+
+    def untrack(self, name):
+        """
+        Stop sampling a server process (its samples are kept).
+        """
+        self.processes.pop(name, None)
+
+    def attach(self, supervisor):
+        """
+        Track the servers of a supervisor automatically, following their states.
+        """
+        from MCSH.supervisor import STATE_STARTING, STATE_RUNNING
+
+        def on_state_change(server, old_state, new_state):
+            if new_state in (STATE_STARTING, STATE_RUNNING) and server.pid is not None:
+                if server.name not in self.processes or self.processes[server.name].pid != server.pid:
+                    self.track(server.name, server.pid)
+            elif new_state not in (STATE_STARTING, STATE_RUNNING):
+                self.untrack(server.name)
+
+        supervisor.state_listeners.append(on_state_change)
+
+    def _sample_process(self, process, now):
+        """
+        Read all the values of a process at once.
+        """
+        with process.oneshot():
+            cpu_percent = process.cpu_percent(None)
+            rss = process.memory_info().rss
+            threads = process.num_threads()
+            if hasattr(process, "num_fds"):
+                open_files = process.num_fds()
+            else:
+                open_files = process.num_handles()
+            try:
+                io_counters = process.io_counters()
+                read_bytes, write_bytes = io_counters.read_bytes, io_counters.write_bytes
+            except (AttributeError, self._psutil.AccessDenied):
+                read_bytes, write_bytes = 0, 0
+        return now, cpu_percent, rss, threads, open_files, read_bytes, write_bytes
+
+    def sample_once(self):
+        """
+        Sample all the tracked processes once.
+        """
+        now = time.time()
+        for name, process in list(self.processes.items()):
+            try:
+                sample = self._sample_process(process, now)
+            except self._psutil.NoSuchProcess:
+                self.untrack(name)
+                continue
+            except self._psutil.Error:
+                continue
+            self.buffers[name].append(sample)
+            for listener in self.sample_listeners:
+                try:
+                    listener(name, sample)
+                except Exception:
+                    log(MODULE_NAME, "ERROR", "A sample listener failed for server {}.", name)
+
+    def latest(self):
+        """
+        The latest sample of every server.
+        """
+        return {name: buffer.latest() for name, buffer in self.buffers.items()}
+
+    async def run(self):
+        """
+        Sample every interval, until cancelled.
+        """
+        while True:
+            started = time.monotonic()
+            self.sample_once()
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
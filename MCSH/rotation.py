@@ -0,0 +1,211 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.rotation
+ Module Revision: 0.0.1-18
+ Module Description:
+    Rotation and archiving for logs and crash reports.
+    Rotated segments are gzip-compressed in the background, and appended
+    to a per-period archive (e.g. archive/2020-08.tar) without rewriting it.
+    The oldest archives are deleted once the retention size is exceeded.
+    A segment that is being written is locked (flock) by its writer, and isn't archived by another
+    MCSH process (e.g. a daemon that keeps running); the archives are appended under archive/.lock.
+    Considering crashes during the PRE-INITIALIZATION, it will NOT use MCSH.logging.
+"""
+import os
+import threading
+import time
+
+# Defaults for the rotation engine
+ROTATE_MAX_BYTES = 5 * 1024 * 1024
+ROTATE_PERIOD_FORMAT = "%Y-%m"
+RETENTION_MAX_BYTES = 64 * 1024 * 1024
+ARCHIVE_LOCK_FILE = ".lock"
+
+
+def _flock(file, blocking=True):
+    """
+    Lock a file exclusively (until it's unlocked or closed).
+    Returns False if another open file holds the lock (only when not blocking).
+    Files can't be locked where there's no flock: then it always succeeds.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class Rotator:
+    """
+    A rotation engine for a directory of text files (logs, crash reports).
+    """
+
+    def __init__(self, directory, suffix=".log", max_bytes=ROTATE_MAX_BYTES, rotate_daily=True,
+                 period_format=ROTATE_PERIOD_FORMAT, retention_bytes=RETENTION_MAX_BYTES):
+        """
+        directory: The directory that holds the segments.
+        suffix: Only files ending with it are treated as segments.
+        max_bytes: Rotate a segment once it reaches this size (0 to disable).
+        rotate_daily: Rotate a segment once the day changes.
+        period_format: strftime format of the archive period (one archive per period).
+        retention_bytes: Maximum total size of all archives (0 to disable).
+        """
+        self.directory = directory
+        self.archive_directory = os.path.join(directory, "archive")
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.period_format = period_format
+        self.retention_bytes = retention_bytes
+        self._lock = threading.Lock()
+        self._threads = []
+        self._issued_names = set()
+
+    def should_rotate(self, segment_size, segment_opened_time):
+        """
+        Check whether the segment that is being written should be rotated.
+        """
+        if self.max_bytes and segment_size >= self.max_bytes:
+            return True
+        if self.rotate_daily and \
+                time.strftime("%Y-%m-%d", time.localtime(segment_opened_time)) != \
+                time.strftime("%Y-%m-%d", time.localtime()):
+            return True
+        return False
+
+    def new_segment_name(self, prefix=""):
+        """
+        Get an unused segment path, named by the current time.
+        Names issued before are never reused, as they might be in the archive already.
+        """
+        base_name = prefix + time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+        segment_name = os.path.join(self.directory, base_name + self.suffix)
+        counter = 1
+        while os.path.exists(segment_name) or segment_name in self._issued_names:
+            segment_name = os.path.join(self.directory, "{}.{}{}".format(base_name, counter, self.suffix))
+            counter += 1
+        self._issued_names.add(segment_name)
+        return segment_name
+
+    def list_segments(self):
+        """
+        List all the segments in the directory, oldest first.
+        """
+        try:
+            segments = [os.path.join(self.directory, file) for file in os.listdir(self.directory)
+                        if file.endswith(self.suffix) and os.path.isfile(os.path.join(self.directory, file))]
+        except OSError:
+            return []
+        return sorted(segments, key=lambda segment: (os.path.getmtime(segment), segment))
+
+    def hold(self, segment_file):
+        """
+        Lock the open file of a segment that is being written, so it isn't archived until it's closed.
+        """
+        _flock(segment_file, blocking=False)
+
+    def archive_old(self, keep=0, exclude=()):
+        """
+        Archive all the segments except for the newest 'keep' ones (and the excluded ones).
+        Segments that are still written (see hold) are skipped.
+        """
+        segments = [segment for segment in self.list_segments()
+                    if os.path.abspath(segment) not in [os.path.abspath(i) for i in exclude]]
+        if keep:
+            segments = segments[:-keep]
+        if segments:
+            self.archive(segments)
+
+    def archive(self, segments, wait=False):
+        """
+        Compress and archive the segments in a background thread.
+        The thread isn't a daemon thread, so the interpreter waits for it at exit.
+        """
+        thread = threading.Thread(target=self._archive_segments, args=(list(segments),),
+                                  name="MCSH-Rotator", daemon=False)
+        self._threads = [i for i in self._threads if i.is_alive()]
+        self._threads.append(thread)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def wait(self, timeout=None):
+        """
+        Wait for all the background archiving to finish.
+        """
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _archive_segments(self, segments):
+        with self._lock:
+            try:
+                os.makedirs(self.archive_directory, exist_ok=True)
+                lock_file = open(os.path.join(self.archive_directory, ARCHIVE_LOCK_FILE), "a")
+            except OSError:
+                print("[??-??] [rotation/ERROR]: Can't open the archive directory {}.".format(self.archive_directory))
+                return
+            # Other processes archive into the same archives
+            with lock_file:
+                _flock(lock_file)
+                for segment in segments:
+                    try:
+                        self._archive_segment(segment)
+                    except Exception:
+                        print("[??-??] [rotation/ERROR]: Failed to archive {}.".format(segment))
+                try:
+                    self._enforce_retention()
+                except Exception:
+                    print("[??-??] [rotation/ERROR]: Failed to clean up old archives.")
+
+    def _archive_segment(self, segment):
+        """
+        Compress a segment, and append it to the archive of its period.
+        A tar archive is appended in place, so the old members are never rewritten.
+        """
+        # Imported here, as archiving always runs in the background
+        import gzip
+        import shutil
+        import tarfile
+        try:
+            source = open(segment, "rb")
+        except FileNotFoundError:
+            # Archived by another process already
+            return
+        with source:
+            if not _flock(source, blocking=False):
+                # Still written by another process
+                return
+            segment_time = os.path.getmtime(segment)
+            archive_name = os.path.join(self.archive_directory,
+                                        time.strftime(self.period_format, time.localtime(segment_time)) + ".tar")
+            compressed_name = segment + ".gz"
+            with gzip.open(compressed_name, "wb") as target:
+                shutil.copyfileobj(source, target)
+            with tarfile.open(archive_name, "a") as tar:
+                tar.add(compressed_name, arcname=os.path.basename(compressed_name))
+            os.remove(compressed_name)
+            os.remove(segment)
+
+    def _enforce_retention(self):
+        """
+        Delete the oldest archives until the total size meets the retention limit.
+        The newest archive is always kept.
+        """
+        if not self.retention_bytes or not os.path.exists(self.archive_directory):
+            return
+        archives = sorted([os.path.join(self.archive_directory, file)
+                           for file in os.listdir(self.archive_directory) if file.endswith(".tar")])
+        total_size = sum([os.path.getsize(archive) for archive in archives])
+        for archive in archives[:-1]:
+            if total_size <= self.retention_bytes:
+                break
+            total_size -= os.path.getsize(archive)
+            os.remove(archive)
@@ -0,0 +1,164 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.scheduler
+ Module Revision: 0.0.1-18
+ Module Description:
+    A dependency-aware job scheduler.
+    A job runs once all the jobs it depends on are done (it's skipped if any of them failed).
+    Every job belongs to a pool, which limits how many of its jobs run at once,
+    and how long to wait between starting them (the stagger).
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from MCSH.logging import log
+
+MODULE_NAME = "scheduler"
+# Job states
+JOB_PENDING = "PENDING"
+JOB_RUNNING = "RUNNING"
+JOB_DONE = "DONE"
+JOB_FAILED = "FAILED"
+JOB_SKIPPED = "SKIPPED"
+
+
+class Job:
+    """
+    A scheduled job.
+    """
+    __slots__ = ("name", "function", "dependencies", "pool", "description", "state", "result", "error")
+
+    def __init__(self, name, function, dependencies=(), pool="default", description=None):
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies)
+        self.pool = pool
+        self.description = description or name
+        self.state = JOB_PENDING
+        self.result = None
+        self.error = None
+
+
+class JobScheduler:
+    """
+    The job scheduler.
+    pools: Pool name -> (concurrency, stagger seconds).
+    """
+
+    def __init__(self, pools=None):
+        self.pools = {"default": (1, 0)}
+        self.pools.update(pools or {})
+        self.jobs = {}
+
+    def add(self, name, function, dependencies=(), pool="default", description=None):
+        """
+        Add a job. function is called with the results of the dependencies, as a dict.
+        Adding a job with the same name again returns the existing job (e.g. a shared download).
+        """
+        if name in self.jobs:
+            return self.jobs[name]
+        if pool not in self.pools:
+            raise ValueError("Unknown pool: {}".format(pool))
+        job = Job(name, function, dependencies, pool, description)
+        self.jobs[name] = job
+        return job
+
+    def plan(self):
+        """
+        The jobs in an order that satisfies the dependencies.
+        """
+        ordered = []
+        visiting = set()
+        visited = set()
+
+        def visit(job):
+            if job.name in visited:
+                return
+            if job.name in visiting:
+                raise ValueError("Dependency cycle at job {}.".format(job.name))
+            visiting.add(job.name)
+            for dependency in job.dependencies:
+                if dependency not in self.jobs:
+                    raise ValueError("Job {} depends on unknown job {}.".format(job.name, dependency))
+                visit(self.jobs[dependency])
+            visiting.discard(job.name)
+            visited.add(job.name)
+            ordered.append(job)
+
+        for job in self.jobs.values():
+            visit(job)
+        return ordered
+
+    def run(self, dry_run=False):
+        """
+        Run all the jobs.
+        dry_run: Only log the plan.
+        Returns whether all the jobs are done.
+        """
+        ordered = self.plan()
+        if dry_run:
+            log(MODULE_NAME, "INFO", lambda: "-- Plan ({} jobs) --\n".format(len(ordered)) + "\n".join(
+                ["{}. [{}] {}{}".format(index + 1, job.pool, job.description,
+                                        " (after {})".format(", ".join(job.dependencies))
+                                        if job.dependencies else "")
+                 for index, job in enumerate(ordered)]))
+            return True
+        running = {}
+        pool_running = {pool: 0 for pool in self.pools}
+        pool_last_start = {pool: 0 for pool in self.pools}
+        finished = 0
+        with ThreadPoolExecutor(max_workers=sum([pool[0] for pool in self.pools.values()]),
+                                thread_name_prefix="MCSH-Job") as executor:
+            while finished < len(ordered):
+                next_start = None
+                for job in ordered:
+                    if job.state != JOB_PENDING:
+                        continue
+                    dependency_states = [self.jobs[dependency].state for dependency in job.dependencies]
+                    if any([state in (JOB_FAILED, JOB_SKIPPED) for state in dependency_states]):
+                        job.state = JOB_SKIPPED
+                        finished += 1
+                        log(MODULE_NAME, "WARNING", "[{}/{}] Skipped: {}", finished, len(ordered), job.description)
+                        continue
+                    if not all([state == JOB_DONE for state in dependency_states]):
+                        continue
+                    concurrency, stagger = self.pools[job.pool]
+                    if pool_running[job.pool] >= concurrency:
+                        continue
+                    wait_time = pool_last_start[job.pool] + stagger - time.monotonic()
+                    if wait_time > 0:
+                        next_start = wait_time if next_start is None else min(next_start, wait_time)
+                        continue
+                    job.state = JOB_RUNNING
+                    pool_running[job.pool] += 1
+                    pool_last_start[job.pool] = time.monotonic()
+                    log(MODULE_NAME, "INFO", "Started: {}", job.description)
+                    results = {dependency: self.jobs[dependency].result for dependency in job.dependencies}
+                    # In the context of the caller: the output of a command the daemon runs goes to its client
+                    running[executor.submit(contextvars.copy_context().run, job.function, results)] = job
+                if finished >= len(ordered):
+                    break
+                if not running:
+                    # Nothing can run until a stagger is over
+                    time.sleep(next_start or 0)
+                    continue
+                done, not_done = wait(list(running), timeout=next_start, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    pool_running[job.pool] -= 1
+                    finished += 1
+                    try:
+                        job.result = future.result()
+                        job.state = JOB_DONE
+                        log(MODULE_NAME, "INFO", "[{}/{}] Done: {}", finished, len(ordered), job.description)
+                    except Exception as e:
+                        job.error = e
+                        job.state = JOB_FAILED
+                        log(MODULE_NAME, "ERROR", "[{}/{}] Failed: {}: {}", finished, len(ordered),
+                            job.description, e)
+        return all([job.state == JOB_DONE for job in ordered])
@@ -0,0 +1,120 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.server_properties
+ Module Revision: 0.0.1-18
+ Module Description:
+    Reads and edits the server.properties of the servers.
+    Edits keep the layout of the file: its comments, order and untouched lines.
+"""
+import os
+
+MODULE_NAME = "server_properties"
+PROPERTIES_FILE = "server.properties"
+
+
+def _parse_line(line):
+    """
+    Get the key of a property line, or None for comments and blank lines.
+    """
+    line = line.strip()
+    if not line or line[0] in "#!":
+        return None
+    key, separator, value = line.partition("=")
+    if not separator:
+        key, separator, value = line.partition(":")
+    return key.strip()
+
+
+def _read_lines(file_name):
+    try:
+        with open(file_name, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return None
+
+
+def _write_lines(file_name, lines):
+    """
+    Write the lines to a temporary file first, so the server never reads a half-written file.
+    """
+    with open(file_name + ".tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(file_name + ".tmp", file_name)
+
+
+def read_properties(file_name):
+    """
+    Read a .properties file (key=value lines, # and ! comments).
+    Returns key -> value (strings), or {} if the file doesn't exist.
+    """
+    properties = {}
+    try:
+        with open(file_name, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] in "#!":
+                    continue
+                key, separator, value = line.partition("=")
+                if not separator:
+                    key, separator, value = line.partition(":")
+                properties[key.strip()] = value.strip()
+    except FileNotFoundError:
+        pass
+    return properties
+
+
+def read_server_properties(server_directory):
+    """
+    Read the server.properties of a server directory.
+    """
+    return read_properties(os.path.join(server_directory, PROPERTIES_FILE))
+
+
+def merge_properties(file_name, template):
+    """
+    Merge the default server.properties of a server version (the text) into a file:
+    the values already in the file are kept, and the new keys are added with their comments.
+    Returns the added keys.
+    """
+    lines = _read_lines(file_name)
+    template_lines = template.splitlines()
+    if lines is None:
+        _write_lines(file_name, template_lines)
+        return [key for key in map(_parse_line, template_lines) if key is not None]
+    keys = set(map(_parse_line, lines))
+    added = []
+    comments = []
+    for line in template_lines:
+        key = _parse_line(line)
+        if key is None:
+            # The comments right above a key describe it
+            if line.strip():
+                comments.append(line)
+            else:
+                comments = []
+            continue
+        if key not in keys:
+            lines.extend(comments + [line])
+            added.append(key)
+        comments = []
+    if added:
+        _write_lines(file_name, lines)
+    return added
+
+
+def set_properties(file_name, values):
+    """
+    Set some properties of a file (key -> value), in place. Keys that aren't in the file are appended.
+    """
+    lines = _read_lines(file_name) or []
+    values = dict(values)
+    for index, line in enumerate(lines):
+        key = _parse_line(line)
+        if key in values:
+            lines[index] = "{}={}".format(key, values.pop(key))
+    lines.extend(["{}={}".format(key, value) for key, value in values.items()])
+    _write_lines(file_name, lines)
@@ -0,0 +1,318 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.servers
+ Module Revision: 0.0.1-18
+ Module Description:
+    The registry of the installed servers. (--list)
+    Every server has a record:
+        {"type", "flavour", "version", "channel", "directory", "jar" (JE), "artifact", "state"}
+    kept in memory with indexes by name, type, version and state.
+    On disk, the records are a snapshot (MCSH/config/servers.json, replaced atomically)
+    and a journal of the changes since (MCSH/config/servers.journal, one JSON line each),
+    so a change appends a line instead of rewriting every record. The journal is folded
+    into a new snapshot once it's long enough.
+    The files are locked while they're read or written, and every process (the CLI, the
+    daemon) catches up with the changes of the others before using its records.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from MCSH.logging import log
+
+MODULE_NAME = "servers"
+SERVERS_FILE = "MCSH/config/servers.json"
+SERVERS_JOURNAL_FILE = "MCSH/config/servers.journal"
+SERVERS_LOCK_FILE = "MCSH/config/servers.lock"
+SERVERS_FORMAT_VERSION = 1
+# Journal entries kept before they're folded into the snapshot
+SERVERS_COMPACT_ENTRIES = 1000
+# The fields with an index (records are found by name directly)
+INDEXED_FIELDS = ["type", "version", "state"]
+# The state of a server nothing runs (see MCSH.supervisor)
+DEFAULT_STATE = "STOPPED"
+
+
+def _stat(file_name):
+    try:
+        stat = os.stat(file_name)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+class ServerRegistry:
+    """
+    The registry of the installed servers.
+    """
+
+    def __init__(self, snapshot_file=SERVERS_FILE, journal_file=SERVERS_JOURNAL_FILE, lock_file=SERVERS_LOCK_FILE):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.lock_file = lock_file
+        self.records = {}
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        self.sequence = 0
+        self._snapshot_stat = False
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """
+        Lock the registry files (shared for reading, exclusive for writing), and catch up with them.
+        """
+        with self._lock:
+            try:
+                import fcntl
+            except ImportError:
+                # The files can't be locked here: only this process is safe
+                fcntl = None
+            with open(self.lock_file, "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """
+        Load what changed on disk since the last time: the new journal entries,
+        or everything if the snapshot was replaced.
+        """
+        snapshot_stat = _stat(self.snapshot_file)
+        journal_stat = _stat(self.journal_file)
+        if snapshot_stat != self._snapshot_stat or (journal_stat or (0, 0, 0))[2] < self._journal_offset:
+            self._load_snapshot()
+            self._snapshot_stat = snapshot_stat
+        if journal_stat is not None and journal_stat[2] > self._journal_offset:
+            self._replay_journal()
+
+    def _load_snapshot(self):
+        self.records = {}
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        self.sequence = 0
+        self._journal_offset = 0
+        self._journal_entries = 0
+        try:
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.load(f)
+                f.close()
+        except FileNotFoundError:
+            return
+        if "servers" not in snapshot or "sequence" not in snapshot:
+            # The first servers.json: only name -> record, without the states
+            snapshot = {"sequence": 0, "servers": snapshot}
+            for record in snapshot["servers"].values():
+                record.setdefault("state", DEFAULT_STATE)
+        self.sequence = snapshot["sequence"]
+        for server_name, record in snapshot["servers"].items():
+            self._apply("put", server_name, record)
+
+    def _replay_journal(self):
+        with open(self.journal_file, "rb") as f:
+            f.seek(self._journal_offset)
+            for line in f:
+                # A line without its end is a write that didn't finish: it's overwritten by the next one
+                if not line.endswith(b"\n"):
+                    break
+                self._journal_offset += len(line)
+                self._journal_entries += 1
+                entry = json.loads(line)
+                # Entries already in the snapshot (if the journal wasn't emptied after it) are skipped
+                if entry["sequence"] > self.sequence:
+                    self.sequence = entry["sequence"]
+                    self._apply(entry["operation"], entry["name"], entry.get("record"))
+
+    def _apply(self, operation, server_name, record):
+        """
+        Change a record in memory, and in the indexes.
+        """
+        old_record = self.records.pop(server_name, None)
+        if old_record is not None:
+            for field in INDEXED_FIELDS:
+                names = self.indexes[field].get(old_record.get(field))
+                names.discard(server_name)
+                if not names:
+                    del self.indexes[field][old_record.get(field)]
+        if operation == "put":
+            self.records[server_name] = record
+            for field in INDEXED_FIELDS:
+                self.indexes[field].setdefault(record.get(field), set()).add(server_name)
+
+    def _commit(self, operation, server_name, record=None):
+        """
+        Append a change to the journal (holding the exclusive lock), then apply it.
+        """
+        entry = {"sequence": self.sequence + 1, "operation": operation, "name": server_name}
+        if record is not None:
+            entry["record"] = record
+        line = (json.dumps(entry) + "\n").encode()
+        with open(self.journal_file, "ab") as f:
+            if f.tell() != self._journal_offset:
+                f.truncate(self._journal_offset)
+                f.seek(self._journal_offset)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_offset += len(line)
+        self._journal_entries += 1
+        self.sequence += 1
+        self._apply(operation, server_name, record)
+        if self._journal_entries >= SERVERS_COMPACT_ENTRIES:
+            self._compact()
+
+    def _compact(self):
+        """
+        Write all the records to a new snapshot, and empty the journal.
+        """
+        snapshot = {"version": SERVERS_FORMAT_VERSION, "sequence": self.sequence, "servers": self.records}
+        with open(self.snapshot_file + ".tmp", "w") as f:
+            f.write(json.dumps(snapshot))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.snapshot_file + ".tmp", self.snapshot_file)
+        # A crash here leaves entries that are in the snapshot too: they're skipped by their sequence
+        with open(self.journal_file, "wb") as f:
+            f.close()
+        self._snapshot_stat = _stat(self.snapshot_file)
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def compact(self):
+        with self._locked(exclusive=True):
+            self._compact()
+
+    def get(self, server_name):
+        """
+        Get the record of a server (a copy), or None.
+        """
+        with self._locked():
+            record = self.records.get(server_name)
+            return dict(record) if record is not None else None
+
+    def __contains__(self, server_name):
+        with self._locked():
+            return server_name in self.records
+
+    def __len__(self):
+        with self._locked():
+            return len(self.records)
+
+    def names(self):
+        with self._locked():
+            return sorted(self.records)
+
+    def items(self):
+        """
+        All the (server name, record) pairs, sorted by name.
+        """
+        with self._locked():
+            return [(server_name, dict(self.records[server_name])) for server_name in sorted(self.records)]
+
+    def find(self, **conditions):
+        """
+        Get the names of the servers matching all the conditions on the indexed fields,
+        e.g. find(type="JE", state="RUNNING").
+        """
+        with self._locked():
+            result = None
+            for field, value in conditions.items():
+                names = self.indexes[field].get(value, set())
+                result = set(names) if result is None else result & names
+                if not result:
+                    return []
+            return sorted(self.records if result is None else result)
+
+    def add(self, server_name, record):
+        """
+        Add a server.
+        """
+        if not server_name or server_name in (".", "..") or "/" in server_name or "\\" in server_name:
+            raise ValueError("Invalid server name: {}".format(server_name))
+        record = dict(record)
+        record.setdefault("state", DEFAULT_STATE)
+        with self._locked(exclusive=True):
+            if server_name in self.records:
+                raise ValueError("Server {} already exists.".format(server_name))
+            self._commit("put", server_name, record)
+
+    def update(self, server_name, **fields):
+        """
+        Change some fields of a server. Returns the new record.
+        """
+        with self._locked(exclusive=True):
+            if server_name not in self.records:
+                raise KeyError("There's no server named {}.".format(server_name))
+            record = dict(self.records[server_name], **fields)
+            self._commit("put", server_name, record)
+            return dict(record)
+
+    def remove(self, server_name):
+        """
+        Remove a server. Returns its record (a copy).
+        """
+        with self._locked(exclusive=True):
+            if server_name not in self.records:
+                raise KeyError("There's no server named {}.".format(server_name))
+            record = dict(self.records[server_name])
+            self._commit("delete", server_name)
+            return record
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    Get the server registry of this process.
+    """
+    global _registry
+    if _registry is None:
+        _registry = ServerRegistry()
+    return _registry
+
+
+def server_state(server_name, record):
+    """
+    Get the state of a server: from the supervisor if the daemon runs here, otherwise from its record.
+    """
+    from MCSH.daemon import running_daemon
+    if running_daemon is not None and server_name in running_daemon.supervisor_thread.supervisor.servers:
+        return running_daemon.supervisor_thread.supervisor.servers[server_name].state
+    return record.get("state", DEFAULT_STATE)
+
+
+def owner_server(path):
+    """
+    Get the (name, record) of the server whose directory contains the path (or is in it), or (None, None).
+    """
+    path = os.path.abspath(path)
+    for server_name, record in get_registry().items():
+        directory = os.path.abspath(record["directory"])
+        if os.path.commonpath([path, directory]) in (path, directory):
+            return server_name, record
+    return None, None
+
+
+def list_servers():
+    """
+    List all installed server(s). (--list)
+    """
+    servers = get_registry().items()
+    if not servers:
+        log(MODULE_NAME, "INFO", "There's no installed server.")
+        return
+    log(MODULE_NAME, "INFO", lambda: "{} server(s):\n".format(len(servers)) + "\n".join(
+        ["{} | {} | {} | {}".format(server_name, record.get("type", "?"), record.get("state", DEFAULT_STATE),
+                                    record.get("version", "?"))
+         for server_name, record in servers]))
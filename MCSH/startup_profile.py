@@ -0,0 +1,65 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.startup_profile
+ Module Revision: 0.0.1-18
+ Module Description:
+    Measures how long each startup phase (imports, initializing) takes.
+    Enabled by the '--startup-profile' argument.
+    It must not import any other MCSH module, so it can time their imports.
+"""
+import time
+from contextlib import contextmanager
+
+enabled = False
+_phases = []
+_start_time = time.perf_counter()
+
+
+def enable():
+    """
+    Enable the startup profiler.
+    """
+    global enabled
+    enabled = True
+
+
+@contextmanager
+def phase(phase_name):
+    """
+    Time a startup phase.
+    Nested phases are shown indented in the report.
+    """
+    if not enabled:
+        yield
+        return
+    record = [phase_name, len([i for i in _phases if i[2] is None]), None]
+    _phases.append(record)
+    phase_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record[2] = time.perf_counter() - phase_start
+
+
+def print_report():
+    """
+    Print the timing of all the phases.
+    """
+    if not enabled:
+        return
+    print("-- Startup Profile --")
+    for phase_name, depth, phase_time in _phases:
+        print("{indent}{name:<{width}} {time:>9.2f} ms".format(**{
+            "indent": "  " * depth,
+            "name": phase_name,
+            "width": 40 - 2 * depth,
+            "time": (phase_time or 0) * 1000
+        }))
+    print("{name:<40} {time:>9.2f} ms".format(**{
+        "name": "Total",
+        "time": (time.perf_counter() - _start_time) * 1000
+    }))
@@ -0,0 +1,325 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.supervisor
+ Module Revision: 0.0.1-18
+ Module Description:
+    Launches and monitors the server processes.
+    All the servers share one asyncio event loop (no thread per server):
+    their console output is read without blocking and sent to MCSH.logging,
+    and crashed servers are restarted with an exponential backoff.
+"""
+import asyncio
+import re
+import threading
+import time
+
+from MCSH.logging import log
+
+MODULE_NAME = "supervisor"
+# Server states
+STATE_STOPPED = "STOPPED"
+STATE_STARTING = "STARTING"
+STATE_RUNNING = "RUNNING"
+STATE_STOPPING = "STOPPING"
+STATE_CRASHED = "CRASHED"
+# Console lines that show the server has finished starting
+READY_PATTERNS = {
+    "JE": re.compile(r'Done \([0-9.,]+s\)!'),
+    "BE": re.compile(r'Server started\.')
+}
+# Restart backoff (seconds)
+RESTART_BACKOFF_MIN = 1
+RESTART_BACKOFF_MAX = 300
+# A server that ran this long is considered stable, and its backoff and restart count are reset.
+RESTART_STABLE_TIME = 600
+STOP_TIMEOUT = 60
+
+
+class ManagedServer:
+    """
+    A server process managed by the supervisor.
+    """
+
+    def __init__(self, name, server_type, command, cwd=None, env=None,
+                 stop_command="stop", auto_restart=True, max_restarts=None):
+        """
+        name: The server name.
+        server_type: JE or BE.
+        command: The command line (a list) to launch the server.
+        cwd, env: The working directory and environment of the server process.
+        stop_command: The console command that stops the server gracefully.
+        auto_restart: Restart the server when it crashes.
+        max_restarts: Give up after this many restarts in a row (None for unlimited).
+        """
+        self.name = name
+        self.server_type = server_type
+        self.command = [str(i) for i in command]
+        self.cwd = cwd
+        self.env = env
+        self.stop_command = stop_command
+        self.auto_restart = auto_restart
+        self.max_restarts = max_restarts
+        self.state = STATE_STOPPED
+        self.process = None
+        self.pid = None
+        self.start_time = None
+        self.exit_code = None
+        self.restart_count = 0
+        self.backoff = RESTART_BACKOFF_MIN
+        self.task = None
+        self.wanted_running = False
+
+    def snapshot(self):
+        """
+        The state of the server, as a dict.
+        """
+        return {
+            "name": self.name,
+            "type": self.server_type,
+            "state": self.state,
+            "pid": self.pid,
+            "uptime": time.time() - self.start_time if self.start_time and self.pid else 0,
+            "exit_code": self.exit_code,
+            "restart_count": self.restart_count
+        }
+
+
+class Supervisor:
+    """
+    Supervises many server processes on one asyncio event loop.
+    """
+
+    def __init__(self):
+        self.servers = {}
+        # Called with (server, line) for every console line
+        self.line_listeners = []
+        # Called with (server, old state, new state) for every state change
+        self.state_listeners = []
+
+    def add_server(self, server):
+        """
+        Add a server to the supervisor (it isn't started).
+        """
+        if server.name in self.servers:
+            raise ValueError("Server {} already exists.".format(server.name))
+        self.servers[server.name] = server
+        return server
+
+    def remove_server(self, name):
+        """
+        Remove a stopped server from the supervisor.
+        """
+        server = self.servers[name]
+        if server.task is not None and not server.task.done():
+            raise ValueError("Server {} is running.".format(name))
+        del self.servers[name]
+
+    def states(self):
+        """
+        The states of all the servers.
+        """
+        return {name: server.snapshot() for name, server in self.servers.items()}
+
+    def _set_state(self, server, state):
+        if server.state == state:
+            return
+        old_state = server.state
+        server.state = state
+        log(MODULE_NAME, "INFO", "Server {}: {} -> {}", server.name, old_state, state)
+        for listener in self.state_listeners:
+            try:
+                listener(server, old_state, state)
+            except Exception:
+                log(MODULE_NAME, "ERROR", "A state listener failed for server {}.", server.name)
+
+    async def start(self, name):
+        """
+        Start a server, and keep it running until it's stopped.
+        """
+        server = self.servers[name]
+        if server.task is not None and not server.task.done():
+            return
+        server.wanted_running = True
+        server.restart_count = 0
+        server.backoff = RESTART_BACKOFF_MIN
+        server.task = asyncio.ensure_future(self._run_server(server))
+
+    async def start_all(self):
+        """
+        Start all the servers concurrently.
+        """
+        await asyncio.gather(*[self.start(name) for name in self.servers])
+
+    async def stop(self, name, timeout=STOP_TIMEOUT):
+        """
+        Stop a server gracefully, killing it if it doesn't stop within the timeout.
+        """
+        server = self.servers[name]
+        server.wanted_running = False
+        if server.process is not None and server.process.returncode is None:
+            self._set_state(server, STATE_STOPPING)
+            try:
+                await self.send_command(name, server.stop_command)
+                await asyncio.wait_for(server.process.wait(), timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                log(MODULE_NAME, "WARNING", "Server {} didn't stop in time, killing it...", name)
+                try:
+                    server.process.kill()
+                except ProcessLookupError:
+                    pass
+        if server.task is not None:
+            server.task.cancel()
+            try:
+                await server.task
+            except asyncio.CancelledError:
+                pass
+            server.task = None
+        self._set_state(server, STATE_STOPPED)
+
+    async def stop_all(self, timeout=STOP_TIMEOUT):
+        """
+        Stop all the servers concurrently.
+        """
+        await asyncio.gather(*[self.stop(name, timeout) for name in self.servers])
+
+    async def send_command(self, name, command):
+        """
+        Send a command to the server console.
+        """
+        process = self.servers[name].process
+        if process is None or process.returncode is not None:
+            raise ConnectionError("Server {} isn't running.".format(name))
+        process.stdin.write((command + "\n").encode())
+        await process.stdin.drain()
+
+    async def _run_server(self, server):
+        """
+        Run the server, and restart it with backoff while it's wanted to be running.
+        """
+        while server.wanted_running:
+            await self._launch(server)
+            if not server.wanted_running:
+                break
+            self._set_state(server, STATE_CRASHED)
+            log(MODULE_NAME, "ERROR", "Server {} crashed (exit code {}).", server.name, server.exit_code)
+            if time.time() - server.start_time >= RESTART_STABLE_TIME:
+                # It ran stably: this crash isn't one in a row
+                server.backoff = RESTART_BACKOFF_MIN
+                server.restart_count = 0
+            if not server.auto_restart or \
+                    (server.max_restarts is not None and server.restart_count >= server.max_restarts):
+                server.wanted_running = False
+                break
+            log(MODULE_NAME, "INFO", "Restarting server {} in {} seconds...", server.name, server.backoff)
+            await asyncio.sleep(server.backoff)
+            server.backoff = min(server.backoff * 2, RESTART_BACKOFF_MAX)
+            server.restart_count += 1
+
+    async def _launch(self, server):
+        """
+        Launch the server process once, and wait until it exits.
+        """
+        self._set_state(server, STATE_STARTING)
+        server.start_time = time.time()
+        server.exit_code = None
+        try:
+            server.process = await asyncio.create_subprocess_exec(
+                *server.command, cwd=server.cwd, env=server.env,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            log(MODULE_NAME, "ERROR", "Failed to launch server {}: {}", server.name, e)
+            server.exit_code = None
+            return
+        server.pid = server.process.pid
+        if server.server_type not in READY_PATTERNS:
+            self._set_state(server, STATE_RUNNING)
+        try:
+            await asyncio.gather(
+                self._read_stream(server, server.process.stdout, "INFO"),
+                self._read_stream(server, server.process.stderr, "WARNING"))
+            server.exit_code = await server.process.wait()
+        finally:
+            if server.process.returncode is None:
+                try:
+                    server.process.kill()
+                except ProcessLookupError:
+                    pass
+            server.pid = None
+
+    async def _read_stream(self, server, stream, log_severity):
+        """
+        Read the console output line by line, and send it to the log and the listeners.
+        """
+        ready_pattern = READY_PATTERNS.get(server.server_type)
+        log_module = "server/" + server.name
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            line = line.decode(errors="replace").rstrip("\r\n")
+            log(log_module, log_severity, line)
+            if server.state == STATE_STARTING and ready_pattern is not None and ready_pattern.search(line):
+                self._set_state(server, STATE_RUNNING)
+            for listener in self.line_listeners:
+                try:
+                    listener(server, line)
+                except Exception:
+                    log(MODULE_NAME, "ERROR", "A line listener failed for server {}.", server.name)
+
+
+class SupervisorThread(threading.Thread):
+    """
+    Runs a supervisor's event loop in a background thread,
+    so that synchronous code (e.g. the daemon) can use it.
+    """
+
+    def __init__(self, supervisor=None):
+        super().__init__(name="MCSH-Supervisor", daemon=True)
+        self.supervisor = supervisor or Supervisor()
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """
+        Schedule a coroutine on the supervisor loop, without waiting for it.
+        """
+        self._ready.wait()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, coroutine, timeout=None):
+        """
+        Run a coroutine on the supervisor loop, and wait for its result.
+        """
+        return self.submit(coroutine).result(timeout)
+
+    def call_function(self, function, *args, timeout=None):
+        """
+        Run a function on the supervisor loop, and wait for its result.
+        The servers of the supervisor are only changed there, as the loop goes through them.
+        """
+        async def run():
+            return function(*args)
+        return self.call(run(), timeout)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop all the servers, then the event loop.
+        """
+        if not self.is_alive():
+            return
+        try:
+            self.call(self.supervisor.stop_all(), timeout + 5)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join(5)
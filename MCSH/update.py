@@ -0,0 +1,247 @@
+"""
+ ***************************************
+ MCSH - A Minecraft Server Helper.
+ Coded by AllenDa 2020.
+ Licensed under MIT.
+ ***************************************
+ Module Name: MCSH.update
+ Module Revision: 0.0.1-18
+ Module Description:
+    Updates servers, and upgrades MCSH.
+    --autoupdate plans the update of every server as jobs of MCSH.scheduler:
+    resolve and download every new version once (several at a time, shared by the
+    servers using it, through MCSH.artifact_cache), then stop, swap and start the
+    servers a few at a time, so the host isn't saturated by servers starting together.
+    BE servers are updated by unpacking the new archive over their program files (MCSH.bedrock).
+"""
+import os
+import re
+
+from MCSH.logging import log
+
+MODULE_NAME = "update"
+UPDATE_MAX_DOWNLOADS = 3
+# Servers swapped at once, and seconds between starting two swaps
+UPDATE_MAX_SWAPS = 1
+UPDATE_SWAP_STAGGER = 15
+UPDATE_FLAVOURS = ["vanilla", "paper", "bedrock"]
+# Back up every server (incrementally, see MCSH.backup) before swapping its jar
+UPDATE_BACKUP = True
+
+
+def _version_key(version):
+    return [int(part) for part in re.findall(r"[0-9]+", version)]
+
+
+def is_newer(entry, server):
+    """
+    Check whether a repository entry (as a dict) is newer than the version a server has:
+    a newer version, or a newer build of the same version.
+    """
+    if _version_key(entry["version"]) != _version_key(server["version"]):
+        return _version_key(entry["version"]) > _version_key(server["version"])
+    # Servers installed before the builds were tracked have no build
+    return entry.get("build") is not None and server.get("build") is not None and entry["build"] > server["build"]
+
+
+def latest_entry(repository, server):
+    """
+    Get the newest repository entry of the server's flavour and channel (as a dict), or None.
+    """
+    entries = [entry for entry in repository.search(server["flavour"])
+               if entry["flavour"] == server["flavour"] and entry["channel"] == server.get("channel", "release")]
+    if not entries:
+        return None
+    return max(entries, key=lambda entry: (entry["time"], _version_key(entry["version"])))
+
+
+def download_progress(name):
+    """
+    Get a download progress callback that logs every 10%.
+    """
+    reported = [0]
+
+    def progress(downloaded, total):
+        if total and downloaded * 10 // total > reported[0]:
+            reported[0] = downloaded * 10 // total
+            log(MODULE_NAME, "INFO", "Downloading {}: {}%", name, reported[0] * 10)
+
+    return progress
+
+
+def artifact_name(entry):
+    """
+    The file name of the download of a repository entry (as a dict).
+    """
+    return entry["name"] + (".zip" if entry["type"] == "BE" else ".jar")
+
+
+def _supervised(server_name):
+    """
+    Get the supervisor thread of the daemon if it manages the server, or None.
+    """
+    from MCSH.daemon import running_daemon
+    if running_daemon is None or server_name not in running_daemon.supervisor_thread.supervisor.servers:
+        return None
+    return running_daemon.supervisor_thread
+
+
+def _answers_rcon(server_name):
+    """
+    Check whether a server answers RCON, i.e. it's running (launched by something else than MCSH).
+    """
+    from MCSH.rcon import RconError, run_commands
+    try:
+        run_commands(server_name, ["list"])
+        return True
+    except (RconError, OSError):
+        return False
+
+
+class UpdatePlanner:
+    """
+    Plans and runs the updates of the installed servers.
+    """
+
+    def __init__(self, registry, repository, cache, downloader):
+        from MCSH.scheduler import JobScheduler
+        self.registry = registry
+        self.repository = repository
+        self.cache = cache
+        self.downloader = downloader
+        self.scheduler = JobScheduler({
+            "network": (UPDATE_MAX_DOWNLOADS, 0),
+            "host": (UPDATE_MAX_SWAPS, UPDATE_SWAP_STAGGER)
+        })
+
+    def plan(self):
+        """
+        Add the jobs for every server with a newer version.
+        Returns the number of servers to update.
+        """
+        count = 0
+        for server_name, server in self.registry.items():
+            if server.get("flavour") not in UPDATE_FLAVOURS:
+                log(MODULE_NAME, "INFO", "Server {} ({}) can't be updated automatically, skipped.",
+                    server_name, server.get("flavour"))
+                continue
+            entry = latest_entry(self.repository, server)
+            if entry is None or not is_newer(entry, server):
+                log(MODULE_NAME, "DEBUG", "Server {} is up to date.", server_name)
+                continue
+            self.plan_server(server_name, entry)
+            count += 1
+        return count
+
+    def plan_server(self, server_name, entry):
+        """
+        Add the jobs that put the version of a repository entry (as a dict) on a server.
+        """
+        server = self.registry.get(server_name)
+        resolve_job = self.scheduler.add("resolve:" + entry["name"], self._resolve_job(entry),
+                                         pool="network", description="Resolve " + entry["name"])
+        download_job = self.scheduler.add("download:" + entry["name"], self._download_job(entry),
+                                          [resolve_job.name], "network", "Download " + entry["name"])
+        return self.scheduler.add("swap:" + server_name, self._swap_job(server_name, entry), [download_job.name],
+                                  "host", "Update {}: {} -> {}".format(server_name, server["version"],
+                                                                       entry["version"]))
+
+    def _resolve_job(self, entry):
+        def resolve(results):
+            from MCSH.repository import resolve_download
+            return resolve_download(entry)
+        return resolve
+
+    def _download_job(self, entry):
+        def download(results):
+            url, sha1, sha256 = results["resolve:" + entry["name"]]
+            return self.cache.fetch(url, sha256, sha1, self.downloader, artifact_name(entry),
+                                    download_progress(entry["name"]))
+        return download
+
+    def _swap_job(self, server_name, entry):
+        def swap(results):
+            from MCSH.servers import DEFAULT_STATE
+            digest = results["download:" + entry["name"]]
+            server = self.registry.get(server_name)
+            supervisor_thread = _supervised(server_name)
+            was_running = False
+            if supervisor_thread is None:
+                # Nothing can stop it: a running server would have its program swapped under it
+                if server.get("state", DEFAULT_STATE) != DEFAULT_STATE or _answers_rcon(server_name):
+                    raise RuntimeError("Server {} is running outside the daemon. Stop it first.".format(server_name))
+            else:
+                from MCSH.supervisor import STATE_RUNNING, STATE_STARTING
+                was_running = supervisor_thread.supervisor.servers[server_name].state in (STATE_RUNNING,
+                                                                                            STATE_STARTING)
+                if was_running:
+                    log(MODULE_NAME, "INFO", "Stopping server {}...", server_name)
+                    supervisor_thread.call(supervisor_thread.supervisor.stop(server_name))
+            try:
+                if UPDATE_BACKUP:
+                    from MCSH.backup import BackupStore
+                    BackupStore().backup(server_name, server["directory"])
+                if server.get("type") == "BE":
+                    # Worlds and settings are kept; the backup above is the way back
+                    from MCSH.bedrock import unpack_bedrock
+                    unpack_bedrock(self.cache, digest, server["directory"])
+                else:
+                    jar_file = os.path.join(server["directory"], server["jar"])
+                    if os.path.exists(jar_file):
+                        # Keep the previous version for rolling back
+                        self.cache.release(jar_file, remove_file=False)
+                        os.replace(jar_file, jar_file + ".old")
+                    self.cache.link(digest, jar_file)
+                self.registry.update(server_name, version=entry["version"], build=entry.get("build"),
+                                     artifact=digest)
+            finally:
+                # A failed swap leaves the server as it was before (or half-updated, with its backup)
+                if was_running:
+                    log(MODULE_NAME, "INFO", "Starting server {}...", server_name)
+                    supervisor_thread.call(supervisor_thread.supervisor.start(server_name))
+            return entry["version"]
+        return swap
+
+    def run(self, dry_run=False):
+        return self.scheduler.run(dry_run)
+
+
+def autoupdate_servers():
+    """
+    Update all server(s) in the list. (--autoupdate)
+    """
+    from MCSH.artifact_cache import ArtifactCache
+    from MCSH.consts import config_instance
+    from MCSH.download import Downloader
+    from MCSH.repository import get_repository
+    from MCSH.servers import get_registry
+    dry_run = config_instance.parser_args.dry_run
+    registry = get_registry()
+    if not len(registry):
+        log(MODULE_NAME, "INFO", "There's no server to update.")
+        return
+    downloader = Downloader()
+    try:
+        planner = UpdatePlanner(registry, get_repository(), ArtifactCache(), downloader)
+        count = planner.plan()
+        if not count:
+            log(MODULE_NAME, "INFO", "All the servers are up to date.")
+            return
+        if dry_run:
+            log(MODULE_NAME, "INFO", "{} server(s) would be updated (dry run).", count)
+            planner.run(dry_run=True)
+            return
+        log(MODULE_NAME, "INFO", "Updating {} server(s)...", count)
+        if planner.run():
+            log(MODULE_NAME, "INFO", "All the updates are done.")
+        else:
+            log(MODULE_NAME, "ERROR", "Some updates failed, see the log above.")
+    finally:
+        downloader.close()
+
+
+def upgrade_servers():
+    """
+    Upgrade all server(s) to current version, including MCSH. (--upgrade)
+    """
+    log(MODULE_NAME, "ERROR", "--upgrade isn't available yet.")
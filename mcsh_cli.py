@@ -7,6 +7,23 @@
  Module Description:
     The entrance for the CLI interface.
 """
-import MCSH.init
+import sys
+
+import MCSH.startup_profile
+
 if __name__ == "__main__":
+    if sys.argv[1:] == ["--version"]:
+        # Nothing needs to be initialized for showing the version.
+        from MCSH.consts import MCSH_version
+        print(MCSH_version)
+        sys.exit(0)
+    # Forward the command to the daemon, if there's one running
+    from MCSH.daemon_client import forward_to_daemon
+    exit_code = forward_to_daemon(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+    if "--startup-profile" in sys.argv[1:]:
+        MCSH.startup_profile.enable()
+    with MCSH.startup_profile.phase("Import MCSH"):
+        import MCSH.init
     MCSH.init.init()
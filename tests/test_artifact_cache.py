@@ -0,0 +1,73 @@
+import os
+import time
+
+from MCSH import artifact_cache
+from MCSH.artifact_cache import ArtifactCache
+
+
+def _add(cache, tmp_path, name, size, age):
+    source = tmp_path / name
+    source.write_bytes(os.urandom(size))
+    digest = cache.add_file(str(source), name=name)
+    # Last used 'age' seconds ago (beyond the grace period, unless it's small)
+    cache.index[digest]["last_used"] = time.time() - age
+    cache._save_index()
+    return digest
+
+
+def test_eviction_is_least_recently_used_first(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"), max_bytes=0)
+    old = _add(cache, tmp_path, "old.jar", 1000, 3 * 86400)
+    older = _add(cache, tmp_path, "older.jar", 1000, 4 * 86400)
+    recent = _add(cache, tmp_path, "recent.jar", 1000, 2 * 86400)
+    new = _add(cache, tmp_path, "new.jar", 1000, 60)
+    cache.max_bytes = 2500
+    cache.evict()
+    assert sorted(cache.index) == sorted([recent, new])
+    assert not os.path.exists(cache.object_path(older)) and not os.path.exists(cache.object_path(old))
+    # What was used within the grace period stays, even over the budget
+    cache.max_bytes = 100
+    cache.evict()
+    assert list(cache.index) == [new]
+
+
+def test_referenced_artifacts_are_not_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"), max_bytes=0)
+    placed = _add(cache, tmp_path, "placed.jar", 1000, 5 * 86400)
+    _add(cache, tmp_path, "unused.jar", 1000, 86400)
+    target = str(tmp_path / "server" / "server.jar")
+    assert cache.link(placed, target) in ("hardlink", "reflink", "copy")
+    cache.index[placed]["last_used"] = time.time() - 5 * 86400
+    cache.max_bytes = 500
+    cache.evict()
+    assert list(cache.index) == [placed]
+    assert os.path.exists(target) and os.path.exists(cache.object_path(placed))
+    # Released (e.g. the server was removed): it can go
+    cache.release(target)
+    cache.index[placed]["last_used"] = time.time() - 5 * 86400
+    cache.evict()
+    assert cache.index == {}
+
+
+def test_garbage_collect_drops_missing_references(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    digest = _add(cache, tmp_path, "server.jar", 1000, 86400)
+    target = tmp_path / "server" / "server.jar"
+    cache.link(digest, str(target))
+    cache.index[digest]["last_used"] = time.time() - 86400
+    assert cache.garbage_collect() == 0
+    target.unlink()
+    assert cache.garbage_collect() == 1000
+    assert not cache.contains(digest)
+
+
+def test_index_is_shared_between_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_cache, "ARTIFACT_GRACE_PERIOD", 0)
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    other = ArtifactCache(str(tmp_path / "cache"))
+    digest = _add(cache, tmp_path, "server.jar", 1000, 0)
+    # The other instance catches up under the lock
+    with other.batch():
+        assert other.contains(digest)
+    other.link(digest, str(tmp_path / "server" / "server.jar"))
+    assert cache.references(str(tmp_path / "server")) == {str(tmp_path / "server" / "server.jar"): digest}
@@ -0,0 +1,107 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from MCSH import backup, rcon
+from MCSH.region import HEADER_SIZE, SECTOR_SIZE
+
+
+def test_backup_survives_a_failed_save_on(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server_directory = tmp_path / "server"
+    server_directory.mkdir()
+    (server_directory / "server.properties").write_text("level-name=world\n")
+    monkeypatch.setattr(backup, "_get_server", lambda server_name: {"directory": str(server_directory)})
+    commands = []
+
+    def run_commands(server_name, batch):
+        commands.extend(batch)
+        if batch == ["save-on"]:
+            raise ConnectionError("The RCON connection is closed.")
+        return [""] * len(batch)
+
+    monkeypatch.setattr(rcon, "run_commands", run_commands)
+    backup.backup_server("Test")
+    assert commands == ["save-off", "save-all flush", "save-on"]
+    assert len(backup.BackupStore().list_snapshots("Test")) == 1
+
+
+def _region(chunks):
+    """
+    A region file with the given chunks (bytes), one sector each, in the given order.
+    """
+    locations = bytearray(SECTOR_SIZE)
+    body = b""
+    for sector, (index, data) in enumerate(chunks, HEADER_SIZE // SECTOR_SIZE):
+        locations[index * 4:index * 4 + 4] = ((sector << 8) | 1).to_bytes(4, "big")
+        body += data.ljust(SECTOR_SIZE, b"\x00")
+    return bytes(locations) + bytes(SECTOR_SIZE) + body
+
+
+def _files(directory):
+    return {os.path.relpath(os.path.join(root, file), directory): open(os.path.join(root, file), "rb").read()
+            for root, directories, files in os.walk(directory) for file in files}
+
+
+def test_moved_region_chunks_are_stored_once(tmp_path):
+    store = backup.BackupStore(str(tmp_path / "backups"))
+    region = tmp_path / "server" / "world" / "region" / "r.0.0.mca"
+    region.parent.mkdir(parents=True)
+    chunks = [(index, os.urandom(3000)) for index in range(4)]
+    region.write_bytes(_region(chunks))
+    first = store.load_snapshot("Test", store.backup("Test", str(tmp_path / "server"), workers=2))
+    # The game rewrote the region: the same chunks, in another order
+    region.write_bytes(_region(chunks[::-1]))
+    os.utime(str(region), ns=(1, 1))
+    second = store.load_snapshot("Test", store.backup("Test", str(tmp_path / "server"), workers=2))
+    first_chunks = first["files"]["world/region/r.0.0.mca"]["chunks"]
+    second_chunks = second["files"]["world/region/r.0.0.mca"]["chunks"]
+    # Only the header changed
+    assert first_chunks[0] != second_chunks[0]
+    assert second_chunks[1:] == first_chunks[1:][::-1]
+
+
+def test_unchanged_files_are_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "process_pool", lambda workers=None: ThreadPoolExecutor(max_workers=2))
+    store = backup.BackupStore(str(tmp_path / "backups"))
+    server_directory = tmp_path / "server"
+    server_directory.mkdir()
+    (server_directory / "same.txt").write_bytes(os.urandom(backup.BACKUP_CHUNK_SIZE + 10))
+    (server_directory / "changed.txt").write_text("old")
+    first = store.load_snapshot("Test", store.backup("Test", str(server_directory)))
+    (server_directory / "changed.txt").write_text("new")
+    os.utime(str(server_directory / "changed.txt"), ns=(1, 1))
+    read = []
+    backup_file = backup._backup_file
+    monkeypatch.setattr(backup, "_backup_file", lambda chunks_path, file_name: (
+        read.append(os.path.basename(file_name)), backup_file(chunks_path, file_name))[1])
+    second = store.load_snapshot("Test", store.backup("Test", str(server_directory)))
+    assert read == ["changed.txt"]
+    assert second["files"]["same.txt"] == first["files"]["same.txt"]
+    assert len(second["files"]["same.txt"]["chunks"]) == 2
+
+
+def test_restore_is_exact(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "process_pool", lambda workers=None: ThreadPoolExecutor(max_workers=2))
+    store = backup.BackupStore(str(tmp_path / "backups"))
+    server_directory = tmp_path / "server"
+    (server_directory / "world" / "region").mkdir(parents=True)
+    (server_directory / "world" / "region" / "r.0.0.mca").write_bytes(_region([(7, b"chunk")]) + b"trailing")
+    (server_directory / "server.properties").write_text("level-name=world\n")
+    (server_directory / "start.sh").write_text("#!/bin/sh\n")
+    os.chmod(str(server_directory / "start.sh"), 0o755)
+    (server_directory / "session.lock").write_text("")
+    before = _files(str(server_directory))
+    snapshot_id = store.backup("Test", str(server_directory))
+    (server_directory / "server.properties").write_text("level-name=other\n")
+    (server_directory / "start.sh").unlink()
+    (server_directory / "world" / "extra.dat").write_text("extra")
+    (server_directory / "world" / "region" / "r.0.0.mca").write_bytes(b"corrupted")
+    store.restore("Test", snapshot_id, str(server_directory))
+    assert _files(str(server_directory)) == before
+    assert os.stat(str(server_directory / "start.sh")).st_mode & 0o777 == 0o755
+    # Restoring only a path leaves the rest alone
+    (server_directory / "world" / "extra.dat").write_text("extra")
+    (server_directory / "server.properties").write_text("level-name=other\n")
+    store.restore("Test", snapshot_id, str(server_directory), paths=["world"])
+    assert not (server_directory / "world" / "extra.dat").exists()
+    assert (server_directory / "server.properties").read_text() == "level-name=other\n"
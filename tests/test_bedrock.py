@@ -0,0 +1,108 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+from MCSH import bedrock, servers
+from MCSH.artifact_cache import ArtifactCache
+from MCSH.server_properties import read_server_properties, set_properties
+from MCSH.servers import ServerRegistry
+
+PROPERTIES_V1 = """server-name=Dedicated Server
+# Allowed values: "survival", "creative", or "adventure"
+gamemode=survival
+server-port=19132
+server-portv6=19133
+"""
+PROPERTIES_V2 = PROPERTIES_V1 + """# The maximum allowed view distance in number of chunks.
+view-distance=32
+"""
+
+
+def _archive(tmp_path, name, files):
+    archive_name = str(tmp_path / name)
+    with zipfile.ZipFile(archive_name, "w") as archive:
+        for member_name, data in files.items():
+            info = zipfile.ZipInfo(member_name)
+            if member_name == bedrock.BEDROCK_BINARY:
+                info.external_attr = 0o755 << 16
+            archive.writestr(info, data)
+    return archive_name
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    config = tmp_path / "config"
+    config.mkdir()
+    registry = ServerRegistry(str(config / "servers.json"), str(config / "servers.journal"),
+                              str(config / "servers.lock"))
+    monkeypatch.setattr(servers, "_registry", registry)
+    return registry
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ArtifactCache(str(tmp_path / "cache"))
+
+
+def _version_1(tmp_path, cache):
+    return cache.add_file(_archive(tmp_path, "bedrock-server-1.16.200.zip", {
+        bedrock.BEDROCK_BINARY: b"binary 1", "libCrypto.so": b"library", "behavior_packs/old/manifest.json": b"{}",
+        "server.properties": PROPERTIES_V1, "allowlist.json": "[]", "permissions.json": "[]",
+        "config/default/permissions.json": '{"allowed": []}'}))
+
+
+def _version_2(tmp_path, cache):
+    return cache.add_file(_archive(tmp_path, "bedrock-server-1.16.201.zip", {
+        bedrock.BEDROCK_BINARY: b"binary 2", "libCrypto.so": b"library", "behavior_packs/new/manifest.json": b"{}",
+        "server.properties": PROPERTIES_V2, "allowlist.json": "[]", "permissions.json": "[]",
+        "config/default/permissions.json": '{"allowed": ["new"]}'}))
+
+
+def test_update_keeps_the_settings(tmp_path, registry, cache):
+    directory = tmp_path / "servers" / "Test"
+    bedrock.install_bedrock(registry, "Test", str(directory), _version_1(tmp_path, cache), cache)
+    registry.add("Test", {"type": "BE", "directory": str(directory)})
+    assert read_server_properties(str(directory))["server-name"] == "Test"
+    # The owner edits the settings
+    set_properties(str(directory / "server.properties"), {"gamemode": "creative"})
+    (directory / "allowlist.json").write_text(json.dumps([{"name": "Steve"}]))
+    (directory / "config" / "default" / "permissions.json").write_text('{"allowed": ["mine"]}')
+    counts = bedrock.unpack_bedrock(cache, _version_2(tmp_path, cache), str(directory))
+    assert counts == {"linked": 2, "unchanged": 1, "removed": 1}
+    properties = read_server_properties(str(directory))
+    assert (properties["server-name"], properties["gamemode"], properties["view-distance"]) == \
+        ("Test", "creative", "32")
+    # The new key comes with its comment, after the lines that were there
+    lines = (directory / "server.properties").read_text().splitlines()
+    assert lines[-2:] == ["# The maximum allowed view distance in number of chunks.", "view-distance=32"]
+    assert lines.count("gamemode=creative") == 1
+    assert json.loads((directory / "allowlist.json").read_text()) == [{"name": "Steve"}]
+    assert (directory / "config" / "default" / "permissions.json").read_text() == '{"allowed": ["mine"]}'
+    # Program files: the new ones are placed, the ones the new version doesn't have are gone
+    assert (directory / bedrock.BEDROCK_BINARY).read_bytes() == b"binary 2"
+    assert os.access(str(directory / bedrock.BEDROCK_BINARY), os.X_OK)
+    assert (directory / "behavior_packs" / "new" / "manifest.json").exists()
+    assert not (directory / "behavior_packs" / "old" / "manifest.json").exists()
+
+
+def test_servers_share_program_files(tmp_path, registry, cache):
+    archive_digest = _version_1(tmp_path, cache)
+    for server_name in ["First", "Second"]:
+        directory = tmp_path / "servers" / server_name
+        bedrock.install_bedrock(registry, server_name, str(directory), archive_digest, cache)
+        registry.add(server_name, {"type": "BE", "directory": str(directory)})
+    first, second = tmp_path / "servers" / "First", tmp_path / "servers" / "Second"
+    assert os.path.samefile(str(first / "libCrypto.so"), str(second / "libCrypto.so"))
+    # Settings are the servers' own, with their own ports
+    assert not os.path.samefile(str(first / "server.properties"), str(second / "server.properties"))
+    assert read_server_properties(str(first))["server-port"] == "19132"
+    assert read_server_properties(str(second))["server-port"] == "19134"
+
+
+def test_unsafe_member_paths():
+    for name in ["../escape", "/etc/passwd", "C:/Windows/x", "a/../../b"]:
+        with pytest.raises(ValueError):
+            bedrock._member_name(name)
+    assert bedrock._member_name("./behavior_packs//vanilla/manifest.json") == "behavior_packs/vanilla/manifest.json"
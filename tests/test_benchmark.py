@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from MCSH import benchmark
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repo_directory(monkeypatch):
+    # perf_recommend/ is read relative to the working directory, like mcsh_cli.py runs
+    monkeypatch.chdir(REPO_PATH)
+
+
+def _results(cpu_single=None, cpu_multi=None, disk_write=None):
+    return {"version": benchmark.BENCHMARK_FORMAT_VERSION, "cpu_single": cpu_single, "cpu_multi": cpu_multi,
+            "disk_write": disk_write}
+
+
+def test_match_tier():
+    assert benchmark.match_tier(_results(3.6, 16, 500), 32) == "optimal"
+    assert benchmark.match_tier(_results(3.2, 16, 500), 32) == "recommended"
+    assert benchmark.match_tier(_results(2.6, 4, 60), 32) == "minimum"
+    assert benchmark.match_tier(_results(2.0, 16, 500), 32) is None
+    # Not enough RAM, or a slow disk
+    assert benchmark.match_tier(_results(3.6, 16, 500), 6) == "minimum"
+    assert benchmark.match_tier(_results(3.6, 16, 100), 32) == "minimum"
+    assert benchmark.match_tier(_results(3.6, 16, 500), 10, "BE") == "minimum"
+
+
+def test_match_tier_skips_unmeasured_numbers():
+    assert benchmark.match_tier(_results(), 32) == "optimal"
+    assert benchmark.match_tier(_results(disk_write=100), 32) == "minimum"
+
+
+def test_effective_ghz():
+    reference = benchmark.CPU_CALIBRATION["CPython 3.11"]
+    assert benchmark.effective_ghz(reference * 2.1, "CPython 3.11") == 2.1
+    assert benchmark.effective_ghz(reference, "PyPy 3.9") is None
+    assert benchmark.effective_ghz(None, "CPython 3.11") is None
+
+
+def test_results(tmp_path, monkeypatch):
+    for test in benchmark.BENCHMARK_TIME_BUDGET:
+        monkeypatch.setitem(benchmark.BENCHMARK_TIME_BUDGET, test, 0.05)
+    monkeypatch.setattr(benchmark, "DISK_FILE_SIZE", 4 * benchmark.DISK_BLOCK_SIZE)
+    monkeypatch.setattr(benchmark, "MEMORY_BLOCK_SIZE", 1024 * 1024)
+    monkeypatch.setattr(benchmark, "BENCHMARK_RESULT_FILE", str(tmp_path / "config" / "benchmark.json"))
+    results = benchmark.run_benchmark(str(tmp_path))
+    assert results["version"] == benchmark.BENCHMARK_FORMAT_VERSION
+    assert results["python"] == benchmark.python_name()
+    assert results["cpu_single_score"] > 0 and results["cpu_multi_score"] >= results["cpu_single_score"] * 0.5
+    if results["python"] in benchmark.CPU_CALIBRATION:
+        assert results["cpu_single"] == benchmark.effective_ghz(results["cpu_single_score"])
+    for key in ["memory_bandwidth", "disk_write", "disk_read", "disk_random_read_iops", "disk_random_write_iops"]:
+        assert results[key] > 0
+    assert not os.path.exists(str(tmp_path / ".mcsh_benchmark.tmp"))
+    assert benchmark.load_benchmark() == results
+
+
+def test_outdated_results_are_ignored(tmp_path, monkeypatch):
+    result_file = tmp_path / "benchmark.json"
+    result_file.write_text('{"cpu_single": 0.59, "cpu_multi": 0.6, "disk_write": 500}')
+    monkeypatch.setattr(benchmark, "BENCHMARK_RESULT_FILE", str(result_file))
+    assert benchmark.load_benchmark() is None
@@ -0,0 +1,58 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from MCSH.console_events import EventIndex
+
+
+@pytest.fixture
+def event_index(tmp_path):
+    index = EventIndex(database=str(tmp_path / "events.db"))
+    index.start()
+    yield index
+    index.stop()
+
+
+def _timestamp(text):
+    return time.mktime(time.strptime(text, "%Y-%m-%d %H:%M:%S"))
+
+
+def test_query_returns_the_latest_events(event_index):
+    for i in range(10):
+        event_index.feed("Test", "JE", "[12:00:00] [Server thread/INFO]: Player{} joined the game".format(i),
+                         1000 + i)
+    events = event_index.query("Test", limit=3)
+    assert [event["player"] for event in events] == ["Player7", "Player8", "Player9"]
+
+
+def test_ingest_file_across_midnight(event_index, tmp_path):
+    log_file = tmp_path / "latest.log"
+    log_file.write_text("[23:58:00] [Server thread/INFO]: Alice joined the game\n"
+                        "[00:02:00] [Server thread/INFO]: Bob joined the game\n")
+    mtime = _timestamp("2020-12-02 00:05:00")
+    os.utime(str(log_file), (mtime, mtime))
+    assert event_index.ingest_file("Test", "JE", str(log_file)) == 2
+    events = event_index.query("Test")
+    assert [(event["player"], event["time"]) for event in events] == [
+        ("Alice", _timestamp("2020-12-01 23:58:00")), ("Bob", _timestamp("2020-12-02 00:02:00"))]
+
+
+def test_live_log_isnt_ingested_again(event_index, tmp_path):
+    server = SimpleNamespace(name="Test", server_type="JE", cwd=str(tmp_path))
+    lines = ["[12:00:00] [Server thread/INFO]: Alice joined the game",
+             "[12:01:00] [Server thread/INFO]: Alice left the game"]
+    os.mkdir(str(tmp_path / "logs"))
+    with open(str(tmp_path / "logs" / "latest.log"), "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+            event_index.line_listener(server, line)
+    event_index.state_listener(server, "STOPPING", "STOPPED")
+    event_index.flush()
+    # --events without the daemon: only lines written after the server stopped are new
+    assert event_index.ingest_file("Test", "JE", str(tmp_path / "logs" / "latest.log")) == 0
+    with open(str(tmp_path / "logs" / "latest.log"), "a") as f:
+        f.write("[12:05:00] [Server thread/INFO]: Bob joined the game\n")
+    assert event_index.ingest_file("Test", "JE", str(tmp_path / "logs" / "latest.log")) == 1
+    assert [event["player"] for event in event_index.query("Test")] == ["Alice", "Alice", "Bob"]
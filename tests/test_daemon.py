@@ -0,0 +1,54 @@
+import argparse
+import sys
+import threading
+from types import SimpleNamespace
+
+from MCSH import daemon, servers
+from MCSH.logging import log
+from MCSH.scheduler import JobScheduler
+from MCSH.servers import ServerRegistry
+
+
+def test_command_output_of_worker_threads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "MCSH" / "config").mkdir(parents=True)
+    monkeypatch.setattr(sys, "stdout", daemon._OutputRouter(sys.stdout))
+
+    def parser_parse(argv):
+        # A command whose jobs log from the scheduler's worker threads
+        scheduler = JobScheduler({"default": (2, 0)})
+        for name in argv:
+            scheduler.add(name, lambda results, name=name: log("test", "INFO", "Job {} done.", name))
+        scheduler.run()
+
+    command_daemon = daemon.Daemon(argparse.Namespace(parser_parse=parser_parse))
+    try:
+        output = command_daemon.execute(["first", "second"])["output"]
+        assert "Job first done." in output and "Job second done." in output
+        # Threads the command didn't start keep logging to the daemon's output
+        other = threading.Thread(target=log, args=("test", "INFO", "Not the command's."))
+        other.start()
+        other.join()
+        assert "Not the command's." not in command_daemon.execute([])["output"]
+    finally:
+        command_daemon.event_index.stop()
+
+
+def test_states_are_recorded_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "MCSH" / "config").mkdir(parents=True)
+    registry = ServerRegistry(str(tmp_path / "servers.json"), str(tmp_path / "servers.journal"),
+                              str(tmp_path / "servers.lock"))
+    monkeypatch.setattr(servers, "_registry", registry)
+    registry.add("Test", {"type": "JE", "directory": str(tmp_path)})
+    command_daemon = daemon.Daemon(argparse.Namespace())
+    writers = []
+    monkeypatch.setattr(registry, "update", lambda server_name, **fields: writers.append(
+        (threading.current_thread().name, fields["state"])))
+    server = SimpleNamespace(name="Test")
+    for old_state, new_state in [("STOPPED", "STARTING"), ("STARTING", "RUNNING"), ("RUNNING", "STOPPING")]:
+        command_daemon._record_state(server, old_state, new_state)
+    command_daemon._state_writer.shutdown()
+    # In order, by the state writer
+    assert [state for thread_name, state in writers] == ["STARTING", "RUNNING", "STOPPING"]
+    assert all([thread_name.startswith("MCSH-StateWriter") for thread_name, state in writers])
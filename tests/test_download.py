@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from MCSH import download, repository
+from MCSH.artifact_cache import ArtifactCache
+from MCSH.download import DownloadError, Downloader
+
+CHUNK_SIZE = 64 * 1024
+CONTENT = os.urandom(5 * CHUNK_SIZE + 1234)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range")))
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/file")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content_range = self.headers.get("Range")
+        if content_range and server.ranges:
+            start, end = [int(value) for value in content_range.split("=")[1].split("-")]
+            if start in server.failing:
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            data = CONTENT[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(CONTENT)))
+        else:
+            data = CONTENT
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", '"content"')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.requests = []
+    server.ranges = True
+    server.failing = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_retries(monkeypatch):
+    monkeypatch.setattr(download, "DOWNLOAD_RETRIES", 1)
+
+
+def _chunk_requests(server):
+    return [int(content_range.split("=")[1].split("-")[0]) for path, content_range in server.requests
+            if content_range and content_range != "bytes=0-0"]
+
+
+def test_chunked_download(http_server, tmp_path):
+    downloader = Downloader(chunk_size=CHUNK_SIZE)
+    target = str(tmp_path / "server.jar")
+    digests = downloader.download(http_server.url + "/moved", target, sha256=hashlib.sha256(CONTENT).hexdigest())
+    downloader.close()
+    assert open(target, "rb").read() == CONTENT
+    assert digests["sha1"] == hashlib.sha1(CONTENT).hexdigest()
+    assert sorted(_chunk_requests(http_server)) == list(range(0, len(CONTENT), CHUNK_SIZE))
+    assert not os.path.exists(target + ".part") and not os.path.exists(target + ".part.json")
+
+
+def test_chunked_download_resumes(http_server, tmp_path):
+    target = str(tmp_path / "server.jar")
+    http_server.failing = {3 * CHUNK_SIZE}
+    downloader = Downloader(max_connections=1, chunk_size=CHUNK_SIZE)
+    with pytest.raises(DownloadError, match="resumed"):
+        downloader.download(http_server.url + "/file", target)
+    downloader.close()
+    assert os.path.exists(target + ".part.json")
+    http_server.failing = set()
+    http_server.requests = []
+    downloader = Downloader(chunk_size=CHUNK_SIZE)
+    digests = downloader.download(http_server.url + "/file", target, sha256=hashlib.sha256(CONTENT).hexdigest())
+    downloader.close()
+    assert open(target, "rb").read() == CONTENT
+    assert digests["sha256"] == hashlib.sha256(CONTENT).hexdigest()
+    # Only the chunks that weren't done are fetched again
+    assert sorted(_chunk_requests(http_server)) == [3 * CHUNK_SIZE, 4 * CHUNK_SIZE, 5 * CHUNK_SIZE]
+
+
+def test_stream_download(http_server, tmp_path):
+    http_server.ranges = False
+    downloader = Downloader(chunk_size=CHUNK_SIZE)
+    target = str(tmp_path / "server.jar")
+    digests = downloader.download(http_server.url + "/file", target, sha1=hashlib.sha1(CONTENT).hexdigest())
+    downloader.close()
+    assert open(target, "rb").read() == CONTENT
+    assert digests["sha256"] == hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.mark.parametrize("ranges", [True, False])
+def test_hash_mismatch(http_server, tmp_path, ranges):
+    http_server.ranges = ranges
+    downloader = Downloader(chunk_size=CHUNK_SIZE)
+    target = str(tmp_path / "server.jar")
+    with pytest.raises(DownloadError, match="SHA256 mismatch"):
+        downloader.download(http_server.url + "/file", target, sha256="0" * 64)
+    downloader.close()
+    assert not os.path.exists(target)
+
+
+class _Repository:
+    def __init__(self, url):
+        self.url = url
+
+    def get(self, name):
+        if name != "paper-1.16.4":
+            return None
+        return {"name": name, "type": "JE", "flavour": "direct", "version": "1.16.4", "channel": "release",
+                "time": "2020-12-01", "url": self.url}
+
+
+def test_download_server(http_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(repository, "get_repository", lambda: _Repository(http_server.url + "/file"))
+    download.download_server("paper-1.16.4")
+    assert open("paper-1.16.4.jar", "rb").read() == CONTENT
+    cache = ArtifactCache()
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    assert cache.contains(digest)
+    assert cache.index[digest]["refs"] == [os.path.abspath("paper-1.16.4.jar")]
+    # The next download comes from the cache
+    http_server.requests = []
+    os.remove("paper-1.16.4.jar")
+    download.download_server("paper-1.16.4")
+    assert os.path.exists("paper-1.16.4.jar") and not http_server.requests
+
+
+def test_progress_runs_in_the_callers_context(http_server, tmp_path):
+    # The daemon routes the output of a command by a context variable (see MCSH.daemon._OutputRouter)
+    from MCSH.daemon import _command_output
+    token = _command_output.set("command")
+    contexts = []
+    try:
+        downloader = Downloader(chunk_size=CHUNK_SIZE)
+        downloader.download(http_server.url + "/file", str(tmp_path / "server.jar"),
+                            progress=lambda downloaded, total: contexts.append(_command_output.get()))
+        downloader.close()
+    finally:
+        _command_output.reset(token)
+    assert contexts and set(contexts) == {"command"}
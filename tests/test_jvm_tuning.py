@@ -0,0 +1,110 @@
+import argparse
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from MCSH import consts, jvm_tuning, servers
+from MCSH.servers import ServerRegistry
+from MCSH.supervisor import SupervisorThread
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repo_directory(monkeypatch, tmp_path):
+    # perf_recommend/ is read relative to the working directory, like mcsh_cli.py runs
+    monkeypatch.chdir(REPO_PATH)
+    monkeypatch.setattr(jvm_tuning, "LAUNCH_PROFILES_FILE", str(tmp_path / "launch_profiles.json"))
+    monkeypatch.setattr(jvm_tuning, "_java_versions", {"java": 17})
+    monkeypatch.setattr(consts, "config_instance", argparse.Namespace(
+        computer_info={"memory_total": 32, "cpu": 8}))
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    config = tmp_path / "config"
+    config.mkdir()
+    registry = ServerRegistry(str(config / "servers.json"), str(config / "servers.journal"),
+                              str(config / "servers.lock"))
+    monkeypatch.setattr(servers, "_registry", registry)
+    return registry
+
+
+def _add(registry, tmp_path, server_name, server_type="JE", max_players=None, players=None):
+    directory = tmp_path / server_name
+    directory.mkdir()
+    if max_players is not None:
+        (directory / "server.properties").write_text("max-players={}\n".format(max_players))
+    record = {"type": server_type, "directory": str(directory), "jar": "server.jar"}
+    if players is not None:
+        record["players"] = players
+    registry.add(server_name, record)
+    return registry.get(server_name)
+
+
+def _heap(command):
+    return int(next(flag for flag in command if flag.startswith("-Xmx"))[len("-Xmx"):-1])
+
+
+def test_ram_is_split_by_weight():
+    big = jvm_tuning.compute_launch_profile(16, 8, server_count=2, weight=3, total_weight=4)
+    small = jvm_tuning.compute_launch_profile(16, 8, server_count=2, weight=1, total_weight=4)
+    assert (big["heap_mb"], small["heap_mb"]) == (9216, 3072)
+    assert big["parallel_gc_threads"] == small["parallel_gc_threads"] == 4
+
+
+def test_zgc_needs_a_known_java_version(monkeypatch):
+    monkeypatch.setattr(jvm_tuning, "_heap_cap_mb", lambda: 64 * 1024)
+    assert jvm_tuning.compute_launch_profile(64, 16, java_version=17)["gc"] == "ZGC"
+    assert jvm_tuning.compute_launch_profile(64, 16, java_version=11)["gc"] == "G1"
+    assert jvm_tuning.compute_launch_profile(64, 16)["gc"] == "G1"
+
+
+@pytest.mark.parametrize("output, version", [
+    ('openjdk version "1.8.0_275"\nOpenJDK Runtime Environment', 8),
+    ('openjdk version "17.0.1" 2021-10-19\nOpenJDK Runtime Environment', 17),
+    ('Error: could not find java.dll', None)])
+def test_java_version(monkeypatch, output, version):
+    monkeypatch.setattr(subprocess, "run", lambda *args, **kwargs: SimpleNamespace(stdout=output.encode()))
+    assert jvm_tuning.java_version("/opt/java/bin/java") == version
+
+
+def test_missing_java():
+    assert jvm_tuning.java_version("/nonexistent/java") is None
+
+
+def test_bedrock_servers_share_the_ram(registry, tmp_path):
+    alone = _add(registry, tmp_path, "Survival", max_players=30)
+    heap_alone = _heap(jvm_tuning.managed_server("Survival", alone).command)
+    _add(registry, tmp_path, "Bedrock", "BE", max_players=10)
+    _add(registry, tmp_path, "Lobby", players=20)
+    heap_shared = _heap(jvm_tuning.managed_server("Survival", alone).command)
+    assert heap_shared < heap_alone
+    profile = jvm_tuning._load_profiles()["Survival"]
+    assert profile["inputs"]["server_count"] == 3
+    assert (profile["inputs"]["weight"], profile["inputs"]["total_weight"]) == (30, 60)
+    assert profile["inputs"]["java_version"] == 17
+    assert not [file for file in os.listdir(str(tmp_path)) if file.endswith(".tmp")]
+
+
+def test_profiles_are_updated_on_add_and_remove(registry, tmp_path):
+    supervisor_thread = SupervisorThread()
+    supervisor_thread.start()
+    supervisor = supervisor_thread.supervisor
+    try:
+        survival = _add(registry, tmp_path, "Survival")
+        supervisor_thread.call_function(supervisor.add_server, jvm_tuning.managed_server("Survival", survival))
+        heap_alone = _heap(supervisor.servers["Survival"].command)
+        creative = _add(registry, tmp_path, "Creative")
+        supervisor_thread.call_function(supervisor.add_server, jvm_tuning.managed_server("Creative", creative))
+        jvm_tuning.update_launch_profiles(supervisor_thread)
+        assert _heap(supervisor.servers["Survival"].command) < heap_alone
+        registry.remove("Creative")
+        supervisor_thread.call_function(supervisor.remove_server, "Creative")
+        jvm_tuning.update_launch_profiles(supervisor_thread)
+        assert _heap(supervisor.servers["Survival"].command) == heap_alone
+        assert list(jvm_tuning._load_profiles()) == ["Survival"]
+    finally:
+        supervisor_thread.stop()
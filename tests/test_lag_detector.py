@@ -0,0 +1,67 @@
+"""
+Tests of MCSH.lag_detector, fed by the console events of MCSH.console_events.
+"""
+import os
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+from MCSH import lag_detector
+from MCSH.console_events import EventIndex
+from MCSH.lag_detector import LagDetector
+from MCSH.supervisor import ManagedServer, Supervisor
+
+CANT_KEEP_UP = "[12:00:00] [Server thread/WARN]: Can't keep up! Is the server overloaded? " \
+               "Running 5000ms or 100 ticks behind"
+
+
+@pytest.fixture
+def java_server(tmp_path):
+    """
+    A supervised JE server: a sleeping process, with a fake jcmd next to its 'java'.
+    """
+    jcmd = tmp_path / "jcmd"
+    jcmd.write_text("#!/bin/sh\necho 'Full thread dump (fake)'\n")
+    jcmd.chmod(jcmd.stat().st_mode | stat.S_IXUSR)
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    server = ManagedServer("Test", "JE", [str(tmp_path / "java"), "-jar", "server.jar"])
+    server.pid = process.pid
+    supervisor = Supervisor()
+    supervisor.add_server(server)
+    yield supervisor
+    process.kill()
+    process.wait()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="The fake jcmd is a shell script.")
+def test_cant_keep_up_captures_report(tmp_path, monkeypatch, java_server):
+    report_path = tmp_path / "crash_report"
+    monkeypatch.setattr(lag_detector, "LAG_REPORT_PATH", str(report_path))
+    index = EventIndex(database=str(tmp_path / "events.db"))
+    detector = LagDetector(java_server)
+    index.event_listeners.append(detector.event_listener)
+    for i in range(lag_detector.LAG_TRIGGER_COUNT):
+        assert index.feed("Test", "JE", CANT_KEEP_UP)[1] == "lag"
+    deadline = time.time() + 30
+    while time.time() < deadline and ("Test" in detector.capturing or not report_path.exists()):
+        time.sleep(0.1)
+    reports = [name for name in os.listdir(str(report_path)) if name.startswith("LAG_Test_")]
+    assert len(reports) == 1
+    report = (report_path / reports[0]).read_text()
+    assert "Full thread dump (fake)" in report
+    assert "5000ms behind" in report
+    # The next warnings are within the cooldown: no second report
+    assert not detector.observe("Test", lag=5000)
+
+
+def test_lag_below_trigger_count_is_ignored(tmp_path, java_server):
+    index = EventIndex(database=str(tmp_path / "events.db"))
+    detector = LagDetector(java_server)
+    index.event_listeners.append(detector.event_listener)
+    for i in range(lag_detector.LAG_TRIGGER_COUNT - 1):
+        index.feed("Test", "JE", CANT_KEEP_UP)
+    assert not detector.capturing
+    assert not detector.last_capture
@@ -0,0 +1,80 @@
+import calendar
+import math
+import os
+import time
+
+import pytest
+
+from MCSH.metrics_store import MetricsStore
+
+# 2020-06-01 00:00:00 UTC
+DAY = calendar.timegm((2020, 6, 1, 0, 0, 0))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetricsStore(str(tmp_path / "metrics"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def kolkata():
+    # A time zone half an hour off the UTC hours
+    old_tz = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Kolkata"
+    time.tzset()
+    yield
+    if old_tz is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = old_tz
+    time.tzset()
+
+
+def test_round_trip(store):
+    store.append("Test", DAY + 10, cpu_percent=12.5, rss=1024, players=3)
+    store.append_sample("Test", (DAY + 11, 50.0, 2048, 40))
+    records = store.query("Test", DAY, DAY + 60)
+    assert [(record["time"], record["cpu_percent"], record["rss"]) for record in records] == [
+        (DAY + 10, 12.5, 1024), (DAY + 11, 50.0, 2048)]
+    assert records[0]["players"] == 3 and math.isnan(records[0]["threads"])
+    assert records[1]["threads"] == 40 and math.isnan(records[1]["players"])
+
+
+def test_range_query_across_days(store):
+    for second in range(-300, 300):
+        store.append("Test", DAY + second, cpu_percent=second)
+    assert len(os.listdir(os.path.join(store.path, "Test", "1s"))) == 2
+    records = store.query("Test", DAY - 5, DAY + 5)
+    assert [record["cpu_percent"] for record in records] == list(range(-5, 5))
+    assert store.query("Test", DAY + 300, DAY + 400) == []
+    assert len(store.query("Test", DAY - 1000, DAY + 1000)) == 600
+
+
+def test_downsampling(store):
+    for second in range(0, 7200, 10):
+        store.append("Test", DAY + second, cpu_percent=second % 60, tps=20)
+    # Without tps in the second hour: the average ignores the missing values
+    store.append("Test", DAY + 3605, cpu_percent=5)
+    store.close()
+    store.maintain(now=DAY + 3 * 86400)
+    minutes = store.query("Test", DAY, DAY + 86400, resolution="1m")
+    assert len(minutes) == 120
+    assert (minutes[0]["time"], minutes[0]["cpu_percent"], minutes[0]["tps"]) == (DAY, 25, 20)
+    assert minutes[60]["cpu_percent"] == 25 - 20 / 7
+    assert not os.listdir(os.path.join(store.path, "Test", "1s"))
+    store.maintain(now=DAY + 40 * 86400)
+    hours = store.query("Test", DAY, DAY + 86400)
+    assert [record["time"] for record in hours] == [DAY, DAY + 3600]
+    assert hours[0]["tps"] == 20
+
+
+def test_buckets_stay_in_their_day(store, kolkata):
+    # 23:30 UTC is 05:00 in Kolkata: the hour bucket (23:00 UTC) and its segment are the same day
+    timestamp = DAY - 1800
+    store.append("Test", timestamp, cpu_percent=1)
+    store.close()
+    store.maintain(now=DAY + 40 * 86400)
+    assert os.listdir(os.path.join(store.path, "Test", "1h")) == ["2020-05-31.bin"]
+    assert [record["time"] for record in store.query("Test", DAY - 3600, DAY)] == [DAY - 3600]
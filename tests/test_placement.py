@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from MCSH import placement
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repo_directory(monkeypatch):
+    # perf_recommend/ is read relative to the working directory, like mcsh_cli.py runs
+    monkeypatch.chdir(REPO_PATH)
+
+
+def _snapshot(host, cpu_freq, memory_total=32, cpu=8, benchmark=None):
+    return {
+        "version": placement.PROBE_FORMAT_VERSION,
+        "host": host,
+        "time": 0,
+        "computer_info": {"memory_total": memory_total, "cpu": cpu, "cpu_freq": cpu_freq},
+        "benchmark": benchmark,
+        "disk_free": 500
+    }
+
+
+def _write_plan(tmp_path, snapshots, servers):
+    for snapshot in snapshots:
+        (tmp_path / (snapshot["host"] + ".probe.json")).write_text(json.dumps(snapshot))
+    plan_file = tmp_path / "plan.json"
+    plan_file.write_text(json.dumps({"hosts": [snapshot["host"] + ".probe.json" for snapshot in snapshots],
+                                     "servers": servers}))
+    return str(plan_file)
+
+
+def test_cpu_freq_text():
+    assert placement._cpu_freq("2.3 GHz") == 2.3
+    assert placement._cpu_freq("2400 MHz") == 2.4
+    assert placement._cpu_freq(3.1) == 3.1
+    assert placement._cpu_freq("Unable to read") is None
+    assert placement._cpu_freq(None) is None
+
+
+def test_plan_with_macos_cpu_speed(tmp_path):
+    plan_file = _write_plan(tmp_path, [_snapshot("mac", "3.6 GHz"), _snapshot("unknown", "Unable to read")],
+                            [{"name": "Survival", "players": 20}])
+    servers, hosts = placement._load_plan(plan_file)
+    assert hosts["mac"]["computer_info"]["cpu_freq"] == 3.6
+    assert hosts["unknown"]["computer_info"]["cpu_freq"] is None
+    plan, explanations, free = placement.plan_placement(servers, hosts)
+    assert plan["Survival"] in hosts
+    # The CPU of the host with an unknown speed isn't planned
+    assert placement.host_capacity(hosts["unknown"])["CPUMulti"] is None
+
+
+def test_plan_rejects_slow_cores(tmp_path):
+    plan_file = _write_plan(tmp_path, [_snapshot("slow", "1.2 GHz")], [{"name": "Big", "players": 100}])
+    servers, hosts = placement._load_plan(plan_file)
+    plan, explanations, free = placement.plan_placement(servers, hosts)
+    assert plan["Big"] is None
+    assert "single-core speed" in explanations["Big"]
+
+
+def test_plan_command_doesnt_crash(tmp_path):
+    plan_file = _write_plan(tmp_path, [_snapshot("mac", "2.3 GHz")], [{"name": "Survival", "players": 10}])
+    placement.plan_command(plan_file)
+
+
+def test_uncalibrated_benchmark_is_not_a_cpu_speed(tmp_path):
+    # Results of an older MCSH: the CPU scores weren't calibrated
+    snapshot = _snapshot("host", 3.6, benchmark={"cpu_single": 0.59, "cpu_multi": 0.6, "disk_write": 400})
+    plan_file = _write_plan(tmp_path, [snapshot], [{"name": "Survival", "players": 20}])
+    servers, hosts = placement._load_plan(plan_file)
+    capacity = placement.host_capacity(hosts["host"])
+    assert capacity["CPUFreq"] == 3.6
+    assert capacity["DiskWrite"] == 400 * (1 - placement.PLACEMENT_HEADROOM)
+    assert placement.plan_placement(servers, hosts)[0]["Survival"] == "host"
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from MCSH import program_config
+from MCSH.consts import MCSH_version
+from MCSH.program_config import PROGRAM_CONFIG_SCHEMA_VERSION, ConfigError, ProgramConfig
+
+
+def _config(tmp_path, content):
+    file_name = tmp_path / "MCSH.json"
+    file_name.write_text(content if isinstance(content, str) else json.dumps(content))
+    return ProgramConfig(str(file_name))
+
+
+def test_migrate_schema_0(tmp_path):
+    # A file of the first MCSH versions: no schema version, and not every key
+    config = _config(tmp_path, {"version": "MCSH v0.0.1-Alpha", "custom": 1})
+    loaded = config.load()
+    assert loaded["schema_version"] == PROGRAM_CONFIG_SCHEMA_VERSION
+    assert loaded["version"] == MCSH_version
+    assert (loaded["color_enabled"], loaded["locale"], loaded["custom"]) == (False, "en_us", 1)
+    # Saved back, so the next load doesn't migrate it again
+    assert json.loads((tmp_path / "MCSH.json").read_text()) == loaded
+    assert ProgramConfig(str(tmp_path / "MCSH.json"))._migrate(dict(loaded)) is False
+
+
+def test_newer_schema_is_not_migrated(tmp_path):
+    config = _config(tmp_path, {"schema_version": PROGRAM_CONFIG_SCHEMA_VERSION + 1, "future": True})
+    assert config.load()["schema_version"] == PROGRAM_CONFIG_SCHEMA_VERSION + 1
+    assert "future" in json.loads((tmp_path / "MCSH.json").read_text())
+
+
+@pytest.mark.parametrize("key, value", [("color_enabled", "yes"), ("color_enabled", 1), ("locale", None),
+                                        ("schema_version", True)])
+def test_invalid_values_are_rejected(tmp_path, monkeypatch, key, value):
+    warnings = []
+    monkeypatch.setattr(program_config, "log", lambda module, level, text, *args: warnings.append(level))
+    content = {"schema_version": PROGRAM_CONFIG_SCHEMA_VERSION, "version": MCSH_version,
+               "color_enabled": True, "locale": "zh_cn"}
+    content[key] = value
+    loaded = _config(tmp_path, content).load()
+    assert loaded[key] == program_config.PROGRAM_CONFIG_SCHEMA[key][1]
+    assert warnings == ["WARNING"]
+    # The other values are kept
+    assert all([loaded[other] == content[other] for other in content if other != key])
+
+
+@pytest.mark.parametrize("content", ["{not json", "[1, 2]"])
+def test_corrupted_file(tmp_path, content):
+    config = _config(tmp_path, content)
+    with pytest.raises(ConfigError):
+        config.load()
+    assert config.get("locale", "default") == "default"
+
+
+def test_reload_tells_the_listeners(tmp_path):
+    config = _config(tmp_path, {"schema_version": PROGRAM_CONFIG_SCHEMA_VERSION, "color_enabled": False})
+    first = config.load()
+    assert config.load() is first
+    changes = []
+    config.change_listeners.append(lambda old, new: changes.append((old["color_enabled"], new["color_enabled"])))
+    (tmp_path / "MCSH.json").write_text(json.dumps({"schema_version": PROGRAM_CONFIG_SCHEMA_VERSION,
+                                                    "color_enabled": True, "padding": "changes the size"}))
+    config.reload()
+    # A broken edit keeps the current config
+    (tmp_path / "MCSH.json").write_text("{")
+    config.reload()
+    assert changes == [(False, True)]
+    assert config.config["color_enabled"] is True
@@ -0,0 +1,144 @@
+"""
+Tests of MCSH.prune on synthetic region files.
+"""
+import argparse
+import os
+import zlib
+
+import pytest
+
+from MCSH import consts, prune, servers
+from MCSH.region import (COMPRESSION_EXTERNAL, COMPRESSION_ZLIB, HEADER_SIZE, SECTOR_SIZE, read_chunk,
+                         read_locations, read_timestamps)
+from MCSH.servers import ServerRegistry
+
+
+def _chunk_nbt(inhabited_time, padding=0):
+    return b"\x0a\x00\x00" + prune.INHABITED_TIME_TAG + inhabited_time.to_bytes(8, "big", signed=True) + \
+        os.urandom(padding) + b"\x00"
+
+
+def write_region(file_name, chunks):
+    """
+    Write a region file. chunks: index -> (NBT, timestamp), or (None, timestamp) for an external chunk.
+    Chunks are written in reverse order, with a free sector between them.
+    """
+    locations = bytearray(SECTOR_SIZE)
+    timestamps = bytearray(SECTOR_SIZE)
+    body = b""
+    sector = HEADER_SIZE // SECTOR_SIZE
+    for index, (nbt, timestamp) in sorted(chunks.items(), reverse=True):
+        if nbt is None:
+            chunk = (1).to_bytes(4, "big") + bytes([COMPRESSION_ZLIB | COMPRESSION_EXTERNAL])
+        else:
+            data = zlib.compress(nbt)
+            chunk = (len(data) + 1).to_bytes(4, "big") + bytes([COMPRESSION_ZLIB]) + data
+        sectors = (len(chunk) + SECTOR_SIZE - 1) // SECTOR_SIZE
+        locations[index * 4:index * 4 + 4] = ((sector << 8) | sectors).to_bytes(4, "big")
+        timestamps[index * 4:index * 4 + 4] = timestamp.to_bytes(4, "big")
+        body += chunk + bytes(sectors * SECTOR_SIZE - len(chunk)) + bytes(SECTOR_SIZE)
+        sector += sectors + 1
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, "wb") as f:
+        f.write(bytes(locations) + bytes(timestamps) + body)
+
+
+def _read(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def test_compact_region(tmp_path):
+    file_name = str(tmp_path / "region" / "r.0.0.mca")
+    nbts = {0: _chunk_nbt(100), 1: _chunk_nbt(200, padding=6000), 33: _chunk_nbt(300), 1023: _chunk_nbt(400)}
+    write_region(file_name, {index: (nbt, 1000 + index) for index, nbt in nbts.items()})
+    size_before, size_after = prune.compact_region(file_name, removed={33})
+    data = _read(file_name)
+    assert (size_before, size_after) == (HEADER_SIZE + 9 * SECTOR_SIZE, len(data))
+    locations = sorted(read_locations(data), key=lambda location: location[1])
+    # No gaps: the kept chunks follow each other from the header on, in their order in the file
+    assert [index for index, offset, length in locations] == [1023, 1, 0]
+    assert [(offset, length) for index, offset, length in locations] == [
+        (HEADER_SIZE, SECTOR_SIZE), (HEADER_SIZE + SECTOR_SIZE, 2 * SECTOR_SIZE),
+        (HEADER_SIZE + 3 * SECTOR_SIZE, SECTOR_SIZE)]
+    assert len(data) == HEADER_SIZE + 4 * SECTOR_SIZE
+    timestamps = read_timestamps(data)
+    for index, offset, length in locations:
+        compression, chunk_data = read_chunk(data, offset)
+        assert zlib.decompress(chunk_data) == nbts[index]
+        assert timestamps[index] == 1000 + index
+    assert timestamps[33] == 0
+
+
+def test_compact_region_removes_everything(tmp_path):
+    file_name = str(tmp_path / "region" / "r.0.0.mca")
+    write_region(file_name, {5: (_chunk_nbt(0), 1)})
+    assert prune.compact_region(file_name, removed={5})[1] == 0
+    assert not os.path.exists(file_name)
+
+
+def test_prune_by_inhabited_time(tmp_path):
+    region = tmp_path / "world" / "region"
+    write_region(str(region / "r.0.0.mca"), {0: (_chunk_nbt(10), 1), 1: (_chunk_nbt(5000), 1), 2: (None, 1)})
+    # The external chunk can't be read: it's kept, like its .mcc file
+    (region / "c.2.0.mcc").write_bytes(zlib.compress(_chunk_nbt(0)))
+    write_region(str(tmp_path / "world" / "entities" / "r.0.0.mca"), {0: (b"entities", 1), 1: (b"entities", 1)})
+    removed, size_before, size_after = prune.prune_region(str(region / "r.0.0.mca"), min_inhabited_time=1200)
+    assert removed == 1
+    assert sorted([index for index, offset, length in read_locations(_read(str(region / "r.0.0.mca")))]) == [1, 2]
+    assert [index for index, offset, length in
+            read_locations(_read(str(tmp_path / "world" / "entities" / "r.0.0.mca")))] == [1]
+    assert (region / "c.2.0.mcc").exists()
+
+
+def test_prune_by_keep_radius(tmp_path):
+    region = tmp_path / "world" / "region"
+    # Chunks (0, 0), (2, 0), (5, 3) and (-1, -1) in two regions
+    write_region(str(region / "r.0.0.mca"), {0: (_chunk_nbt(0), 1), 2: (_chunk_nbt(0), 1),
+                                             3 * 32 + 5: (None, 1)})
+    write_region(str(region / "r.-1.-1.mca"), {1023: (_chunk_nbt(0), 1)})
+    (region / "c.5.3.mcc").write_bytes(b"external")
+    assert prune.prune_region(str(region / "r.0.0.mca"), keep_radius=2, spawn=(0, 0))[0] == 1
+    assert prune.prune_region(str(region / "r.-1.-1.mca"), keep_radius=2, spawn=(0, 0))[0] == 0
+    assert sorted([index for index, offset, length in read_locations(_read(str(region / "r.0.0.mca")))]) == [0, 2]
+    # The external chunk file of the removed chunk is gone too
+    assert not (region / "c.5.3.mcc").exists()
+
+
+def test_dry_run_changes_nothing(tmp_path):
+    file_name = str(tmp_path / "world" / "region" / "r.0.0.mca")
+    write_region(file_name, {0: (_chunk_nbt(0), 1), 1: (_chunk_nbt(5000), 1)})
+    before = _read(file_name)
+    removed, size_before, size_after = prune.prune_region(file_name, min_inhabited_time=1200, dry_run=True)
+    assert removed == 1 and size_after < size_before
+    assert _read(file_name) == before
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    config = tmp_path / "config"
+    config.mkdir()
+    registry = ServerRegistry(str(config / "servers.json"), str(config / "servers.journal"),
+                              str(config / "servers.lock"))
+    monkeypatch.setattr(servers, "_registry", registry)
+    return registry
+
+
+@pytest.fixture
+def parser_args(monkeypatch):
+    parser_args = argparse.Namespace(dry_run=False, inhabited_time=1200, keep_radius=None)
+    monkeypatch.setattr(consts, "config_instance", argparse.Namespace(parser_args=parser_args))
+    return parser_args
+
+
+@pytest.mark.parametrize("by_name", [True, False])
+def test_refuses_worlds_of_running_servers(tmp_path, registry, parser_args, by_name):
+    file_name = str(tmp_path / "Test" / "world" / "region" / "r.0.0.mca")
+    write_region(file_name, {0: (_chunk_nbt(0), 1), 1: (_chunk_nbt(5000), 1)})
+    registry.add("Test", {"type": "JE", "directory": str(tmp_path / "Test"), "state": "RUNNING"})
+    before = _read(file_name)
+    prune.prune_command("Test" if by_name else str(tmp_path / "Test" / "world"))
+    assert _read(file_name) == before
+    registry.update("Test", state="STOPPED")
+    prune.prune_command("Test" if by_name else str(tmp_path / "Test" / "world"))
+    assert len(read_locations(_read(file_name))) == 1
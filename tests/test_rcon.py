@@ -0,0 +1,138 @@
+"""
+Tests of MCSH.rcon against a fake asyncio RCON server.
+"""
+import asyncio
+
+import pytest
+
+from MCSH.rcon import (RCON_FRAGMENT_SIZE, TYPE_AUTH_RESPONSE, TYPE_COMMAND, TYPE_LOGIN, TYPE_RESPONSE,
+                       RconConnection, RconError, RconPool, encode_packet, read_packet)
+
+PASSWORD = "secret"
+LONG_RESPONSE = "".join([chr(ord("a") + i % 26) for i in range(RCON_FRAGMENT_SIZE * 2 + 100)])
+
+
+class FakeRconServer:
+    """
+    Answers "echo <text>" with the text, "long" with LONG_RESPONSE in fragments,
+    and "full" with exactly one full fragment.
+    """
+
+    def __init__(self, password=PASSWORD):
+        self.password = password
+        self.commands = []
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_id, packet_type, body = await read_packet(reader)
+            assert packet_type == TYPE_LOGIN
+            # Like the vanilla server: an empty response first, then the login result
+            writer.write(encode_packet(request_id, TYPE_RESPONSE, ""))
+            writer.write(encode_packet(request_id if body == self.password else -1, TYPE_AUTH_RESPONSE, ""))
+            await writer.drain()
+            while True:
+                request_id, packet_type, body = await read_packet(reader)
+                assert packet_type == TYPE_COMMAND
+                self.commands.append(body)
+                # A stray response (e.g. of a command that timed out) is ignored by the client
+                writer.write(encode_packet(request_id + 1000, TYPE_RESPONSE, "stray"))
+                if body == "long":
+                    fragments = [LONG_RESPONSE[i:i + RCON_FRAGMENT_SIZE]
+                                 for i in range(0, len(LONG_RESPONSE), RCON_FRAGMENT_SIZE)]
+                elif body == "full":
+                    fragments = ["x" * RCON_FRAGMENT_SIZE]
+                else:
+                    fragments = [body[len("echo "):]]
+                for fragment in fragments:
+                    writer.write(encode_packet(request_id, TYPE_RESPONSE, fragment))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_responses_are_matched_by_request_id():
+    async def run():
+        server = await FakeRconServer().start()
+        connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=5, pipeline_depth=4)
+        await connection.connect()
+        try:
+            return await connection.run_batch(["echo {}".format(i) for i in range(10)])
+        finally:
+            connection.close()
+            await server.stop()
+
+    assert _run(run()) == [str(i) for i in range(10)]
+
+
+def test_fragments_are_reassembled():
+    async def run():
+        server = await FakeRconServer().start()
+        connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=5)
+        await connection.connect()
+        try:
+            return await connection.run_batch(["long", "full", "echo done"])
+        finally:
+            connection.close()
+            await server.stop()
+
+    long_response, full_response, done = _run(run())
+    assert long_response == LONG_RESPONSE
+    # A full fragment with nothing after it ends when no other fragment comes
+    assert full_response == "x" * RCON_FRAGMENT_SIZE
+    assert done == "done"
+
+
+def test_refused_login():
+    async def run():
+        server = await FakeRconServer().start()
+        connection = RconConnection("127.0.0.1", server.port, "wrong", timeout=5)
+        try:
+            with pytest.raises(RconError):
+                await connection.connect()
+            assert not connection.connected
+        finally:
+            await server.stop()
+
+    _run(run())
+
+
+def test_broadcast_fans_out():
+    async def run():
+        servers = [await FakeRconServer().start() for i in range(3)]
+        refusing = await FakeRconServer(password="other").start()
+        pool = RconPool(timeout=5)
+        for i, server in enumerate(servers):
+            pool.add("Server{}".format(i), "127.0.0.1", server.port, PASSWORD)
+        pool.add("Refusing", "127.0.0.1", refusing.port, PASSWORD)
+        try:
+            return (await pool.broadcast("echo hello", ["Server0", "Server1", "Server2", "Refusing"]),
+                    await pool.broadcast(["echo a", "echo b"], ["Server0", "Server1"]),
+                    [server.commands for server in servers])
+        finally:
+            pool.close()
+            for server in servers + [refusing]:
+                await server.stop()
+
+    results, batch_results, commands = _run(run())
+    assert [results["Server{}".format(i)] for i in range(3)] == ["hello"] * 3
+    assert isinstance(results["Refusing"], RconError)
+    assert batch_results == {"Server0": ["a", "b"], "Server1": ["a", "b"]}
+    # One connection per server, reused by the second broadcast
+    assert commands == [["echo hello", "echo a", "echo b"]] * 2 + [["echo hello"]]
@@ -0,0 +1,103 @@
+import email.message
+import io
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from MCSH import repository
+from MCSH.repository import REPOSITORY_SOURCES, RepositoryIndex
+
+PAPER_URL = REPOSITORY_SOURCES["paper"]
+PAPER_VERSION_URL = PAPER_URL + "/versions/1.16.5"
+VANILLA_MANIFEST = {"versions": [
+    {"id": "1.16.5", "type": "release", "releaseTime": "2021-01-14", "url": "https://example.com/1.16.5.json"},
+    {"id": "21w03a", "type": "snapshot", "releaseTime": "2021-01-20", "url": "https://example.com/21w03a.json"}]}
+BEDROCK_LINKS = {"result": {"links": [
+    {"downloadType": "serverBedrockLinux", "downloadUrl": "https://example.com/bedrock-server-1.16.201.02.zip"},
+    {"downloadType": "serverBedrockWindows", "downloadUrl": "https://example.com/bedrock-server-1.16.201.02.zip"}]}}
+
+
+class FakeSources:
+    """
+    Answers the requests of the repository like the sources do, with ETags.
+    """
+
+    def __init__(self):
+        self.bodies = {REPOSITORY_SOURCES["vanilla"]: VANILLA_MANIFEST, PAPER_URL: {"versions": ["1.16.4", "1.16.5"]},
+                       REPOSITORY_SOURCES["bedrock"]: BEDROCK_LINKS, PAPER_VERSION_URL: {"builds": [400, 401]}}
+        self.requests = []
+        self.offline = False
+
+    def urlopen(self, request, timeout=None):
+        url = request.full_url
+        self.requests.append((url, request.get_header("If-none-match")))
+        if self.offline:
+            raise urllib.error.URLError("Network is unreachable")
+        body = json.dumps(self.bodies[url]).encode()
+        etag = '"{}"'.format(hash(body))
+        headers = email.message.Message()
+        if request.get_header("If-none-match") == etag:
+            raise urllib.error.HTTPError(url, 304, "Not Modified", headers, None)
+        headers["ETag"] = etag
+        return urllib.request.addinfourl(io.BytesIO(body), headers, url, 200)
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    sources = FakeSources()
+    monkeypatch.setattr(urllib.request, "urlopen", sources.urlopen)
+    return sources
+
+
+def _index(tmp_path):
+    return RepositoryIndex(str(tmp_path / "repository.idx"), str(tmp_path / "repository_state.json"))
+
+
+def test_search(tmp_path, sources):
+    index = _index(tmp_path)
+    index.refresh()
+    names = lambda query: [entry["name"] for entry in index.search(query)]
+    assert names("paper") == ["paper-1.16.4", "paper-1.16.5"]
+    # Every term must match, and a term matches the tokens it prefixes
+    assert names("pap 1.16.5") == ["paper-1.16.5"]
+    assert names("1.16") == ["bedrock-1.16.201.02", "paper-1.16.4", "paper-1.16.5", "vanilla-1.16.5"]
+    assert names("vanilla snap") == ["vanilla-21w03a"]
+    assert names("be") == ["bedrock-1.16.201.02"]
+    assert names("paper 1.15") == []
+    assert index.get("paper-1.16.5")["build"] == 401
+    assert index.get("vanilla-1.16.5")["build"] is None
+
+
+def test_unchanged_sources_are_not_downloaded_again(tmp_path, sources, monkeypatch):
+    assert _index(tmp_path).refresh()
+    index = _index(tmp_path)
+    assert len(index.entries) == 5
+    sources.requests.clear()
+    saved = []
+    monkeypatch.setattr(RepositoryIndex, "save", lambda self: saved.append(True))
+    # Checked recently: nothing is requested
+    assert not index.refresh()
+    assert sources.requests == []
+    # Every source answers 304: the index isn't saved
+    assert not index.refresh(force=True)
+    assert all([etag is not None for url, etag in sources.requests if url != PAPER_VERSION_URL])
+    assert saved == []
+    # A new Paper build of the same version
+    sources.bodies[PAPER_VERSION_URL] = {"builds": [400, 401, 402]}
+    assert index.refresh(force=True)
+    assert saved == [True]
+    assert index.get("paper-1.16.5")["build"] == 402
+
+
+def test_failed_refresh_is_rate_limited(tmp_path, sources):
+    sources.offline = True
+    index = _index(tmp_path)
+    assert not index.refresh()
+    # No connection: the other sources aren't tried (each would wait for its timeout)
+    assert len(sources.requests) == 1
+    index = _index(tmp_path)
+    assert not index.refresh()
+    assert len(sources.requests) == 1
+    assert index.entries == []
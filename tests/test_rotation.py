@@ -0,0 +1,91 @@
+import gzip
+import os
+import tarfile
+import time
+
+from MCSH import logging
+from MCSH.rotation import Rotator
+
+
+def _segment(directory, name, text, mtime):
+    segment = directory / name
+    segment.write_text(text)
+    os.utime(str(segment), (mtime, mtime))
+    return str(segment)
+
+
+def _archived(rotator):
+    members = {}
+    for archive in sorted(os.listdir(rotator.archive_directory)):
+        if archive.endswith(".tar"):
+            with tarfile.open(os.path.join(rotator.archive_directory, archive)) as tar:
+                for member in tar.getmembers():
+                    members[(archive, member.name)] = gzip.decompress(tar.extractfile(member).read()).decode()
+    return members
+
+
+def test_should_rotate():
+    rotator = Rotator("unused", max_bytes=100)
+    assert not rotator.should_rotate(99, time.time())
+    assert rotator.should_rotate(100, time.time())
+    assert rotator.should_rotate(0, time.time() - 86400)
+    assert not Rotator("unused", max_bytes=0, rotate_daily=False).should_rotate(10 ** 9, 0)
+
+
+def test_archive_old_keeps_the_newest(tmp_path):
+    rotator = Rotator(str(tmp_path))
+    january = time.mktime((2020, 1, 15, 12, 0, 0, 0, 0, -1))
+    february = time.mktime((2020, 2, 15, 12, 0, 0, 0, 0, -1))
+    _segment(tmp_path, "a.log", "first", january)
+    _segment(tmp_path, "b.log", "second", february)
+    _segment(tmp_path, "c.log", "third", february + 60)
+    _segment(tmp_path, "d.log", "fourth", february + 120)
+    rotator.archive_old(keep=1, exclude=[str(tmp_path / "c.log")])
+    rotator.wait()
+    assert sorted([file for file in os.listdir(str(tmp_path)) if file.endswith(".log")]) == ["c.log", "d.log"]
+    assert _archived(rotator) == {("2020-01.tar", "a.log.gz"): "first", ("2020-02.tar", "b.log.gz"): "second"}
+
+
+def test_segments_being_written_are_not_archived(tmp_path):
+    rotator = Rotator(str(tmp_path))
+    segment = _segment(tmp_path, "running.log", "still written", time.time() - 3600)
+    # Another process (here: another open file) writes the segment
+    with open(segment, "a") as f:
+        Rotator(str(tmp_path)).hold(f)
+        rotator.archive([segment], wait=True)
+        assert os.path.exists(segment)
+    rotator.archive([segment], wait=True)
+    assert not os.path.exists(segment)
+    assert list(_archived(rotator).values()) == ["still written"]
+
+
+def test_retention(tmp_path):
+    rotator = Rotator(str(tmp_path), retention_bytes=25 * 1024)
+    for month in range(1, 5):
+        mtime = time.mktime((2020, month, 15, 12, 0, 0, 0, 0, -1))
+        (tmp_path / "{}.log".format(month)).write_bytes(os.urandom(10 * 1024))
+        os.utime(str(tmp_path / "{}.log".format(month)), (mtime, mtime))
+    rotator.archive_old()
+    rotator.wait()
+    # About 20 KB per archive: only the newest one fits, and it's always kept
+    assert sorted([file for file in os.listdir(rotator.archive_directory) if file.endswith(".tar")]) == \
+        ["2020-04.tar"]
+
+
+def test_log_writer_batches_and_rotates(tmp_path):
+    rotator = Rotator(str(tmp_path), max_bytes=1000)
+    segment = rotator.new_segment_name()
+    writer = logging._LogWriter(segment, rotator)
+    writer.start()
+    lines = ["line {:04}\n".format(i) for i in range(500)]
+    for line in lines:
+        writer.write(line)
+    writer.flush()
+    assert writer.file_name != segment
+    writer.stop()
+    rotator.wait()
+    written = "".join([value for key, value in sorted(_archived(rotator).items())])
+    for file in sorted(os.listdir(str(tmp_path)), key=lambda file: os.path.getmtime(str(tmp_path / file))):
+        if file.endswith(".log"):
+            written += (tmp_path / file).read_text()
+    assert sorted(written.splitlines(True)) == lines
@@ -0,0 +1,31 @@
+from MCSH.server_properties import merge_properties, read_properties, set_properties
+
+TEMPLATE = """# Used as the server name
+server-name=Dedicated Server
+
+# Allowed values: "survival", "creative", or "adventure"
+gamemode=survival
+"""
+
+
+def test_merge_into_a_missing_file(tmp_path):
+    file_name = str(tmp_path / "server.properties")
+    assert merge_properties(file_name, TEMPLATE) == ["server-name", "gamemode"]
+    assert read_properties(file_name) == {"server-name": "Dedicated Server", "gamemode": "survival"}
+
+
+def test_merge_keeps_the_values_and_layout(tmp_path):
+    properties = tmp_path / "server.properties"
+    properties.write_text("# My server\ngamemode = creative\nlevel-name:My World\n")
+    assert merge_properties(str(properties), TEMPLATE) == ["server-name"]
+    assert properties.read_text() == "# My server\ngamemode = creative\nlevel-name:My World\n" \
+                                     "# Used as the server name\nserver-name=Dedicated Server\n"
+    assert merge_properties(str(properties), TEMPLATE) == []
+
+
+def test_set_properties(tmp_path):
+    properties = tmp_path / "server.properties"
+    properties.write_text("! Comment\nserver-port=19132\nmax-players=10\n")
+    set_properties(str(properties), {"server-port": 19134, "server-portv6": 19135})
+    assert properties.read_text() == "! Comment\nserver-port=19134\nmax-players=10\nserver-portv6=19135\n"
+    assert read_properties(str(tmp_path / "missing.properties")) == {}
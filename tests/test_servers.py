@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from MCSH import servers
+from MCSH.servers import ServerRegistry
+
+
+def _registry(config):
+    return ServerRegistry(str(config / "servers.json"), str(config / "servers.journal"), str(config / "servers.lock"))
+
+
+def _record(version="1.16.5", **fields):
+    return dict({"type": "JE", "flavour": "vanilla", "version": version, "directory": "/srv/x"}, **fields)
+
+
+def test_snapshot_and_journal_replay(tmp_path):
+    registry = _registry(tmp_path)
+    registry.add("Survival", _record())
+    registry.add("Creative", _record())
+    registry.compact()
+    registry.update("Survival", version="1.17", state="RUNNING")
+    registry.remove("Creative")
+    registry.add("Lobby", _record(type="BE"))
+    # Another process: the snapshot, then the journal since
+    other = _registry(tmp_path)
+    assert other.names() == ["Lobby", "Survival"]
+    assert other.get("Survival")["version"] == "1.17"
+    assert other.find(state="RUNNING") == ["Survival"]
+    assert other.find(type="JE", state="STOPPED") == []
+    assert other.find(type="BE") == ["Lobby"]
+    # And it sees the changes made after it loaded
+    registry.update("Lobby", state="RUNNING")
+    assert other.find(state="RUNNING") == ["Lobby", "Survival"]
+
+
+def test_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(servers, "SERVERS_COMPACT_ENTRIES", 10)
+    registry = _registry(tmp_path)
+    registry.add("Test", _record())
+    for i in range(25):
+        registry.update("Test", restarts=i)
+    # Folded twice into the snapshot: only the entries since are in the journal
+    assert len((tmp_path / "servers.journal").read_bytes().splitlines()) == 6
+    snapshot = json.loads((tmp_path / "servers.json").read_text())
+    assert snapshot["sequence"] == 20 and snapshot["servers"]["Test"]["restarts"] == 18
+    assert _registry(tmp_path).get("Test")["restarts"] == 24
+
+
+def test_journal_entries_in_the_snapshot_are_skipped(tmp_path):
+    registry = _registry(tmp_path)
+    registry.add("Test", _record())
+    registry.update("Test", version="1.17")
+    journal = (tmp_path / "servers.journal").read_bytes()
+    registry.compact()
+    # A crash between writing the snapshot and emptying the journal
+    (tmp_path / "servers.journal").write_bytes(journal)
+    other = _registry(tmp_path)
+    assert other.get("Test")["version"] == "1.17"
+    other.update("Test", version="1.18")
+    assert _registry(tmp_path).get("Test")["version"] == "1.18"
+
+
+def test_legacy_registry(tmp_path):
+    (tmp_path / "servers.json").write_text(json.dumps({"Old": _record()}))
+    registry = _registry(tmp_path)
+    assert registry.get("Old")["state"] == servers.DEFAULT_STATE
+    assert registry.find(state=servers.DEFAULT_STATE) == ["Old"]
+    registry.update("Old", version="1.17")
+    registry.compact()
+    snapshot = json.loads((tmp_path / "servers.json").read_text())
+    assert snapshot["version"] == servers.SERVERS_FORMAT_VERSION
+    assert snapshot["servers"]["Old"]["version"] == "1.17"
+
+
+def test_torn_journal_line(tmp_path):
+    registry = _registry(tmp_path)
+    registry.add("Test", _record())
+    # A write that didn't finish
+    with open(str(tmp_path / "servers.journal"), "ab") as f:
+        f.write(b'{"sequence": 2, "operation": "put", "name": "Te')
+    other = _registry(tmp_path)
+    assert other.names() == ["Test"]
+    # The next change overwrites it
+    other.update("Test", version="1.17")
+    assert _registry(tmp_path).get("Test")["version"] == "1.17"
+    assert all([json.loads(line) for line in (tmp_path / "servers.journal").read_bytes().splitlines()])
+
+
+def test_records_are_copies(tmp_path):
+    registry = _registry(tmp_path)
+    registry.add("Test", _record())
+    registry.get("Test")["version"] = "changed"
+    registry.update("Test", players=10)["version"] = "changed"
+    [record for name, record in registry.items()][0]["version"] = "changed"
+    removed = registry.remove("Test")
+    removed["version"] = "changed"
+    assert removed["players"] == 10
+    registry.add("Test", _record())
+    assert registry.get("Test")["version"] == "1.16.5"
+    with pytest.raises(KeyError):
+        registry.remove("Missing")
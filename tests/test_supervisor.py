@@ -0,0 +1,51 @@
+"""
+Tests of the restart policy of MCSH.supervisor.
+"""
+import asyncio
+import sys
+
+from MCSH import supervisor
+from MCSH.supervisor import STATE_CRASHED, ManagedServer, Supervisor
+
+
+def _crashing_server(run_time):
+    return ManagedServer("Test", "JE", [sys.executable, "-c", "import time; time.sleep({}); exit(1)".format(run_time)],
+                         max_restarts=1)
+
+
+def _run(server, crashes):
+    """
+    Run the server until it crashed the given number of times (or gave up).
+    """
+    crashed = []
+
+    async def run():
+        test_supervisor = Supervisor()
+        test_supervisor.state_listeners.append(
+            lambda server, old_state, new_state: crashed.append(new_state) if new_state == STATE_CRASHED else None)
+        test_supervisor.add_server(server)
+        await test_supervisor.start(server.name)
+        while len(crashed) < crashes and server.wanted_running:
+            await asyncio.sleep(0.05)
+        server.wanted_running = False
+        await test_supervisor.stop(server.name, timeout=5)
+
+    asyncio.run(run())
+    return len(crashed)
+
+
+def test_gives_up_after_max_restarts(monkeypatch):
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF_MIN", 0.01)
+    server = _crashing_server(0)
+    # The first run, and one restart
+    assert _run(server, 5) == 2
+    assert not server.wanted_running
+
+
+def test_stable_runs_reset_the_restart_count(monkeypatch):
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF_MIN", 0.01)
+    monkeypatch.setattr(supervisor, "RESTART_STABLE_TIME", 0.2)
+    server = _crashing_server(0.3)
+    # Every crash comes after a stable run: max_restarts is never reached
+    assert _run(server, 4) == 4
+    assert server.restart_count <= 1